@@ -0,0 +1,94 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+    This module measures the cost of the board handling done by make_move
+    (Game.get_board() plus Game.push_move()) at every ply of a long game
+    and compares it with replaying the whole game from SAN.
+    Run it from the project directory: python3 -m benchmarks.board_snapshot
+    Redis isn't needed, games are never saved.
+"""
+
+
+from random import Random
+from time import perf_counter
+from chess import Board
+from hydraChess.models import Game
+
+
+PLIES = 300
+BUCKET_SIZE = 25
+REPEATS = 20
+
+
+def gen_game(plies: int) -> list:
+    """Returns SAN moves of a random game which lasts at least plies"""
+    seed = 0
+    while True:
+        rand = Random(seed)
+        board = Board()
+        moves = list()
+        while len(moves) < plies and not board.is_game_over():
+            move = rand.choice(list(board.legal_moves))
+            moves.append(board.san(move))
+            board.push(move)
+        if len(moves) == plies:
+            return moves
+        seed += 1
+
+
+def replay(moves: list) -> Board:
+    board = Board()
+    for move in moves:
+        board.push_san(move)
+    return board
+
+
+def run():
+    moves = gen_game(PLIES)
+
+    snapshot_times = list()
+    replay_times = list()
+    tail_lengths = list()
+
+    game = Game()
+    for ply, move in enumerate(moves):
+        start = perf_counter()
+        for _ in range(REPEATS):
+            board = game.get_board()
+        snapshot_times.append((perf_counter() - start) / REPEATS)
+        game.push_move(board, move)
+
+        start = perf_counter()
+        for _ in range(REPEATS):
+            replay(moves[:ply])
+        replay_times.append((perf_counter() - start) / REPEATS)
+
+        tail_lengths.append(game.get_moves_cnt() - game.root_ply)
+
+    print(f"{'plies':>10} {'snapshot, us':>14} {'replay, us':>12} "
+          f"{'max tail':>9}")
+    for start in range(0, PLIES, BUCKET_SIZE):
+        end = start + BUCKET_SIZE
+        snapshot = sum(snapshot_times[start:end]) / BUCKET_SIZE * 10 ** 6
+        full = sum(replay_times[start:end]) / BUCKET_SIZE * 10 ** 6
+        print(f"{start + 1:>4}-{end:<5} {snapshot:>14.1f} {full:>12.1f} "
+              f"{max(tail_lengths[start:end]):>9}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,124 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+    This module measures the Socket.IO message queue traffic of games:
+    messages published by the tasks, which every web process has to
+    receive and deserialize. Games are played with eager tasks.
+    Run it from the project directory: python3 -m benchmarks.fanout
+    Redis must be running, the testing database is used by default.
+"""
+
+
+from argparse import ArgumentParser
+from collections import Counter
+from datetime import timedelta
+import pickle
+import redis
+import rom.util
+from hydraChess import game_management, identity_map
+from hydraChess.models import User, Game
+from hydraChess.config import TestingConfig
+from benchmarks.board_snapshot import gen_game
+
+
+CHANNEL = 'flask-socketio'  # Channel of flask_socketio.RedisManager
+PLIES = 60
+
+
+def play(user_ids, plies: int) -> int:
+    '''Plays a game, which is resigned after the given number of plies'''
+    white_user, black_user = User.get(user_ids)
+    game = Game(white_user=white_user, black_user=black_user,
+                white_rating=white_user.rating,
+                black_rating=black_user.rating)
+    game.total_clock = timedelta(minutes=5)
+    game.white_clock = game.black_clock = game.total_clock
+    game.save()
+    game_id = game.id
+
+    game_management.start_game.apply((game_id, ))
+    for ply, move in enumerate(gen_game(plies)):
+        user_id = user_ids[ply % 2]
+        game_management.make_move.apply((user_id, game_id, move))
+        if ply == plies // 2:
+            # The player to move reloads the game page
+            user_id = user_ids[(ply + 1) % 2]
+            game_management.on_disconnect.apply((user_id, game_id))
+            game_management.on_reconnect.apply((user_id, game_id))
+    game_management.resign.apply((user_ids[0], game_id))
+    return game_id
+
+
+def run(db: int, games: int):
+    identity_map.set_connection_settings(db=db)
+    game_management.celery.conf.task_always_eager = True
+
+    socket_io_url = game_management.app.config['SOCKET_IO_URL']
+    pubsub = redis.Redis.from_url(socket_io_url).pubsub()
+    pubsub.subscribe(CHANNEL)
+    pubsub.get_message(timeout=1)  # Subscription confirmation
+
+    users = [User(login=f'fanout_{i}', sid=f'fanout_{i}') for i in range(2)]
+    for user in users:
+        user.save()
+    user_ids = [user.id for user in users]
+
+    game_ids = list()
+    for _ in range(games):
+        with identity_map.scope():
+            game_ids.append(play(user_ids, PLIES))
+
+    messages = Counter()
+    traffic = Counter()
+    events = 0
+    while True:
+        message = pubsub.get_message(timeout=1)
+        if message is None:
+            break
+        data = pickle.loads(message['data'])
+        # Emits batched by a task are published in one message
+        batch = data.get('batch', (data, ))
+        event = 'batch' if 'batch' in data else data.get('event')
+        messages[event] += 1
+        traffic[event] += len(message['data'])
+        events += len(batch)
+    pubsub.close()
+
+    for game in Game.get(game_ids):
+        game.delete()
+    for user in User.get(user_ids):
+        user.delete()
+
+    moves = games * PLIES
+    print(f"{games} games, {PLIES} moves each")
+    print(f"{'event':20} {'messages':>9} {'bytes':>9}")
+    for event in sorted(messages, key=str):
+        print(f"{event!s:20} {messages[event]:9} {traffic[event]:9}")
+    print(f"{sum(messages.values())} messages, {events} events, "
+          f"{sum(messages.values()) / games:.1f} messages per game")
+    print(f"game_updated per move: {messages['game_updated'] / moves:.1f} "
+          f"messages, {traffic['game_updated'] / moves:.0f} bytes")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--db', type=int, default=TestingConfig.REDIS_DB_ID)
+    parser.add_argument('--games', type=int, default=20)
+    args = parser.parse_args()
+
+    rom.util.set_connection_settings(db=args.db)
+    run(args.db, args.games)
@@ -0,0 +1,97 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+    This module measures loading of a games list page (api/v1.x/games_list)
+    of every allowed size and compares it with loading the Game entities
+    and their players one by one.
+    Run it from the project directory: python3 -m benchmarks.games_list
+    Redis must be running, the testing database is used by default.
+"""
+
+
+from argparse import ArgumentParser
+from time import perf_counter
+import rom.util
+from hydraChess.models import User, Game
+from hydraChess.config import TestingConfig
+from benchmarks.board_snapshot import gen_game
+from benchmarks.timers import percentile
+
+
+PAGE_SIZES = (10, 20, 50, 100)
+REPEATS = 100
+
+
+def load_entities(game_ids: list) -> list:
+    '''Page data loaded like before'''
+    games_data = list()
+    for game in Game.get(game_ids):
+        games_data.append({
+            'white_player': game.white_user.login,
+            'black_player': game.black_user.login,
+            'id': game.id,
+            'result': game.result,
+            'moves_cnt': game.get_moves_cnt(),
+        })
+    return games_data
+
+
+def measure(func, game_ids: list) -> str:
+    latencies = list()
+    for _ in range(REPEATS):
+        start = perf_counter()
+        func(game_ids)
+        latencies.append(perf_counter() - start)
+    return (f"p50: {percentile(latencies, 50) * 1000:7.3f} ms, "
+            f"p99: {percentile(latencies, 99) * 1000:7.3f} ms")
+
+
+def run():
+    rom.util.use_null_session()
+
+    users = [User(login=f"games_list_benchmark_{i}") for i in range(2)]
+    for user in users:
+        user.save()
+
+    moves = gen_game(80)
+    games = list()
+    for i in range(max(PAGE_SIZES)):
+        game = Game(white_user=users[i % 2], black_user=users[1 - i % 2],
+                    result='1-0', is_finished=True)
+        game.moves = moves
+        game.save()
+        games.append(game)
+    game_ids = [game.id for game in games]
+
+    for size in PAGE_SIZES:
+        print(f"{size:3} games, "
+              f"entities: {measure(load_entities, game_ids[:size])} | "
+              f"summaries: {measure(Game.get_summaries, game_ids[:size])}")
+
+    for game in games:
+        game.delete()
+    for user in users:
+        user.delete()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--db', type=int, default=TestingConfig.REDIS_DB_ID)
+    args = parser.parse_args()
+
+    rom.util.set_connection_settings(db=args.db)
+    run()
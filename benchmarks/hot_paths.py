@@ -0,0 +1,253 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+    This module times the hot paths of game management on seeded data:
+    Game.get_board and Game.get_moves_cnt of short and long games,
+    the clock properties, get_rating_changes, search_game with a large
+    pool of seekers and GamesList.get of a user with thousands of games.
+    "cold" paths are timed on a freshly loaded game, "warm" ones on
+    a game, which has already loaded its moves.
+    Results are written as JSON, pass the file of another version to
+    --compare to see the difference:
+    python3 -m benchmarks.hot_paths --output new.json --compare old.json
+    Run it from the project directory. Redis must be running,
+    the database is flushed, the testing one is used by default.
+"""
+
+
+import os
+os.environ.setdefault('HYDRACHESS_CONFIG', 'hydraChess.config.TestingConfig')
+
+from argparse import ArgumentParser  # noqa: E402
+from datetime import datetime, timedelta  # noqa: E402
+from random import Random  # noqa: E402
+from time import perf_counter  # noqa: E402
+from typing import Callable, Dict, List  # noqa: E402
+import json  # noqa: E402
+import platform  # noqa: E402
+import subprocess  # noqa: E402
+import rom.util  # noqa: E402
+from hydraChess.__main__ import app  # noqa: E402
+from hydraChess.config import TestingConfig  # noqa: E402
+from hydraChess.game_management import celery, get_rating_changes,\
+    search_game  # noqa: E402
+from hydraChess.models import Game, User, save_many  # noqa: E402
+from hydraChess.resources import GamesList  # noqa: E402
+from hydraChess import matchmaking  # noqa: E402
+from benchmarks.board_snapshot import gen_game  # noqa: E402
+from benchmarks.timers import percentile  # noqa: E402
+
+
+SHORT_GAME_PLIES = 10
+LONG_GAME_PLIES = 200
+HISTORY_GAMES = 5000  # Played games of one user
+HISTORY_GAME_PLIES = 60
+SEEKERS = 10000
+SEARCHES = 500
+SEARCH_MINUTES = 1
+CHUNK_SIZE = 500  # Entities saved in one round trip while seeding
+REPEATS = 200
+CPU_NUMBER = 100  # Calls of CPU bound paths per timed sample
+
+
+def measure(func: Callable, setup: Callable = lambda: None,
+            repeats: int = REPEATS, number: int = 1) -> Dict[str, float]:
+    '''Times func(setup()) called number times in a row, repeats times.
+       Times are in microseconds per call.'''
+    latencies = list()
+    for _ in range(repeats):
+        arg = setup()
+        start = perf_counter()
+        for _ in range(number):
+            func(arg)
+        latencies.append((perf_counter() - start) / number)
+    return {
+        'calls': repeats * number,
+        'mean_us': sum(latencies) / len(latencies) * 10 ** 6,
+        'p50_us': percentile(latencies, 50) * 10 ** 6,
+        'p99_us': percentile(latencies, 99) * 10 ** 6,
+    }
+
+
+def new_game(white: User, black: User, moves: List[str]) -> Game:
+    game = Game(white_user=white, black_user=black,
+                white_rating=white.rating, black_rating=black.rating,
+                is_started=True, is_finished=True, result='1-0')
+    game.total_clock = game.white_clock = game.black_clock = \
+        timedelta(minutes=5)
+    game.last_move_datetime = datetime.utcnow()
+    game.moves = moves
+    return game
+
+
+def save_in_chunks(entities: list) -> None:
+    '''Games' moves are saved too'''
+    for i in range(0, len(entities), CHUNK_SIZE):
+        chunk = entities[i:i + CHUNK_SIZE]
+        save_many(chunk)
+        pipe = rom.util.get_connection().pipeline(False)
+        for entity in chunk:
+            if isinstance(entity, Game):
+                pipe.set(entity.moves_key, entity.packed_moves)
+        pipe.execute()
+
+
+def seed() -> Dict:
+    rand = Random(0)
+    white, black = User(login='hot_paths_white'), User(login='hot_paths_black')
+    save_in_chunks([white, black])
+
+    games = {plies: new_game(white, black, gen_game(plies))
+             for plies in (SHORT_GAME_PLIES, LONG_GAME_PLIES)}
+    save_in_chunks(list(games.values()))
+
+    # The user plays all the history games against black
+    moves = gen_game(HISTORY_GAME_PLIES)
+    history = [new_game(white, black, moves) for _ in range(HISTORY_GAMES)]
+    save_in_chunks(history)
+    for i, game in enumerate(history):
+        white.append_game_id(game.id, finished_at=i)
+    white.save()
+
+    seekers = [User(login=f'hot_paths_seeker{i}',
+                    rating=rand.randint(1000, 2000))
+               for i in range(SEEKERS)]
+    searchers = [User(login=f'hot_paths_searcher{i}',
+                      rating=rand.randint(1200, 1800))
+                 for i in range(SEARCHES)]
+    save_in_chunks(seekers + searchers)
+    for seeker in seekers:
+        matchmaking.add(seeker.id, seeker.rating, SEARCH_MINUTES * 60)
+
+    return {'games': {plies: game.id for plies, game in games.items()},
+            'history_user': white.login,
+            'searchers': [searcher.id for searcher in searchers]}
+
+
+def get_games_list(query: str) -> Dict:
+    with app.test_request_context(f'/api/v1.x/games_list/?{query}'):
+        data, status = GamesList().get()
+    assert status == 200, data
+    return data
+
+
+def run(repeats: int) -> Dict[str, Dict[str, float]]:
+    data = seed()
+    results = dict()
+
+    for plies, game_id in data['games'].items():
+        warm_game = Game.get(game_id)
+        warm_game.get_board()
+        for name, func in (('Game.get_board', Game.get_board),
+                           ('Game.get_moves_cnt', Game.get_moves_cnt)):
+            results[f'{name}[{plies} plies, cold]'] = measure(
+                func, lambda: Game.get(game_id), repeats
+            )
+            results[f'{name}[{plies} plies, warm]'] = measure(
+                func, lambda: warm_game, repeats, CPU_NUMBER
+            )
+
+    game = Game.get(data['games'][LONG_GAME_PLIES])
+    tdelta = timedelta(minutes=3, seconds=12, microseconds=345)
+    results['Game.white_clock[get]'] = measure(
+        lambda game: game.white_clock, lambda: game, repeats, CPU_NUMBER
+    )
+    results['Game.white_clock[set]'] = measure(
+        lambda game: setattr(game, 'white_clock', tdelta), lambda: game,
+        repeats, CPU_NUMBER
+    )
+
+    results['get_rating_changes'] = measure(
+        get_rating_changes, lambda: data['games'][LONG_GAME_PLIES], repeats
+    )
+
+    # Every search finds an opponent and starts the game eagerly
+    searchers = iter(data['searchers'])
+    results[f'search_game[{SEEKERS} seekers]'] = measure(
+        lambda user_id: search_game(user_id, SEARCH_MINUTES),
+        lambda: next(searchers), min(repeats, SEARCHES)
+    )
+
+    nickname = data['history_user']
+    for size in (10, 100):
+        results[f'GamesList.get[{HISTORY_GAMES} games, size {size}]'] = \
+            measure(get_games_list, lambda: f'nickname={nickname}&size={size}',
+                    repeats)
+    cursor = get_games_list(
+        f'nickname={nickname}&size=100&start_from={HISTORY_GAMES // 2}'
+    )['next_cursor']
+    results[f'GamesList.get[{HISTORY_GAMES} games, size 100, cursor]'] = \
+        measure(get_games_list,
+                lambda: f'nickname={nickname}&size=100&cursor={cursor}',
+                repeats)
+    return results
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, check=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: Dict, base: Dict = None) -> None:
+    print(f"{'path':50} {'p50, us':>10} {'p99, us':>10}"
+          + (f" {'base p50':>10} {'change':>8}" if base else ''))
+    for name, result in results.items():
+        line = f"{name:50} {result['p50_us']:10.1f} {result['p99_us']:10.1f}"
+        if base and name in base:
+            base_p50 = base[name]['p50_us']
+            change = (result['p50_us'] - base_p50) / base_p50 * 100
+            line += f" {base_p50:10.1f} {change:+7.1f}%"
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--db', type=int, default=TestingConfig.REDIS_DB_ID)
+    parser.add_argument('--repeats', type=int, default=REPEATS)
+    parser.add_argument('--output', help="file to write results to")
+    parser.add_argument('--compare', help="results of another version")
+    args = parser.parse_args()
+
+    rom.util.set_connection_settings(db=args.db)
+    rom.util.use_null_session()
+    celery.conf.update(CELERY_ALWAYS_EAGER=True)
+
+    conn = rom.util.get_connection()
+    conn.flushdb()
+    try:
+        results = run(args.repeats)
+    finally:
+        conn.flushdb()
+
+    base = None
+    if args.compare:
+        with open(args.compare) as base_file:
+            base = json.load(base_file)['results']
+    print_results(results, base)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({
+                'commit': get_commit(),
+                'python': platform.python_version(),
+                'created_at': datetime.utcnow().isoformat(),
+                'results': results,
+            }, output, indent=2)
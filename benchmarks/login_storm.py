@@ -0,0 +1,138 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+    This module measures latency of socket events handled by the web
+    process during a login storm. A connected player emits an event every
+    INTERVAL, while CONCURRENCY greenlets sign in over and over; latency
+    is from the moment the event is due till it's handled, so it includes
+    waiting for the greenlets, which hash passwords. Compare the pool
+    with hashing in the caller (the way it was done before):
+    python3 -m benchmarks.login_storm
+    python3 -m benchmarks.login_storm --threads 0
+    The site runs with StackConfig like in benchmarks.stack.
+    Run it from the project directory, redislite must be installed
+    (benchmarks/requirements.txt).
+"""
+
+
+import os
+os.environ.setdefault('HYDRACHESS_CONFIG', 'hydraChess.config.StackConfig')
+
+from argparse import ArgumentParser  # noqa: E402
+from time import perf_counter  # noqa: E402
+from typing import List  # noqa: E402
+import gevent  # noqa: E402
+from gevent.event import Event  # noqa: E402
+from hydraChess.__main__ import app, sio  # noqa: E402
+from hydraChess.models import User  # noqa: E402
+from hydraChess import passwords  # noqa: E402
+from benchmarks.stack import start_redis  # noqa: E402
+from benchmarks.timers import percentile  # noqa: E402
+
+
+LOGINS = 200
+CONCURRENCY = 50
+INTERVAL = 0.01
+PASSWORD = 'login_storm'
+
+
+def create_users(count: int) -> List[User]:
+    hashed_password = passwords.generate_hash(PASSWORD)
+    users = [User(login=f'login_storm{i}', hashed_password=hashed_password)
+             for i in range(count)]
+    for user in users:
+        user.save()
+    return users
+
+
+def ping(user: User, latencies: List[float], stop: Event
+         ) -> None:
+    '''Emits an event, which is handled without tasks, every INTERVAL'''
+    http = app.test_client()
+    with http.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+    client = sio.test_client(app, query_string='request_type=lobby',
+                             flask_test_client=http)
+
+    due = perf_counter() + INTERVAL
+    while not stop.is_set():
+        gevent.sleep(max(due - perf_counter(), 0))
+        client.emit('cancel_search', {})
+        latencies.append(perf_counter() - due)
+        due = max(due + INTERVAL, perf_counter())
+    client.disconnect()
+
+
+def sign_in(users: List[User], logins: List[float]) -> None:
+    http = app.test_client()
+    while users:
+        user = users.pop()
+        start = perf_counter()
+        response = http.post('/sign_in', data={'login': user.login,
+                                               'password': PASSWORD})
+        assert response.status_code == 302, "The user wasn't signed in"
+        logins.append(perf_counter() - start)
+        http.get('/logout')
+
+
+def measure(pinger: User, users: List[User], concurrency: int) -> None:
+    latencies = list()
+    logins = list()
+    stop = Event()
+    ping_greenlet = gevent.spawn(ping, pinger, latencies, stop)
+
+    start = perf_counter()
+    if users:
+        gevent.joinall([gevent.spawn(sign_in, users, logins)
+                        for _ in range(concurrency)], raise_error=True)
+    else:
+        gevent.sleep(1)
+    elapsed = perf_counter() - start
+    stop.set()
+    ping_greenlet.get()
+
+    title = f"{len(logins)} logins" if logins else "idle"
+    print(f"{title}: {elapsed:.2f} s"
+          + (f", {len(logins) / elapsed:.1f} logins/s, "
+             f"login p50 {percentile(logins, 50) * 1000:.1f} ms"
+             if logins else ''))
+    print(f"  socket event latency: "
+          f"p50 {percentile(latencies, 50) * 1000:.2f} ms, "
+          f"p99 {percentile(latencies, 99) * 1000:.2f} ms, "
+          f"max {max(latencies) * 1000:.2f} ms")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--logins', type=int, default=LOGINS)
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY,
+                        help="greenlets signing in")
+    parser.add_argument('--threads', type=int,
+                        default=app.config['PASSWORD_HASHING_THREADS'],
+                        help="hashing threads, 0 hashes in the caller")
+    args = parser.parse_args()
+
+    passwords.configure(args.threads)
+
+    redis = start_redis()
+    try:
+        pinger, *users = create_users(args.logins + 1)
+        measure(pinger, [], args.concurrency)
+        measure(pinger, users, args.concurrency)
+    finally:
+        redis.shutdown()
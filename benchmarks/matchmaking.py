@@ -0,0 +1,133 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+    This module measures opponent search with SEEKERS simultaneous seekers
+    of one time control and compares it with scanning the whole pool.
+    Then it compares pairings per second of searches paired on arrival
+    with one matchmaking tick pairing the same seekers.
+    Run it from the project directory: python3 -m benchmarks.matchmaking
+    Redis must be running, the testing database is used by default.
+"""
+
+
+from argparse import ArgumentParser
+from random import Random
+from time import perf_counter, time
+import rom.util
+from hydraChess import matchmaking
+from hydraChess.config import TestingConfig
+from benchmarks.timers import percentile
+
+
+SEEKERS = 10000
+SEARCHES = 1000
+SECONDS = 1234567  # Time control nobody else uses
+FIRST_USER_ID = 10 ** 9
+
+
+def scan_pool(rating: int) -> int:
+    '''Closest seeker found by loading the whole pool, like before'''
+    conn = rom.util.get_connection()
+    pool = conn.zrange(matchmaking.POOL_KEY.format(SECONDS), 0, -1,
+                       withscores=True)
+    return min(pool, key=lambda x: abs(x[1] - rating))
+
+
+def measure(func, ratings: list) -> str:
+    latencies = list()
+    for rating in ratings:
+        start = perf_counter()
+        func(rating)
+        latencies.append(perf_counter() - start)
+    return (f"p50: {percentile(latencies, 50) * 1000:7.3f} ms, "
+            f"p99: {percentile(latencies, 99) * 1000:7.3f} ms")
+
+
+def pair_on_arrival(seekers: list) -> int:
+    pairs_cnt = 0
+    for user_id, rating, since in seekers:
+        if matchmaking.search(user_id, rating, SECONDS, since) is not None:
+            pairs_cnt += 1
+    return pairs_cnt
+
+
+def pair_in_tick(seekers: list) -> tuple:
+    for user_id, rating, since in seekers:
+        matchmaking.add(user_id, rating, SECONDS, since)
+
+    # Like matchmaking.tick(), but for the benchmark's time control
+    conn = rom.util.get_connection()
+    start = perf_counter()
+    pool = conn.zrange(matchmaking.POOL_KEY.format(SECONDS), 0, -1,
+                       withscores=True)
+    data = conn.hmget(matchmaking.SEEKERS_KEY,
+                      [user_id for user_id, _ in pool])
+    snapshot = [
+        (int(user_id), int(rating), float(seeker.split(b':')[1]))
+        for (user_id, rating), seeker in zip(pool, data)
+    ]
+    pairs = matchmaking.claim_pairs(matchmaking.pair_seekers(snapshot),
+                                    SECONDS)
+    return len(pairs), perf_counter() - start
+
+
+def run():
+    rand = Random(0)
+    now = time()
+
+    user_ids = range(FIRST_USER_ID, FIRST_USER_ID + SEEKERS)
+    for user_id in user_ids:
+        rating = int(rand.gauss(1500, 300))
+        matchmaking.add(user_id, rating, SECONDS, now - rand.random() * 60)
+
+    ratings = [int(rand.gauss(1500, 300)) for _ in range(SEARCHES)]
+    print(f"{SEEKERS} seekers, {SEARCHES} searches")
+    print(f"index lookup: "
+          f"{measure(lambda x: matchmaking.find_opponent(x, SECONDS), ratings)}")
+    print(f"pool scan:    {measure(scan_pool, ratings)}")
+
+    for user_id in user_ids:
+        matchmaking.remove(user_id)
+
+    now = time()
+    seekers = [
+        (user_id, int(rand.gauss(1500, 300)), now) for user_id in user_ids
+    ]
+
+    start = perf_counter()
+    pairs_cnt = pair_on_arrival(seekers)
+    elapsed = perf_counter() - start
+    print(f"on arrival: {pairs_cnt} pairs, "
+          f"{pairs_cnt / elapsed:9.0f} pairs/s")
+    for user_id in user_ids:
+        matchmaking.remove(user_id)
+
+    pairs_cnt, elapsed = pair_in_tick(seekers)
+    print(f"one tick:   {pairs_cnt} pairs, "
+          f"{pairs_cnt / elapsed:9.0f} pairs/s")
+    for user_id in user_ids:
+        matchmaking.remove(user_id)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--db', type=int, default=TestingConfig.REDIS_DB_ID)
+    args = parser.parse_args()
+
+    rom.util.set_connection_settings(db=args.db)
+    run()
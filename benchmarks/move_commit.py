@@ -0,0 +1,116 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+    This module measures move commit latency while other processes keep
+    taking the game's entity lock, like draw offers and reconnects do.
+    The Lua commit (Game.commit_move) is compared with saving the game
+    under the entity lock, like make_move did before.
+    Run it from the project directory: python3 -m benchmarks.move_commit
+    Redis must be running, the testing database is used by default.
+"""
+
+
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from multiprocessing import Event, Process
+from time import perf_counter, sleep
+import rom.util
+from hydraChess.models import Game
+from hydraChess.config import TestingConfig
+from benchmarks.board_snapshot import gen_game
+from benchmarks.timers import percentile
+
+
+PLIES = 200
+CONTENDERS = 4
+LOCK_HOLD_TIME = 0.002  # Seconds
+
+
+def contend(db: int, game_id: int, stop) -> None:
+    '''Offers draws and reconnects, holding the entity lock'''
+    rom.util.set_connection_settings(db=db)
+    rom.util.use_null_session()
+    while not stop.is_set():
+        game = Game.get(game_id)
+        with rom.util.EntityLock(game, 10, 10):
+            game.refresh()
+            sleep(LOCK_HOLD_TIME)
+            game.white_disconnect_timed_out_eta = datetime.utcnow()
+            game.save()
+
+
+def commit_under_lock(game: Game) -> None:
+    with rom.util.EntityLock(game, 10, 10):
+        game.save()
+
+
+def commit_with_lua(game: Game) -> None:
+    if not game.commit_move():
+        raise RuntimeError("The game was changed by another move")
+
+
+def measure(db: int, commit) -> str:
+    game = Game()
+    game.white_clock = game.black_clock = timedelta(minutes=5)
+    game.save()
+
+    stop = Event()
+    contenders = [
+        Process(target=contend, args=(db, game.id, stop))
+        for _ in range(CONTENDERS)
+    ]
+    for contender in contenders:
+        contender.start()
+
+    latencies = list()
+    board = game.get_board()
+    for ply, move in enumerate(gen_game(PLIES)):
+        # Like make_move after the move is validated
+        game.push_move(board, move)
+        if ply % 2 == 0:
+            game.white_clock -= timedelta(seconds=1)
+        else:
+            game.black_clock -= timedelta(seconds=1)
+        game.last_move_datetime = datetime.utcnow()
+
+        start = perf_counter()
+        commit(game)
+        latencies.append(perf_counter() - start)
+
+    stop.set()
+    for contender in contenders:
+        contender.join()
+    game.delete()
+
+    return (f"p50: {percentile(latencies, 50) * 1000:7.3f} ms, "
+            f"p99: {percentile(latencies, 99) * 1000:7.3f} ms")
+
+
+def run(db: int):
+    rom.util.use_null_session()
+    print(f"{PLIES} moves, {CONTENDERS} processes taking the lock")
+    print(f"entity lock: {measure(db, commit_under_lock)}")
+    print(f"lua commit:  {measure(db, commit_with_lua)}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--db', type=int, default=TestingConfig.REDIS_DB_ID)
+    args = parser.parse_args()
+
+    rom.util.set_connection_settings(db=args.db)
+    run(args.db)
@@ -0,0 +1,112 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+    This module measures the work done for a joining spectator: game info
+    made from the game snapshot by the web server and game info made
+    from the Game entity by the send_game_info task.
+    Run it from the project directory: python3 -m benchmarks.spectators
+    Redis must be running, the testing database is used by default.
+"""
+
+
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from time import perf_counter
+import rom.util
+from hydraChess import snapshots
+from hydraChess.models import User, Game
+from hydraChess.config import TestingConfig
+from benchmarks.board_snapshot import gen_game
+from benchmarks.timers import percentile
+
+
+PLIES = (10, 80, 200)
+SPECTATORS = 1000
+
+
+def from_entity(game_id: int) -> dict:
+    '''Game info made like send_game_info(...) makes it'''
+    now = datetime.utcnow()
+    game = Game.get(game_id)
+    data = {
+        "black_user": {"nickname": game.black_user.login,
+                       "rating": game.black_rating},
+        "white_user": {"nickname": game.white_user.login,
+                       "rating": game.white_rating},
+        "moves": ','.join(game.moves),
+        "is_player": False,
+    }
+    black_clock = game.black_clock
+    white_clock = game.white_clock
+    if game.get_next_to_move():
+        white_clock -= now - game.last_move_datetime
+    else:
+        black_clock -= now - game.last_move_datetime
+    data["black_clock"] = int(black_clock.total_seconds())
+    data["white_clock"] = int(white_clock.total_seconds())
+    return data
+
+
+def from_snapshot(game_id: int) -> dict:
+    snapshot = snapshots.get_or_save(game_id)
+    return snapshots.get_game_info(snapshot, datetime.utcnow())
+
+
+def measure(func, game_id: int) -> str:
+    latencies = list()
+    for _ in range(SPECTATORS):
+        start = perf_counter()
+        func(game_id)
+        latencies.append(perf_counter() - start)
+    return (f"p50: {percentile(latencies, 50) * 1000:7.3f} ms, "
+            f"p99: {percentile(latencies, 99) * 1000:7.3f} ms")
+
+
+def run():
+    rom.util.use_null_session()
+    white_user = User(login='spectators_w')
+    white_user.save()
+    black_user = User(login='spectators_b')
+    black_user.save()
+
+    for plies in PLIES:
+        game = Game(white_user=white_user, black_user=black_user,
+                    white_rating=1200, black_rating=1200)
+        game.white_clock = game.black_clock = timedelta(minutes=5)
+        game.last_move_datetime = datetime.utcnow()
+        game.moves = gen_game(plies)
+        game.save()
+        snapshots.save(game)
+
+        print(f"{plies} plies, {SPECTATORS} spectators")
+        print(f"  send_game_info: {measure(from_entity, game.id)}")
+        print(f"  snapshot:       {measure(from_snapshot, game.id)}")
+
+        rom.util.get_connection().delete(snapshots.snapshot_key(game.id))
+        game.delete()
+
+    white_user.delete()
+    black_user.delete()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--db', type=int, default=TestingConfig.REDIS_DB_ID)
+    args = parser.parse_args()
+
+    rom.util.set_connection_settings(db=args.db)
+    run()
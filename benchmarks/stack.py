@@ -0,0 +1,182 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+    This module runs the whole site in one process with StackConfig:
+    a redislite server stands in for Redis, Celery tasks run eagerly
+    in the process, which has emitted them, timers and matchmaking ticks
+    run in greenlets. There is nothing else to start.
+    Serve the site (e.g. for load_testing):
+    python3 -m benchmarks.stack --serve
+    Play scripted games with Socket.IO test clients, the same games are
+    played on every run, so hot paths can be profiled and compared:
+    python3 -m benchmarks.stack --games 50 --profile stack.prof
+    Run it from the project directory, redislite must be installed
+    (benchmarks/requirements.txt).
+"""
+
+
+import os
+os.environ.setdefault('HYDRACHESS_CONFIG', 'hydraChess.config.StackConfig')
+
+from argparse import ArgumentParser  # noqa: E402
+from cProfile import Profile  # noqa: E402
+from random import Random  # noqa: E402
+from time import perf_counter  # noqa: E402
+from types import SimpleNamespace  # noqa: E402
+from typing import List  # noqa: E402
+import chess  # noqa: E402
+import gevent  # noqa: E402
+import redislite  # noqa: E402
+from hydraChess.__main__ import app, sio  # noqa: E402
+from hydraChess.game_management import celery, start_games  # noqa: E402
+from hydraChess.models import Game, User  # noqa: E402
+from hydraChess import identity_map, matchmaking, timers  # noqa: E402
+from benchmarks.timers import percentile  # noqa: E402
+
+
+PLIES = 80  # The white player resigns, if the game lasts longer
+SEED = 0
+
+
+def start_redis() -> redislite.Redis:
+    '''Starts the Redis stand-in, it's stopped with the returned client'''
+    return redislite.Redis(serverconfig={
+        'port': str(app.config['REDIS_PORT']),
+        'save': '',
+    })
+
+
+def start_background() -> None:
+    '''Timers and matchmaking ticks, like their own processes do'''
+    def send_task(task_name: str, args: list) -> None:
+        celery.tasks[task_name].apply_async(args=args)
+
+    gevent.spawn(timers.run, SimpleNamespace(send_task=send_task))
+    if app.config['MATCHMAKING_TICK']:
+        gevent.spawn(matchmaking.run, app.config['MATCHMAKING_TICK'] / 1000,
+                     start_games)
+
+
+class Player:
+    def __init__(self, user: User):
+        self.user_id = user.id
+        self.http = app.test_client()
+        with self.http.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+        self.sio = None
+
+    def connect(self, query_string: str) -> None:
+        if self.sio is not None:
+            self.sio.disconnect()
+        self.sio = sio.test_client(app, query_string=query_string,
+                                   flask_test_client=self.http)
+
+    def emit(self, event: str, data: dict) -> None:
+        self.sio.emit(event, data)
+        self.sio.get_received()  # Emits to the player aren't needed
+
+
+def create_players(count: int) -> List[Player]:
+    user = User(login='stack0')
+    user.set_password('stack')
+    user.save()
+    users = [user]
+    # Hashing passwords is slow, so it's done once
+    for i in range(1, count):
+        users.append(User(login=f'stack{i}',
+                          hashed_password=user.hashed_password))
+        users[-1].save()
+    return list(map(Player, users))
+
+
+def play_game(white: Player, black: Player, random: Random,
+              move_times: List[float]) -> None:
+    for player in (white, black):
+        player.connect('request_type=lobby')
+        player.emit('search_game', {'minutes': 5})
+
+    with identity_map.scope():
+        game_id = User.get(white.user_id).cur_game_id
+        assert game_id, "The players weren't paired"
+        # Colors are chosen by the server
+        if Game.get(game_id).white_user.id != white.user_id:
+            white, black = black, white
+
+    for player in (white, black):
+        player.connect(f'request_type=game&game_id={game_id}')
+
+    board = chess.Board()
+    while not board.is_game_over() and len(board.move_stack) < PLIES:
+        player = white if board.turn == chess.WHITE else black
+        move = random.choice(list(board.legal_moves))
+        start = perf_counter()
+        player.emit('make_move', {'san': board.san(move),
+                                  'game_id': game_id})
+        move_times.append(perf_counter() - start)
+        board.push(move)
+
+    if not board.is_game_over():
+        white.emit('resign', {})
+
+    for player in (white, black):
+        player.sio.disconnect()
+        player.sio = None
+
+
+def play(games: int, profile_path: str = None) -> None:
+    players = create_players(2)
+    random = Random(SEED)
+    move_times = list()
+
+    profile = Profile() if profile_path else None
+    start = perf_counter()
+    if profile:
+        profile.enable()
+    for _ in range(games):
+        play_game(*players, random, move_times)
+    if profile:
+        profile.disable()
+        profile.dump_stats(profile_path)
+    elapsed = perf_counter() - start
+
+    move_times.sort()
+    print(f"Games: {games}, moves: {len(move_times)}, "
+          f"{elapsed:.2f} s, {len(move_times) / elapsed:.1f} moves/s")
+    print(f"make_move (socket event with its eager tasks): "
+          f"p50 {percentile(move_times, 50) * 1000:.3f} ms, "
+          f"p99 {percentile(move_times, 99) * 1000:.3f} ms")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--serve', action='store_true',
+                        help=f"serve the site on port {app.config['PORT']}")
+    parser.add_argument('--games', type=int, default=20,
+                        help="scripted games to play")
+    parser.add_argument('--profile', help="save cProfile stats to the file")
+    args = parser.parse_args()
+
+    redis = start_redis()
+    try:
+        if args.serve:
+            start_background()
+            sio.run(app, port=app.config['PORT'])
+        else:
+            play(args.games, args.profile)
+    finally:
+        redis.shutdown()
@@ -0,0 +1,98 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+    This module measures arming, re-arming, cancelling and draining
+    of game timers with CLOCKS concurrent clocks.
+    Run it from the project directory: python3 -m benchmarks.timers
+    Redis must be running, the testing database is used by default.
+"""
+
+
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from random import Random
+from time import perf_counter
+import rom.util
+from hydraChess import timers
+from hydraChess.config import TestingConfig
+
+
+CLOCKS = 50000
+BUCKET_SIZE = 10000
+
+
+def percentile(values: list, val: int) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * val // 100)]
+
+
+def report(title: str, latencies: list) -> None:
+    buckets = ' '.join(
+        f"{sum(latencies[i:i + BUCKET_SIZE]) / BUCKET_SIZE * 10 ** 6:6.1f}"
+        for i in range(0, len(latencies), BUCKET_SIZE)
+    )
+    print(f"{title:<8} p50: {percentile(latencies, 50) * 10 ** 6:6.1f} us, "
+          f"p99: {percentile(latencies, 99) * 10 ** 6:6.1f} us, "
+          f"mean per {BUCKET_SIZE}: {buckets}")
+
+
+def run():
+    rand = Random(0)
+    names = [f"benchmark:time_is_up:{i}" for i in range(CLOCKS)]
+    now = datetime.utcnow()
+
+    def measure(func, names):
+        latencies = list()
+        for name in names:
+            start = perf_counter()
+            func(name)
+            latencies.append(perf_counter() - start)
+        return latencies
+
+    def arm(name):
+        eta = now + timedelta(minutes=10, seconds=rand.random() * 3600)
+        timers.arm(name, eta, 'on_time_is_up', (1, name))
+
+    report("arm", measure(arm, names))
+    report("re-arm", measure(arm, names))
+    report("cancel", measure(timers.cancel, names[CLOCKS // 2:]))
+
+    for name in names[:CLOCKS // 2]:
+        timers.arm(name, now, 'on_time_is_up', (1, name))
+
+    drained = 0
+    start = perf_counter()
+    while True:
+        tasks = timers.pop_expired()
+        if not tasks:
+            break
+        timers.ack(name for name, _, _ in tasks)
+        drained += len(tasks)
+    elapsed = perf_counter() - start
+
+    print(f"drain    {drained} expired timers in {elapsed:.2f} s, "
+          f"{drained / elapsed:.0f} timers/s")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--db', type=int, default=TestingConfig.REDIS_DB_ID)
+    args = parser.parse_args()
+
+    rom.util.set_connection_settings(db=args.db)
+    run()
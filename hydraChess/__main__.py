@@ -19,36 +19,52 @@ from gevent import monkey
 monkey.patch_all()
 
 import os
-import uuid
+import tempfile
 from datetime import datetime, timedelta
-from io import BytesIO
-from PIL import Image
-from flask import Flask, request, url_for
+from flask import Flask, Response, request
 from flask import render_template, redirect
-from rom.util import EntityLock
 import rom.util
 from flask_socketio import SocketIO, disconnect, join_room
 from flask_login import LoginManager, login_user, logout_user
 from flask_login import current_user, login_required
 from flask_restful import Api
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY
 import sass
 from hydraChess.config import ProductionConfig
+from hydraChess import celery_config, identity_map, metrics, passwords
+from hydraChess import snapshots, tracing
 from hydraChess.forms import SignUpForm, LoginForm, PictureForm
 from hydraChess.forms import ChangePasswordForm
 from hydraChess.models import User, Game
 from hydraChess.resources import GamesPlayed, GamesList, GameResource
+from hydraChess.socketio_queue import BatchingRedisManager, RoleManager,\
+    RoleRedisManager, players_room
 
 
 app = Flask(__name__)
-app.config.from_object(ProductionConfig)
+# Import name of another config class, e.g. hydraChess.config.StackConfig
+app.config.from_object(os.environ.get('HYDRACHESS_CONFIG', ProductionConfig))
 
-rom.util.set_connection_settings(db=app.config['REDIS_DB_ID'])
-rom.util.use_null_session()
+identity_map.set_connection_settings(port=app.config['REDIS_PORT'],
+                                     db=app.config['REDIS_DB_ID'])
+if not app.config['IDENTITY_MAP']:
+    rom.util.use_null_session()
+os.makedirs(app.config['AVATAR_UPLOAD_DIR'], exist_ok=True)
+passwords.configure(app.config['PASSWORD_HASHING_THREADS'])
 
 login_manager = LoginManager()
 login_manager.init_app(app)
 
-sio = SocketIO(app, message_queue=app.config['SOCKET_IO_URL'])
+if not app.config['SOCKET_IO_URL']:
+    sio = SocketIO(app, client_manager=RoleManager())
+elif app.config['SOCKET_IO_BATCHING']:
+    sio = SocketIO(app, client_manager=BatchingRedisManager(
+        app.config['SOCKET_IO_URL'], channel='flask-socketio'
+    ))
+else:
+    sio = SocketIO(app, client_manager=RoleRedisManager(
+        app.config['SOCKET_IO_URL'], channel='flask-socketio'
+    ))
 
 api = Api(app)
 api.add_resource(GamesPlayed, '/api/v1.x/games_played/')
@@ -68,6 +84,12 @@ def authenticated_only(func):
     return wrapper
 
 
+@app.teardown_request
+def clear_identity_map(exception) -> None:
+    # Called after Socket.IO events too
+    rom.util.session.rollback()
+
+
 @login_manager.user_loader
 def load_user(user_id: int) -> User:
     return User.get(user_id)
@@ -218,10 +240,12 @@ def on_connect(*args, **kwargs) -> None:
         cur_user = User.get(current_user.id)
         if cur_user.sid:
             sio.emit('logged_twice', room=cur_user.sid)
-        with EntityLock(cur_user, 10, 10):
-            cur_user.sid = request.sid
-            cur_user.last_time_sid_was_changed = datetime.utcnow()
-            cur_user.save()
+
+        def set_sid(user: User) -> None:
+            user.sid = request.sid
+            user.last_time_sid_was_changed = datetime.utcnow()
+
+        game_management.update(cur_user, set_sid)
 
     if request_type == 'lobby':
         if not current_user.is_authenticated:
@@ -240,22 +264,35 @@ def on_connect(*args, **kwargs) -> None:
         return
 
     game_id = int(game_id)
-    game = Game.get(game_id)
+    # Plies the client already knows, if it's reconnecting
+    ply = request.args.get('ply')
+    ply = int(ply) if ply and ply.isdigit() else None
 
-    if game is None:  # There is no game with current id
+    # Spectators are served from the snapshot, without tasks
+    snapshot = snapshots.get_or_save(game_id)
+
+    if snapshot is None:  # There is no game with current id
         disconnect()
+        return
 
-    if game.is_finished:
-        game_management.send_game_info.delay(game_id, request.sid, False)
+    game_info = snapshots.get_game_info(snapshot, datetime.utcnow(), ply)
+    if snapshot['result']:  # The game is finished
+        sio.emit('game_started', game_info, room=request.sid)
         return
 
     if current_user.is_authenticated:
-        if current_user.id in (game.white_user.id, game.black_user.id):
-            game_management.on_reconnect.delay(current_user.id, game_id)
+        players = snapshots.get_players(snapshot)
+        if current_user.id in (players['white_user_id'],
+                               players['black_user_id']):
+            # Game updates are published to the room once for everyone
+            join_room(game_id)
+            join_room(players_room(game_id))
+            game_management.on_reconnect.delay(current_user.id, game_id,
+                                               ply)
             return
 
-    game_management.send_game_info.delay(game_id, request.sid, False)
     join_room(game_id)
+    sio.emit('game_started', game_info, room=request.sid)
 
 
 @sio.on('make_draw_offer')
@@ -298,7 +335,9 @@ def on_make_move(*args, **kwargs):
             return
         game_id = int(game_id)
         if san and game_id:
-            game_management.make_move.delay(user_id, game_id, san)
+            trace_id = tracing.sample(app.config['TRACE_SAMPLE_RATE'])
+            with tracing.trace(trace_id, 'on_make_move'):
+                game_management.make_move.delay(user_id, game_id, san)
 
 
 @app.route('/settings', methods=['GET', 'POST'])
@@ -310,8 +349,14 @@ def settings():
             change_password_form.validate():
         if current_user.check_password(
                 change_password_form.current_password.data):
-            current_user.set_password(change_password_form.new_password.data)
-            current_user.save()
+            hashed_password = passwords.generate_hash(
+                change_password_form.new_password.data
+            )
+
+            def set_password(user: User) -> None:
+                user.hashed_password = hashed_password
+
+            game_management.update(User.get(current_user.id), set_password)
             change_password_form.message = \
                 'Your password was successfuly updated!'
         else:
@@ -320,33 +365,13 @@ def settings():
 
     picture_form = PictureForm()
     if picture_form.submit_picture.data and picture_form.validate():
-        # Because the stream was already read on validation
-        picture_form.image.data.seek(0)
-        raw_img = BytesIO(picture_form.image.data.read())
-
-        img = Image.open(raw_img)
-        img_new_side = min(img.width // 256, img.height // 256) * 256
-
-        crop_left = (img.width - img_new_side) // 2
-        crop_upper = (img.height - img_new_side) // 2
-        crop_box = (
-            crop_left,
-            crop_upper,
-            crop_left + img_new_side,
-            crop_upper + img_new_side
-        )
-        img = img.crop(box=crop_box)
-        img.thumbnail((256, 256), Image.ANTIALIAS)
-
-        img_hash = uuid.uuid4().hex
-        path = os.path.dirname(os.path.realpath(__file__)) +\
-            url_for('static', filename=f'img/profiles/{img_hash}.jpg')
-
-        img.convert('RGB').save(path)
-
-        current_user.avatar_hash = img_hash
-        current_user.save()
-        picture_form.message = "Your profile pucture was successfuly updated!"
+        # The upload is only copied, decoding it would block the sockets
+        fd, path = tempfile.mkstemp(dir=app.config['AVATAR_UPLOAD_DIR'])
+        with os.fdopen(fd, 'wb') as upload:
+            picture_form.image.data.save(upload)
+        game_management.process_avatar.delay(current_user.id, path)
+        picture_form.message = \
+            "Your profile picture will be updated in a moment!"
 
     return render_template(
         'settings.html',
@@ -368,6 +393,15 @@ def unauth_handler():
     return redirect('/')
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics_page():
+    return Response(metrics.generate(), mimetype=CONTENT_TYPE_LATEST)
+
+
+def get_connected_sockets() -> int:
+    return len(sio.server.manager.rooms.get('/', {}).get(None, ()))
+
+
 @app.errorhandler(404)
 def page_not_found(e):
     return render_template('404.html'), 404
@@ -390,6 +424,12 @@ if __name__ == '__main__':
     with open(path_to_bulma_css, "w") as bulma_css:
         bulma_css.write(compiled_bulma)
 
+    REGISTRY.register(metrics.WebCollector(
+        app.config['CELERY_BROKER_URL'],
+        (queue.name for queue in celery_config.CELERY_QUEUES),
+        get_connected_sockets,
+    ))
+
     #  Set debug to False in production
     sio.run(
         app,
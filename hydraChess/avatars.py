@@ -0,0 +1,92 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Optional
+import hashlib
+import os
+from PIL import Image
+
+
+# Avatars are processed by the workers (process_avatar task), the web
+# process only saves the upload to a file. Every avatar is cropped to
+# a square and saved in every size and format as
+# static/img/profiles/<avatar hash>-<size>.<extension>. The hash is
+# the hash of the upload, so the same picture is processed and stored once.
+
+PROFILES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                            'static', 'img', 'profiles')
+SIZES = (256, 64, 32)  # Descending, every size is resized from the previous
+FORMATS = (('jpg', 'JPEG'), ('webp', 'WEBP'))  # Extension, PIL format
+HASH_LENGTH = 32
+CHUNK_SIZE = 64 * 1024
+# Raised by PIL on broken or hostile images
+INVALID_IMAGE_ERRORS = (OSError, SyntaxError, ValueError,
+                        Image.DecompressionBombError)
+
+
+def get_filename(avatar_hash: str, size: int, extension: str) -> str:
+    return f"{avatar_hash}-{size}.{extension}"
+
+
+def hash_file(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()[:HASH_LENGTH]
+
+
+def has_variants(avatar_hash: str, directory: str = PROFILES_DIR) -> bool:
+    return all(
+        os.path.exists(os.path.join(
+            directory, get_filename(avatar_hash, size, extension)
+        ))
+        for size in SIZES for extension, _ in FORMATS
+    )
+
+
+def save_variants(path: str, directory: str = PROFILES_DIR,
+                  avatar_hash: Optional[str] = None) -> str:
+    '''Saves variants of the image and returns their avatar hash, which is
+       the hash of the image, unless it's given. Variants are saved once,
+       they are written to temporary files first, so concurrent workers
+       don't serve partial files. Raises one of INVALID_IMAGE_ERRORS
+       if it isn't a valid image.'''
+    if avatar_hash is None:
+        avatar_hash = hash_file(path)
+    if has_variants(avatar_hash, directory):
+        return avatar_hash
+
+    with Image.open(path) as img:
+        # JPEGs are decoded downscaled, while both sides are large enough
+        img.draft('RGB', (SIZES[0], SIZES[0]))
+        side = min(img.width, img.height)
+        left = (img.width - side) // 2
+        upper = (img.height - side) // 2
+        img = img.crop((left, upper, left + side, upper + side))
+        img = img.convert('RGB')
+
+    for size in SIZES:
+        img = img.resize((size, size), Image.LANCZOS, reducing_gap=3.0)
+        for extension, img_format in FORMATS:
+            variant_path = os.path.join(
+                directory, get_filename(avatar_hash, size, extension)
+            )
+            tmp_path = f"{variant_path}.{os.getpid()}.tmp"
+            img.save(tmp_path, img_format)
+            os.replace(tmp_path, variant_path)
+
+    return avatar_hash
@@ -0,0 +1,78 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+from collections import OrderedDict
+from typing import Dict
+from chess import Board
+from hydraChess.metrics import BOARD_CACHE_EVICTIONS, BOARD_CACHE_HITS,\
+    BOARD_CACHE_MISSES, BOARD_CACHE_SIZE
+from hydraChess.models import Game
+
+
+class BoardCache:
+    '''Bounded LRU cache of live game boards. Every worker process has its
+       own one. Boards are keyed by game id and moves count, so a board
+       left behind by another worker's move is never used.
+       Stats are exported as metrics, see hydraChess.metrics.'''
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._boards = OrderedDict()  # game_id -> (moves_cnt, board)
+
+    def take(self, game: Game) -> Board:
+        '''Returns the board with the current position of the game.
+           The board is removed from the cache, put it back after the move.'''
+        entry = self._boards.pop(game.id, None)
+        BOARD_CACHE_SIZE.set(len(self._boards))
+        if entry is not None and entry[0] == game.get_moves_cnt():
+            self.hits += 1
+            BOARD_CACHE_HITS.inc()
+            return entry[1]
+
+        self.misses += 1
+        BOARD_CACHE_MISSES.inc()
+        return game.get_board()
+
+    def put(self, game: Game, board: Board) -> None:
+        '''Caches the board with the current position of the game'''
+        if board.halfmove_clock == 0:
+            # Moves before a zeroing move can't be repeated,
+            # there is no need to keep them.
+            board.clear_stack()
+
+        self._boards.pop(game.id, None)
+        self._boards[game.id] = (game.get_moves_cnt(), board)
+
+        while len(self._boards) > self.max_size:
+            self._boards.popitem(last=False)
+            self.evictions += 1
+            BOARD_CACHE_EVICTIONS.inc()
+        BOARD_CACHE_SIZE.set(len(self._boards))
+
+    def discard(self, game_id: int) -> None:
+        self._boards.pop(game_id, None)
+        BOARD_CACHE_SIZE.set(len(self._boards))
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._boards),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions}
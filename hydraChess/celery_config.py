@@ -16,19 +16,35 @@
 
 
 from kombu import Queue, Exchange
+from hydraChess.matchmaking import TIME_CONTROLS
+
+
+def route_search_game(name, args, kwargs, options, task=None, **kw):
+    '''Routes search_game to the queue of its time control, so searches
+       for different time controls are served by separate workers.'''
+    if name != 'search_game':
+        return None
+
+    minutes = args[1] if args else kwargs.get('minutes')
+    if minutes not in TIME_CONTROLS:
+        return {'queue': 'search'}
+    return {'queue': f'search_{int(minutes)}'}
 
 
 CELERY_QUEUES = (
     Queue('high', Exchange('high'), routing_key='high'),
     Queue('normal', Exchange('normal'), routing_key='normal'),
     Queue('low', Exchange('low'), routing_key='low'),
-    Queue('search', Exchange('search'), routing_key='search')
+    Queue('search', Exchange('search'), routing_key='search'),
+    *(Queue(f'search_{minutes}', Exchange('search'),
+            routing_key=f'search_{minutes}')
+      for minutes in TIME_CONTROLS)
 )
 
 CELERY_DEFAULT_QUEUE = 'normal'
 CELERY_DEFAULT_EXCHANGE = 'normal'
 CELERY_DEFAULT_ROUTING_KEY = 'normal'
-CELERY_ROUTES = {
+CELERY_ROUTES = (route_search_game, {
     # -- HIGH PRIORITY QUEUE -- #
     'make_move': {'queue': 'high'},
     'start_game': {'queue': 'high'},
@@ -48,7 +64,8 @@ CELERY_ROUTES = {
     'on_disconnect': {'queue': 'low'},
     'update_rating': {'queue': 'low'},
     'make_draw_offer': {'queue': 'low'},
-    # -- SEARCH QUEUE -- #
-    'search_game': {'queue': 'search'},
+    'process_avatar': {'queue': 'low'},
+    # -- SEARCH QUEUES -- #
+    # search_game is routed by route_search_game
     'cancel_search': {'queue': 'search'}
-}
+})
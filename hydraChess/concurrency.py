@@ -0,0 +1,169 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from argparse import ArgumentParser
+from typing import Callable, Dict, Iterable, List, Optional
+from celery import current_task
+import redis
+import rom
+import rom.util
+from hydraChess.models import save_many
+
+
+# Optimistic updates save the entity as it was loaded, incrementing its
+# version (see models.bump_version). rom's writer script compares loaded
+# values of the changed columns with the stored ones, version among them,
+# so the save fails, if another writer has updated the entity meanwhile.
+# Then the entity is reloaded and the update is applied again. Uncontended
+# updates take one round trip this way and don't need a lock. Comparing
+# only the columns being changed isn't enough: an update may depend on
+# others, or set a column, which was empty when loaded.
+
+STATS_KEY = 'stats:contention'  # Hash: "<task>:<counter>" -> total
+MAX_ATTEMPTS = 10
+
+ADD_VERSION_LUA = '''
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HSETNX', KEYS[1], 'version', 0)
+end
+'''
+
+
+def update(entity: rom.Model, mutate: Callable[[rom.Model], Optional[bool]],
+           optimistic: bool = True, record_stats: bool = False,
+           name: Optional[str] = None) -> bool:
+    '''Applies mutate(entity) and saves the entity. mutate(...) may return
+       False to skip saving, then False is returned.
+       mutate(...) gets the entity as it was loaded, and the stored one
+       after a conflict. If optimistic is False, the entity lock is held
+       instead.
+       Counters are recorded under the name of the current task by default.'''
+    if not optimistic:
+        with rom.util.EntityLock(entity, 10, 10):
+            # Writers, which don't lock, could update it since it was loaded
+            entity.refresh(force=True)
+            if mutate(entity) is False:
+                return False
+            entity.save()
+            return True
+
+    conflicts = 0
+    try:
+        if 'version' not in entity._last:
+            # Saved before versions were added
+            add_version_lua = entity._connection.register_script(
+                ADD_VERSION_LUA
+            )
+            add_version_lua(keys=[entity._pk])
+            entity.refresh(force=True)
+
+        for _ in range(MAX_ATTEMPTS):
+            if mutate(entity) is False:
+                return False
+            try:
+                entity.save()
+                return True
+            except rom.exceptions.DataRaceError:
+                conflicts += 1
+                entity.refresh(force=True)
+
+        raise rom.exceptions.DataRaceError(
+            f"{entity._pk} wasn't updated after {MAX_ATTEMPTS} attempts",
+            entity._namespace, entity.id
+        )
+    finally:
+        if record_stats:
+            _record(name or getattr(current_task, 'name', None) or 'unknown',
+                    conflicts)
+
+
+def transact(keys: Iterable[str],
+             load_and_mutate: Callable[[], Optional[List[rom.Model]]],
+             record_stats: bool = False, name: Optional[str] = None) -> bool:
+    '''Watches the keys, calls load_and_mutate() and saves the entities it
+       returns in one transaction. If any of the keys was changed meanwhile,
+       it's done again. load_and_mutate() must load the entities after it's
+       called and may return None to skip saving, then False is returned.'''
+    keys = list(keys)
+    conflicts = 0
+    try:
+        with rom.util.get_connection().pipeline(True) as pipe:
+            for _ in range(MAX_ATTEMPTS):
+                try:
+                    pipe.watch(*keys)
+                    entities = load_and_mutate()
+                    if entities is None:
+                        return False
+                    pipe.multi()
+                    # Nothing can race, the watched keys are unchanged
+                    save_many(entities, pipe)
+                    return True
+                except redis.WatchError:
+                    conflicts += 1
+
+        raise rom.exceptions.DataRaceError(
+            f"{', '.join(keys)} weren't updated after {MAX_ATTEMPTS} "
+            f"attempts"
+        )
+    finally:
+        if record_stats:
+            _record(name or getattr(current_task, 'name', None) or 'unknown',
+                    conflicts)
+
+
+def _record(name: str, conflicts: int) -> None:
+    pipe = rom.util.get_connection().pipeline(False)
+    pipe.hincrby(STATS_KEY, f"{name}:updates", 1)
+    if conflicts:
+        pipe.hincrby(STATS_KEY, f"{name}:conflicts", conflicts)
+        pipe.hincrby(STATS_KEY, f"{name}:contended_updates", 1)
+    pipe.execute()
+
+
+def get_stats() -> Dict[str, Dict[str, int]]:
+    '''Counters of each task: updates, contended_updates (ones, which had
+       at least one conflict) and conflicts (retries)'''
+    result = dict()
+    for key, value in rom.util.get_connection().hgetall(STATS_KEY).items():
+        name, counter = key.decode().rsplit(':', 1)
+        counters = result.setdefault(
+            name, {'updates': 0, 'contended_updates': 0, 'conflicts': 0}
+        )
+        counters[counter] = int(value)
+    return result
+
+
+if __name__ == '__main__':
+    from hydraChess.config import ProductionConfig
+
+    parser = ArgumentParser(
+        description="Prints contention of optimistic updates per task. Set "
+                    "CONTENTION_STATS in the config to collect it."
+    )
+    parser.add_argument('--db', type=int,
+                        default=ProductionConfig.REDIS_DB_ID)
+    parser.add_argument('--reset', action='store_true',
+                        help="delete collected stats")
+    args = parser.parse_args()
+
+    rom.util.set_connection_settings(db=args.db)
+    if args.reset:
+        rom.util.get_connection().delete(STATS_KEY)
+
+    print(f"{'task':30} {'updates':>9} {'contended':>9} {'conflicts':>9}")
+    for name, counters in sorted(get_stats().items()):
+        print(f"{name:30} {counters['updates']:9} "
+              f"{counters['contended_updates']:9} {counters['conflicts']:9}")
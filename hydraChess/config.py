@@ -19,10 +19,27 @@ class ProductionConfig:
     DEBUG = False
     TESTING = False
     SECRET_KEY = "CHANGE_ME"
+    REDIS_PORT = 6379
     REDIS_DB_ID = 0
-    CELERY_BROKER_URL = f'redis://localhost:6379/{REDIS_DB_ID}'
-    SOCKET_IO_URL = f'redis://localhost:6379/{REDIS_DB_ID}'
+    CELERY_BROKER_URL = f'redis://localhost:{REDIS_PORT}/{REDIS_DB_ID}'
+    SOCKET_IO_URL = f'redis://localhost:{REDIS_PORT}/{REDIS_DB_ID}'
     MAX_CONTENT_LENGTH = 4 * 1024 * 1024  # 4 MB
+    BOARD_CACHE_SIZE = 1000  # Boards of live games per worker process
+    # Milliseconds between matchmaking ticks, which pair the whole pool.
+    # If 0, every search is paired on arrival.
+    MATCHMAKING_TICK = 0
+    IDENTITY_MAP = True  # Cache entities during tasks and requests
+    REDIS_ROUND_TRIPS_STATS = False  # See hydraChess.identity_map
+    OPTIMISTIC_CONCURRENCY = True  # Retry on conflicts instead of locking
+    CONTENTION_STATS = False  # See hydraChess.concurrency
+    # Publish Socket.IO emits of a task in one message.
+    # Web processes must support it before it's turned on for workers.
+    SOCKET_IO_BATCHING = False
+    TRACE_SAMPLE_RATE = 0.0  # Share of moves traced, see hydraChess.tracing
+    TASK_STATS = False  # See hydraChess.task_stats
+    PASSWORD_HASHING_THREADS = 4  # Concurrent hashes, see hydraChess.passwords
+    # Uploaded avatars wait here for the workers, who must see the directory
+    AVATAR_UPLOAD_DIR = '/tmp/hydraChess_avatars'
     PORT = 8000
     HOST = f"http://localhost:{PORT}/"
 
@@ -31,10 +48,36 @@ class TestingConfig:
     DEBUG = True
     TESTING = True
     SECRET_KEY = "ABACABADABACABA"
+    REDIS_PORT = 6379
     REDIS_DB_ID = 1
-    CELERY_BROKER_URL = f'redis://localhost:6379/{REDIS_DB_ID}'
-    SOCKET_IO_URL = f'redis://localhost:6379/{REDIS_DB_ID}'
+    CELERY_BROKER_URL = f'redis://localhost:{REDIS_PORT}/{REDIS_DB_ID}'
+    SOCKET_IO_URL = f'redis://localhost:{REDIS_PORT}/{REDIS_DB_ID}'
     MAX_CONTENT_LENGTH = 4 * 1024 * 1024  # 4 Mb
+    BOARD_CACHE_SIZE = 1000  # Boards of live games per worker process
+    # Milliseconds between matchmaking ticks, which pair the whole pool.
+    # If 0, every search is paired on arrival.
+    MATCHMAKING_TICK = 0
+    IDENTITY_MAP = True  # Cache entities during tasks and requests
+    REDIS_ROUND_TRIPS_STATS = False  # See hydraChess.identity_map
+    OPTIMISTIC_CONCURRENCY = True  # Retry on conflicts instead of locking
+    CONTENTION_STATS = False  # See hydraChess.concurrency
+    SOCKET_IO_BATCHING = True  # Publish emits of a task in one message
+    TRACE_SAMPLE_RATE = 0.0  # Share of moves traced, see hydraChess.tracing
+    TASK_STATS = False  # See hydraChess.task_stats
+    PASSWORD_HASHING_THREADS = 4  # Concurrent hashes, see hydraChess.passwords
+    # Uploaded avatars wait here for the workers, who must see the directory
+    AVATAR_UPLOAD_DIR = '/tmp/hydraChess_avatars'
     WTF_CSRF_ENABLED = False
     PORT = 8001
     HOST = f"http://localhost:{PORT}/"
+
+
+class StackConfig(ProductionConfig):
+    '''The whole site in one process, see benchmarks.stack'''
+    REDIS_PORT = 6390  # Of the redislite server started by benchmarks.stack
+    CELERY_BROKER_URL = f'redis://localhost:{REDIS_PORT}/0'
+    SOCKET_IO_URL = None  # No message queue, emits are local
+    CELERY_ALWAYS_EAGER = True  # Tasks run in the caller
+    WTF_CSRF_ENABLED = False
+    PORT = 8002
+    HOST = f"http://localhost:{PORT}/"
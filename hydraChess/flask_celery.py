@@ -15,8 +15,11 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 
+from contextlib import nullcontext
 from celery import Celery
-from hydraChess import celery_config
+from celery.signals import before_task_publish
+from hydraChess import celery_config, identity_map, metrics, task_stats
+from hydraChess import tracing
 
 
 def make_celery(app):
@@ -26,14 +29,37 @@ def make_celery(app):
                     broker=app.config["CELERY_BROKER_URL"])
     celery.config_from_object(celery_config)
     celery.conf.update(app.config)
+    if app.config['TASK_STATS']:
+        task_stats.connect()
 
     TaskBase = celery.Task
 
+    def emit_batch():
+        '''Publishes Socket.IO emits of the task at once, if it's possible'''
+        manager = app.extensions['socketio'].server.manager
+        if hasattr(manager, 'batch'):
+            return manager.batch()
+        return nullcontext()
+
+    def flush_emits(**kwargs) -> None:
+        '''Emits of the task go before the ones of the tasks it sends,
+           e.g. the last game_updated before game_ended'''
+        manager = app.extensions['socketio'].server.manager
+        if hasattr(manager, 'flush'):
+            manager.flush()
+
+    before_task_publish.connect(flush_emits, weak=False,
+                                dispatch_uid='flush_emits')
+
     class ContextTask(TaskBase):
         abstract = True
 
         def __call__(self, *args, **kwargs):
-            with app.app_context():
+            with app.app_context(),\
+                    identity_map.scope(self.name,
+                                       app.config['REDIS_ROUND_TRIPS_STATS']),\
+                    tracing.trace_task(self), emit_batch(),\
+                    metrics.observe_task(self):
                 return TaskBase.__call__(self, *args, **kwargs)
 
     celery.Task = ContextTask
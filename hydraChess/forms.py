@@ -15,7 +15,6 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 
-from io import BytesIO
 import re
 import imghdr
 from PIL import Image
@@ -24,6 +23,7 @@ from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, PasswordField, SubmitField,\
                     BooleanField, validators
 from wtforms.validators import StopValidation
+from hydraChess.avatars import INVALID_IMAGE_ERRORS
 from hydraChess.models import User
 
 
@@ -58,11 +58,15 @@ def password_content_validator(form, field):
 
 
 def image_content_validator(form, field):
-    image = field.data
-    raw_img = BytesIO(image.read())
-    if imghdr.what(raw_img) is None:
+    # Only headers are read, the image is decoded by the worker
+    image = field.data.stream
+    if imghdr.what(image) is None:
         raise StopValidation(message=("Can't read image data"))
-    img = Image.open(raw_img)
+    try:
+        img = Image.open(image)
+    except INVALID_IMAGE_ERRORS:
+        raise StopValidation(message=("Can't read image data"))
+    image.seek(0)
     if img.width < 256 or img.height < 256:
         raise StopValidation(message=("Image size must be at least 256x256"))
 
@@ -16,14 +16,18 @@
 
 
 from datetime import datetime, timedelta
-from typing import Dict, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 from math import ceil
+import os
 import chess
 import rom
-from celery.task.control import revoke
 from hydraChess.flask_celery import make_celery
+from hydraChess.board_cache import BoardCache
+from hydraChess import avatars, concurrency, matchmaking, metrics, snapshots
+from hydraChess import timers, tracing
 from hydraChess.__main__ import app, sio
-from hydraChess.models import User, Game, GameRequest
+from hydraChess.models import User, Game, save_many
+from hydraChess.socketio_queue import PLAYERS_ONLY
 
 
 FIRST_MOVE_TIME_OUT = 15
@@ -31,29 +35,63 @@ DISCONNECT_TIME_OUT = 60
 
 
 celery = make_celery(app)
+board_cache = BoardCache(app.config['BOARD_CACHE_SIZE'])
+
+
+def update(entity: rom.Model,
+           mutate: Callable[[rom.Model], Optional[bool]]) -> bool:
+    '''Updates the entity with concurrency.update(...) configured by the app'''
+    return concurrency.update(entity, mutate,
+                              app.config['OPTIMISTIC_CONCURRENCY'],
+                              app.config['CONTENTION_STATS'])
+
+
+def first_move_timer(game_id: int) -> str:
+    return f"first_move_timed_out:{game_id}"
+
+
+def time_is_up_timer(game_id: int) -> str:
+    return f"time_is_up:{game_id}"
+
+
+def disconnect_timer(game_id: int, user_id: int) -> str:
+    return f"disconnect_timed_out:{game_id}:{user_id}"
 
 
 @celery.task(name='send_game_info', ignore_result=True)
-def send_game_info(game_id: int, room_id: int, is_player: bool):
+def send_game_info(game_id: int, room_id: int, is_player: bool,
+                   ply: Optional[int] = None):
+    '''Sends game info. If ply is given, the client knows the moves
+       before it and only the rest are sent.'''
     request_datetime = datetime.utcnow()
     game = Game.get(game_id)
 
+    # SAN moves of the snapshot spare replaying the game, if it's up to date
+    snapshot = snapshots.get(game_id)
+    if snapshot and int(snapshot['moves_cnt']) == game.get_moves_cnt():
+        moves = snapshot['moves']
+    else:
+        moves = ','.join(game.moves)
+
     data = {
         "black_user": {"nickname": game.black_user.login,
                        "rating": game.black_rating},
         "white_user": {"nickname": game.white_user.login,
                        "rating": game.white_rating},
-        "moves": game.raw_moves,
         "is_player": is_player,
     }
+    data.update(snapshots.get_moves_since(moves, ply))
 
     if is_player:
         data['color'] = 'w' if game.white_user.sid == room_id else 'b'
+        data['role'] = 'white' if data['color'] == 'w' else 'black'
+    else:
+        data['role'] = 'spectator'
 
     if not game.is_finished:
         black_clock = game.black_clock
         white_clock = game.white_clock
-        if game.raw_moves:
+        if game.get_moves_cnt():
             next_to_move = game.get_next_to_move()
             if next_to_move == chess.WHITE:
                 white_clock -= request_datetime - game.last_move_datetime
@@ -78,19 +116,16 @@ def start_game(game_id: int) -> None:
     '''Marks game as started, sends game info for players,
     emits first_move_waiting signal to white player'''
     game = Game.get(game_id)
-    with rom.util.EntityLock(game, 10, 10):
-        game.is_started = 1
-
-        eta = datetime.utcnow() + timedelta(seconds=FIRST_MOVE_TIME_OUT)
-        task = on_first_move_timed_out.apply_async(
-            args=(game_id, ),
-            eta=eta,
-        )
+    eta = datetime.utcnow() + timedelta(seconds=FIRST_MOVE_TIME_OUT)
 
-        game.first_move_timed_out_task_id = task.id
-        game.first_move_timed_out_task_eta = eta
+    def start(game: Game) -> None:
+        game.is_started = 1
+        game.first_move_timed_out_eta = eta
 
-        game.save()
+    update(game, start)
+    timers.arm(first_move_timer(game_id), eta,
+               'on_first_move_timed_out', (game_id, ))
+    metrics.game_started(game_id)
 
     send_game_info.delay(game_id, game.white_user.sid, True)
     send_game_info.delay(game_id, game.black_user.sid, True)
@@ -108,107 +143,128 @@ def make_move(user_id: int, game_id: int, move_san: str) -> None:
 
     request_datetime = datetime.utcnow()
 
-    game = Game.get(game_id)
+    for _ in range(concurrency.MAX_ATTEMPTS):
+        if try_move(user_id, game_id, move_san, request_datetime):
+            return
+
+    raise rom.exceptions.DataRaceError(
+        f"The move of game {game_id} wasn't committed after "
+        f"{concurrency.MAX_ATTEMPTS} attempts", 'Game', game_id
+    )
+
+
+def try_move(user_id: int, game_id: int, move_san: str,
+             request_datetime: datetime) -> bool:
+    '''Does the work of make_move(...). Returns False, if the move wasn't
+       committed because the game was changed by another move or finished
+       meanwhile, then it should be tried again.'''
+    with tracing.span('load'):
+        game = Game.get(game_id)
 
     if not game or\
             game.is_finished or\
             user_id not in (game.white_user.id, game.black_user.id):
-        return
+        return True
 
-    board = game.get_board()
+    with tracing.span('board'):
+        board = board_cache.take(game)
     is_user_white = user_id == game.white_user.id
 
     if (is_user_white and board.turn == chess.BLACK) or\
             (not is_user_white and board.turn == chess.WHITE):
-        return
+        board_cache.put(game, board)
+        return True
 
     try:
-        with rom.util.EntityLock(game, 10, 10):
-            board.push_san(move_san)
-            game.append_move(move_san)
-
-            if game.first_move_timed_out_task_id:
-                revoke(game.first_move_timed_out_task_id)
-                game.first_move_timed_out_task_id = None
-
-            if is_user_white:
-                revoke(game.white_time_is_up_task_id)
-            else:
-                revoke(game.black_time_is_up_task_id)
-
-            if game.draw_offer_sender and game.draw_offer_sender != user_id:
-                # Decline draw offer only if it was asked by the opp
-                # This call is waiting because of an entity lock
-                decline_draw_offer.delay(user_id, game_id)
-                game.draw_offer_sender = None
-
-            if is_user_white:
-                if game.get_moves_cnt() != 1:
-                    game.white_clock -=\
-                        request_datetime - game.last_move_datetime
-
-                eta = datetime.utcnow() + game.black_clock
-
-                task = on_time_is_up.apply_async(
-                    args=(game.black_user.id, game_id),
-                    eta=eta,
-                )
-
-                game.black_time_is_up_task_id = task.id
-                game.black_time_is_up_task_eta = eta
-            else:
-                if game.get_moves_cnt() != 1:
-                    game.black_clock -=\
-                            request_datetime - game.last_move_datetime
-
-                eta = datetime.utcnow() + game.white_clock
-
-                task = on_time_is_up.apply_async(
-                    args=(game.white_user.id, game_id),
-                    eta=eta,
-                )
-
-                game.white_time_is_up_task_id = task.id
-                game.white_time_is_up_task_eta = eta
-
-            game.last_move_datetime = request_datetime
-
-            if board.fullmove_number == 1:  # and board.turn == chess.BLACK
-                sio.emit('first_move_waiting',
-                         {'wait_time': FIRST_MOVE_TIME_OUT},
-                         room=game.black_user.sid)
-
-                eta = \
-                    datetime.utcnow() + timedelta(seconds=FIRST_MOVE_TIME_OUT)
-                task = on_first_move_timed_out.\
-                    apply_async((game_id, ), eta=eta)
-
-                game.first_move_timed_out_task_id = task.id
-                game.first_move_timed_out_task_eta = eta
+        with tracing.span('validate'):
+            game.push_move(board, move_san)
+    except ValueError:
+        # The move is illegal, the board wasn't changed
+        board_cache.put(game, board)
+        return True
 
-            game.save()
+    # Decline draw offer only if it was asked by the opp
+    declines_draw_offer =\
+        game.draw_offer_sender and game.draw_offer_sender != user_id
+    if declines_draw_offer:
+        game.draw_offer_sender = None
 
-        data = {'san': move_san,
-                'black_clock': int(game.black_clock.total_seconds()),
-                'white_clock': int(game.white_clock.total_seconds())}
+    if game.get_moves_cnt() != 1:
+        if is_user_white:
+            game.white_clock -= request_datetime - game.last_move_datetime
+        else:
+            game.black_clock -= request_datetime - game.last_move_datetime
+    game.last_move_datetime = request_datetime
+
+    first_move_eta = None
+    cancels_first_move_timer = False
+    if board.fullmove_number == 1:  # and board.turn == chess.BLACK
+        first_move_eta =\
+            datetime.utcnow() + timedelta(seconds=FIRST_MOVE_TIME_OUT)
+        game.first_move_timed_out_eta = first_move_eta
+    elif game.first_move_timed_out_eta:
+        cancels_first_move_timer = True
+        game.first_move_timed_out_eta = None
+
+    # The move, the clocks and the timers' deadlines are written at once,
+    # if the game wasn't changed by another move or finished meanwhile.
+    with tracing.span('commit'):
+        is_committed = game.commit_move()
+    if not is_committed:
+        # The game is loaded again by the next attempt
+        board_cache.discard(game_id)
+        rom.util.session.forget(game)
+        return False
+
+    if declines_draw_offer:
+        decline_draw_offer.delay(user_id, game_id)
 
+    with tracing.span('timers'):
+        # Only the clock of the player to move is running, so one timer
+        # is enough. Arming it again moves the deadline.
+        if is_user_white:
+            eta = datetime.utcnow() + game.black_clock
+            timers.arm(time_is_up_timer(game_id), eta,
+                       'on_time_is_up', (game.black_user.id, game_id))
+        else:
+            eta = datetime.utcnow() + game.white_clock
+            timers.arm(time_is_up_timer(game_id), eta,
+                       'on_time_is_up', (game.white_user.id, game_id))
+
+        if first_move_eta is not None:
+            sio.emit('first_move_waiting',
+                     {'wait_time': FIRST_MOVE_TIME_OUT},
+                     room=game.black_user.sid)
+            timers.arm(first_move_timer(game_id), first_move_eta,
+                       'on_first_move_timed_out', (game_id, ))
+        elif cancels_first_move_timer:
+            timers.cancel(first_move_timer(game_id))
+
+    board_cache.put(game, board)
+    with tracing.span('snapshot'):
+        snapshots.push_move(game, move_san)
+
+    data = {'san': move_san,
+            'black_clock': int(game.black_clock.total_seconds()),
+            'white_clock': int(game.white_clock.total_seconds())}
+
+    # Players and spectators are in the game's room
+    with tracing.span('emit'):
         sio.emit('game_updated', data, room=game_id)
-        sio.emit('game_updated', data, room=game.black_user.sid)
-        sio.emit('game_updated', data, room=game.white_user.sid)
-
-        result = board.result()
-        if result != '*':
-            reason: str
-            if result == '1/2-1/2':
-                reason = "Draw"
-            elif result == '1-0':
-                reason = "Checkmate. White won."
-            else:
-                reason = "Checkmate. Black won."
+    metrics.observe_move_latency(make_move)
+
+    result = board.result()
+    if result != '*':
+        reason: str
+        if result == '1/2-1/2':
+            reason = "Draw"
+        elif result == '1-0':
+            reason = "Checkmate. White won."
+        else:
+            reason = "Checkmate. Black won."
 
-            end_game.delay(game_id, result, reason)
-    except ValueError:
-        pass
+        end_game.delay(game_id, result, reason)
+    return True
 
 
 @celery.task(name="resign", ignore_result=True)
@@ -240,7 +296,8 @@ def resign(user_id: int, game_id: int) -> None:
 
 
 @celery.task(name="reconnect", ignore_result=True)
-def on_reconnect(user_id: int, game_id: int) -> None:
+def on_reconnect(user_id: int, game_id: int,
+                 ply: Optional[int] = None) -> None:
     '''Sends game info to reconnected player
     Emits 'opp_reconnected' to the opponent.'''
 
@@ -251,16 +308,18 @@ def on_reconnect(user_id: int, game_id: int) -> None:
     is_user_white = user_id == game.white_user.id
 
     if is_user_white:
-        send_game_info.delay(game_id, game.white_user.sid, True)
+        send_game_info.delay(game_id, game.white_user.sid, True, ply)
 
-        if game.white_disconnect_timed_out_task_id:
-            revoke(game.white_disconnect_timed_out_task_id)
-            with rom.util.EntityLock(game, 10, 10):
-                game.white_disconnect_timed_out_task_id = None
-                game.save()
+        if game.white_disconnect_timed_out_eta:
+            timers.cancel(disconnect_timer(game_id, user_id))
 
-        if game.first_move_timed_out_task_id and next_to_move == chess.WHITE:
-            wait_time = (game.first_move_timed_out_task_eta -
+            def reconnect(game: Game) -> None:
+                game.white_disconnect_timed_out_eta = None
+
+            update(game, reconnect)
+
+        if game.first_move_timed_out_eta and next_to_move == chess.WHITE:
+            wait_time = (game.first_move_timed_out_eta -
                          datetime.utcnow()).seconds
             sio.emit(
                 'first_move_waiting',
@@ -268,8 +327,8 @@ def on_reconnect(user_id: int, game_id: int) -> None:
                 room=game.white_user.sid,
             )
 
-        if game.black_disconnect_timed_out_task_id:
-            wait_time = (game.black_disconnect_timed_out_task_eta -
+        if game.black_disconnect_timed_out_eta:
+            wait_time = (game.black_disconnect_timed_out_eta -
                          datetime.utcnow()).seconds
             sio.emit(
                 'opp_disconnected',
@@ -279,16 +338,18 @@ def on_reconnect(user_id: int, game_id: int) -> None:
 
         sio.emit('opp_reconnected', room=game.black_user.sid)
     else:
-        send_game_info.delay(game_id, game.black_user.sid, True)
+        send_game_info.delay(game_id, game.black_user.sid, True, ply)
+
+        if game.black_disconnect_timed_out_eta:
+            timers.cancel(disconnect_timer(game_id, user_id))
+
+            def reconnect(game: Game) -> None:
+                game.black_disconnect_timed_out_eta = None
 
-        if game.black_disconnect_timed_out_task_id:
-            revoke(game.black_disconnect_timed_out_task_id)
-            with rom.util.EntityLock(game, 10, 10):
-                game.black_disconnect_timed_out_task_id = None
-                game.save()
+            update(game, reconnect)
 
-        if game.first_move_timed_out_task_id and next_to_move == chess.BLACK:
-            wait_time = (game.first_move_timed_out_task_eta -
+        if game.first_move_timed_out_eta and next_to_move == chess.BLACK:
+            wait_time = (game.first_move_timed_out_eta -
                          datetime.utcnow()).seconds
             sio.emit(
                 'first_move_waiting',
@@ -296,8 +357,8 @@ def on_reconnect(user_id: int, game_id: int) -> None:
                 room=game.black_user.sid,
             )
 
-        if game.white_disconnect_timed_out_task_id:
-            wait_time = (game.white_disconnect_timed_out_task_eta -
+        if game.white_disconnect_timed_out_eta:
+            wait_time = (game.white_disconnect_timed_out_eta -
                          datetime.utcnow()).seconds
             sio.emit(
                 'opp_disconnected',
@@ -330,29 +391,31 @@ def on_disconnect(user_id: int, game_id: int) -> None:
 
     is_user_white = user_id == game.white_user.id
 
-    if is_user_white and game.white_disconnect_timed_out_task_id:
+    if is_user_white and game.white_disconnect_timed_out_eta:
         return
-    if not is_user_white and game.black_disconnect_timed_out_task_id:
+    if not is_user_white and game.black_disconnect_timed_out_eta:
         return
 
-    opp_sid: Optional[int]
-    with rom.util.EntityLock(game, 10, 10):
-        eta = request_time + timedelta(seconds=DISCONNECT_TIME_OUT)
-        task = on_disconnect_timed_out.apply_async(
-            args=(user_id, game_id),
-            eta=eta,
-        )
+    eta = request_time + timedelta(seconds=DISCONNECT_TIME_OUT)
 
+    def disconnect(game: Game) -> Optional[bool]:
+        if game.is_finished:
+            return False
         if is_user_white:
-            game.white_disconnect_timed_out_task_id = task.id
-            game.white_disconnect_timed_out_task_eta = eta
-            opp_sid = game.black_user.sid
+            game.white_disconnect_timed_out_eta = eta
         else:
-            game.black_disconnect_timed_out_task_id = task.id
-            game.black_disconnect_timed_out_task_eta = eta
-            opp_sid = game.white_user.sid
+            game.black_disconnect_timed_out_eta = eta
 
-        game.save()
+    if not update(game, disconnect):
+        return
+    timers.arm(disconnect_timer(game_id, user_id), eta,
+               'on_disconnect_timed_out', (user_id, game_id))
+
+    opp_sid: Optional[int]
+    if is_user_white:
+        opp_sid = game.black_user.sid
+    else:
+        opp_sid = game.white_user.sid
 
     if opp_sid:
         sio.emit(
@@ -370,18 +433,26 @@ def make_draw_offer(user_id: int, game_id: int):
     if game.is_finished:
         return
 
-    with rom.util.EntityLock(game, 10, 10):
-        if game.get_moves_cnt() == 0:
-            #  Do not make draw offer, if game isn't started.
-            return
+    if game.get_moves_cnt() == 0:
+        #  Do not make draw offer, if game isn't started.
+        return
+
+    accepts_draw_offer = False
+
+    def make_offer(game: Game) -> Optional[bool]:
+        nonlocal accepts_draw_offer
         if game.draw_offer_sender and game.draw_offer_sender != user_id:
             #  Accept draw offer, if it's already exist
-            accept_draw_offer.delay(user_id, game_id)
-        elif game.draw_offer_sender:
-            return
-
+            accepts_draw_offer = True
+            return False
+        if game.draw_offer_sender:
+            return False
         game.draw_offer_sender = user_id
-        game.save()
+
+    if not update(game, make_offer):
+        if accepts_draw_offer:
+            accept_draw_offer.delay(user_id, game_id)
+        return
 
     opp_sid: str
     if user_id == game.white_user.id:
@@ -401,13 +472,15 @@ def accept_draw_offer(user_id: int, game_id: int):
             user_id not in (game.white_user.id, game.black_user.id):
         return
 
-    with rom.util.EntityLock(game, 10, 10):
-        if game.draw_offer_sender and game.draw_offer_sender != user_id:
-            # opp_sid = User.get(game.draw_offer_sender).sid
-            # sio.emit('draw_offer_accepted', room=opp_sid)
-            game.draw_offer_sender = None
-            game.save()
-            end_game.delay(game_id, "1/2-1/2", "Draw.")
+    def accept(game: Game) -> Optional[bool]:
+        if not game.draw_offer_sender or game.draw_offer_sender == user_id:
+            return False
+        # opp_sid = User.get(game.draw_offer_sender).sid
+        # sio.emit('draw_offer_accepted', room=opp_sid)
+        game.draw_offer_sender = None
+
+    if update(game, accept):
+        end_game.delay(game_id, "1/2-1/2", "Draw.")
 
 
 @celery.task(name='decline_draw_offer', ignore_result=True)
@@ -419,12 +492,14 @@ def decline_draw_offer(user_id: int, game_id: int):
             user_id not in (game.white_user.id, game.black_user.id):
         return
 
-    with rom.util.EntityLock(game, 10, 10):
-        if game.draw_offer_sender and game.draw_offer_sender != user_id:
-            # opp_sid = User.get(game.draw_offer_sender).sid
-            # sio.emit('draw_offer_declined', room=opp_sid)
-            game.draw_offer_sender = None
-            game.save()
+    def decline(game: Game) -> Optional[bool]:
+        if not game.draw_offer_sender or game.draw_offer_sender == user_id:
+            return False
+        # opp_sid = User.get(game.draw_offer_sender).sid
+        # sio.emit('draw_offer_declined', room=opp_sid)
+        game.draw_offer_sender = None
+
+    update(game, decline)
 
 
 @celery.task(name='end_game', ignore_result=True)
@@ -436,93 +511,84 @@ def end_game(game_id: int,
      closes the room,
      recalculates ratings and k-factors if update_stats is True'''
 
-    game = Game.get(game_id)
-
-    if game.is_finished:
+    finished = finish_game(game_id, result, update_stats)
+    if finished is None:
         return
+    game, rating_deltas = finished
 
-    if game.first_move_timed_out_task_id:
-        revoke(game.first_move_timed_out_task_id)
+    board_cache.discard(game_id)
+    snapshots.save(game)
+    metrics.game_ended(game_id)
 
-    if game.white_disconnect_timed_out_task_id:
-        revoke(game.white_disconnect_timed_out_task_id)
-
-    if game.black_disconnect_timed_out_task_id:
-        revoke(game.black_disconnect_timed_out_task_id)
-
-    if game.white_time_is_up_task_id:
-        revoke(game.white_time_is_up_task_id)
+    timers.cancel(
+        first_move_timer(game_id),
+        time_is_up_timer(game_id),
+        disconnect_timer(game_id, game.white_user.id),
+        disconnect_timer(game_id, game.black_user.id),
+    )
 
-    if game.black_time_is_up_task_id:
-        revoke(game.black_time_is_up_task_id)
+    data = {
+        'result': result,
+        'reason': reason,
+        PLAYERS_ONLY: {'rating_deltas': rating_deltas},
+    }
+    sio.emit('game_ended', data, room=game_id)
 
-    data = {'result': result}
-    sio.emit('game_ended', data, room=game_id)  # Emit to spectators
 
-    with rom.util.EntityLock(game, 10, 10):
+def finish_game(game_id: int, result: str, update_stats: bool
+                ) -> Optional[Tuple[Game, Dict[str, int]]]:
+    '''Finishes the game and updates its players (current game, and if
+       update_stats is True, games played, played games, rating and
+       K-factor) in one transaction. Returns the game and rating deltas
+       of the players, None if the game is already finished.'''
+    game = Game.get(game_id)
+    if game is None:
+        return None
+    rating_deltas = {'w': 0, 'b': 0}
+
+    def load_and_mutate() -> Optional[List[rom.Model]]:
+        nonlocal game
+        # Loaded again after watching, so no change is missed
+        game = Game.get(game_id, force=True)
+        if game.is_finished:
+            return None
         game.is_finished = 1
         game.result = result
-        with rom.util.EntityLock(game.white_user, 10, 10):
-            game.white_user.cur_game_id = None
-            game.white_user.save()
-
-        with rom.util.EntityLock(game.black_user, 10, 10):
-            game.black_user.cur_game_id = None
-            game.black_user.save()
-
-        game.save()
-
-    if update_stats:
-        rating_changes = get_rating_changes(game_id)
-
-        with rom.util.EntityLock(game.white_user, 10, 10):
-            game.white_user.games_played += 1
-            game.white_user.append_game_id(game_id)
-            game.white_user.save()
-
-        with rom.util.EntityLock(game.black_user, 10, 10):
-            game.black_user.games_played += 1
-            game.black_user.append_game_id(game_id)
-            game.black_user.save()
-
-        if result == "1-0":
-            update_rating.delay(game.white_user.id, rating_changes["w"].win)
-            update_rating.delay(game.black_user.id, rating_changes["b"].lose)
-            data['rating_deltas'] = {
-                'w': rating_changes['w'].win,
-                'b': rating_changes['b'].lose
-            }
-        elif result == "1/2-1/2":
-            update_rating.delay(game.white_user.id, rating_changes["w"].draw)
-            update_rating.delay(game.black_user.id, rating_changes["b"].draw)
-            data['rating_deltas'] = {
-                'w': rating_changes['w'].draw,
-                'b': rating_changes['b'].draw
-            }
-        elif result == "0-1":
-            update_rating.delay(game.white_user.id, rating_changes["w"].lose)
-            update_rating.delay(game.black_user.id, rating_changes["b"].win)
-            data['rating_deltas'] = {
-                'w': rating_changes['w'].lose,
-                'b': rating_changes['b'].win
-            }
-    else:
-        data['rating_deltas'] = {
-            'w': 0,
-            'b': 0
-        }
 
-    data['reason'] = reason
-    sio.emit('game_ended', data, room=game.white_user.sid)
-    sio.emit('game_ended', data, room=game.black_user.sid)
-
-    update_k_factor.delay(game.white_user.id)
-    update_k_factor.delay(game.black_user.id)
+        white_user, black_user = game.white_user, game.black_user
+        if update_stats and result in RESULT_SCORES:
+            rating_changes = get_rating_changes_of(white_user, black_user)
+            white_score, black_score = RESULT_SCORES[result]
+            rating_deltas['w'] = getattr(rating_changes['w'], white_score)
+            rating_deltas['b'] = getattr(rating_changes['b'], black_score)
+
+        for user, delta in ((white_user, rating_deltas['w']),
+                            (black_user, rating_deltas['b'])):
+            user.cur_game_id = None
+            if update_stats:
+                user.games_played += 1
+                user.append_game_id(game_id)
+                user.rating += delta
+                user.k_factor = get_k_factor(user)
+        return [game, white_user, black_user]
+
+    if not concurrency.transact(
+        (game._pk, game.white_user._pk, game.black_user._pk),
+        load_and_mutate, app.config['CONTENTION_STATS']
+    ):
+        return None
+    return game, rating_deltas
 
 
 @celery.task(name="on_first_move_timed_out", ignore_result=True)
 def on_first_move_timed_out(game_id: int) -> None:
     """Interrupts game because of user didn't make first move for too long"""
+    game = Game.get(game_id)
+
+    eta = game.first_move_timed_out_eta
+    if not eta or eta > datetime.utcnow():
+        return  # The timer was cancelled or armed again after it expired
+
     end_game.delay(game_id, "-", 'Game cancelled.', update_stats=False)
 
 
@@ -533,6 +599,13 @@ def on_disconnect_timed_out(user_id: int, game_id: int) -> None:
 
     is_user_white = user_id == game.white_user.id
 
+    if is_user_white:
+        eta = game.white_disconnect_timed_out_eta
+    else:
+        eta = game.black_disconnect_timed_out_eta
+    if not eta or eta > datetime.utcnow():
+        return  # The user has reconnected or disconnected again since
+
     result: str
     reason: str
     if is_user_white:
@@ -550,10 +623,19 @@ def on_time_is_up(user_id: int, game_id: int) -> None:
     """Interrupts game because of user's time is up"""
     game = Game.get(game_id)
 
-    board = game.get_board()
-
     is_user_white = user_id == game.white_user.id
 
+    if game.is_finished or\
+            (game.get_next_to_move() == chess.WHITE) != is_user_white:
+        return  # The user has moved right before the timer expired
+
+    clock = game.white_clock if is_user_white else game.black_clock
+    if not game.last_move_datetime or\
+            game.last_move_datetime + clock > datetime.utcnow():
+        return  # The timer is stale, e.g. the user and the opp have moved
+
+    board = game.get_board()
+
     result: str
     reason: str
     # Finish game with draw if other player has insufficient material to win
@@ -598,12 +680,26 @@ class RatingChange:
                 "lose": self.lose}
 
 
+# Attributes of RatingChange of white and black for each result
+RESULT_SCORES = {
+    '1-0': ('win', 'lose'),
+    '1/2-1/2': ('draw', 'draw'),
+    '0-1': ('lose', 'win'),
+}
+
+
 def get_rating_changes(game_id: int) -> Dict[str, RatingChange]:
     '''Returns rating changes for game in dict.
         Example: {"w": RatingChange, "b": RatingChange}'''
     game = Game.get(game_id)
-    r_white = game.white_user.rating
-    r_black = game.black_user.rating
+    return get_rating_changes_of(game.white_user, game.black_user)
+
+
+def get_rating_changes_of(white_user: User, black_user: User
+                          ) -> Dict[str, RatingChange]:
+    '''Like get_rating_changes(...), but for the players'''
+    r_white = white_user.rating
+    r_black = black_user.rating
 
     R_white = 10 ** (r_white / 400)
     R_black = 10 ** (r_black / 400)
@@ -613,8 +709,8 @@ def get_rating_changes(game_id: int) -> Dict[str, RatingChange]:
     E_white = R_white / R_sum
     E_black = R_black / R_sum
 
-    k_factor_white = game.white_user.k_factor
-    k_factor_black = game.black_user.k_factor
+    k_factor_white = white_user.k_factor
+    k_factor_black = black_user.k_factor
 
     rating_change_white = RatingChange.from_formula(k_factor_white, E_white)
     rating_change_black = RatingChange.from_formula(k_factor_black, E_black)
@@ -623,97 +719,168 @@ def get_rating_changes(game_id: int) -> Dict[str, RatingChange]:
             "b": rating_change_black}
 
 
+def get_k_factor(user: User) -> int:
+    '''K-factor of the user by FIDE rules (after 2014)'''
+    k_factor = user.k_factor
+    if k_factor == 40 and user.games_played >= 30:
+        k_factor = 20
+
+    if k_factor == 20 and user.games_played >= 3 and user.rating >= 2400:
+        k_factor = 10
+    return k_factor
+
+
+# update_k_factor and update_rating aren't sent by end_game anymore,
+# they serve the tasks sent by older workers.
+
 @celery.task(name="update_k_factor", ignore_result=True)
 def update_k_factor(user_id: int) -> None:
     '''Updates k_factor by FIDE rules (after 2014)'''
     user = User.get(user_id)
 
-    with rom.util.EntityLock(user, 10, 10):
-        if user.k_factor == 40 and user.games_played >= 30:
-            user.k_factor = 20
-            user.save()
+    def update_k(user: User) -> Optional[bool]:
+        k_factor = user.k_factor
+        user.k_factor = get_k_factor(user)
+        if user.k_factor == k_factor:
+            return False
 
-        if (user.k_factor == 20 and user.games_played >= 3
-                and user.rating >= 2400):
-            user.k_factor = 10
-            user.save()
+    update(user, update_k)
 
 
 @celery.task(name="update_rating", ignore_result=True)
 def update_rating(user_id: int, rating_delta: int) -> None:
     '''Update database info about user's rating'''
     user = User.get(user_id)
-    with rom.util.EntityLock(user, 10, 10):
+
+    def add_delta(user: User) -> None:
         user.rating += rating_delta
-        user.save()
+
+    update(user, add_delta)
 
 
 @celery.task(name="search_game", ignore_result=True)
 def search_game(user_id: int, minutes: int) -> None:
-    '''If there is appropriate game request, it starts a new game.
-       Else it makes the game request and adds it to the database.'''
+    '''If there is an appropriate opponent in the pool, it starts a new game.
+       Else it adds the user to the pool.'''
     user = User.get(user_id)
 
-    if minutes not in (1, 2, 3, 5, 10, 15, 20, 30, 60):
+    if minutes not in matchmaking.TIME_CONTROLS:
         return
 
     seconds = minutes * 60
 
-    with rom.util.EntityLock(user, 10, 10):
-        game_requests = \
-                rom.query.Query(GameRequest).filter(time=seconds).all()
-
-        added_to_existed = False
-        if game_requests:
-            accepted_request = \
-                min(game_requests,
-                    key=lambda x: abs(User.get(x.user_id).rating - user.rating))
-            if abs(user.rating -
-                   User.get(accepted_request.user_id).rating) <= 200:
-                added_to_existed = True
-
-                accepted_request.delete()
-                user_to_play_with = User.get(accepted_request.user_id)
-
-                game = Game(
-                    white_user=user,
-                    black_user=user_to_play_with,
-                    white_rating=user.rating,
-                    black_rating=user_to_play_with.rating,
-                    is_started=0,
-                )
-                tdelta = timedelta(seconds=seconds)
-                game.total_clock = tdelta
-                game.white_clock = tdelta
-                game.black_clock = tdelta
-                game.save()
-
-                user.cur_game_id = game.id
-                user.save()
-
-                with rom.util.EntityLock(user_to_play_with, 10, 10):
-                    user_to_play_with.cur_game_id = game.id
-                    user_to_play_with.in_search = False
-                    user_to_play_with.save()
-
-                sio.emit(
-                    'redirect',
-                    {'url': f'/game/{game.id}'},
-                    room=user.sid,
-                )
-                sio.emit(
-                    'redirect',
-                    {'url': f'/game/{game.id}'},
-                    room=user_to_play_with.sid,
-                )
-                start_game.delay(game.id)
-
-        if added_to_existed is False:
-            user.in_search = True
-            user.save()
-
-            game_request = GameRequest(time=seconds, user_id=user_id)
-            game_request.save()
+    def start_search(user: User) -> None:
+        user.in_search = True
+
+    # The flag is set before the user is added to the pool, so
+    # cancel_search(...) can't leave it set without a search
+    update(user, start_search)
+
+    if app.config['MATCHMAKING_TICK']:
+        # The user will be paired by a matchmaking tick
+        matchmaking.add(user_id, user.rating, seconds)
+        opponent_id = None
+    else:
+        opponent_id = matchmaking.search(user_id, user.rating, seconds)
+
+    if opponent_id is None:
+        # The search could be cancelled after the flag was set, but before
+        # the user was added. It can't be cancelled by the user then.
+        user.refresh(force=True)
+        if not user.in_search:
+            matchmaking.remove(user_id)
+        return
+
+    user_to_play_with = User.get(opponent_id)
+
+    game = Game(
+        white_user=user,
+        black_user=user_to_play_with,
+        white_rating=user.rating,
+        black_rating=user_to_play_with.rating,
+        is_started=0,
+    )
+    tdelta = timedelta(seconds=seconds)
+    game.total_clock = tdelta
+    game.white_clock = tdelta
+    game.black_clock = tdelta
+    game.save()
+
+    def join(user: User) -> None:
+        user.cur_game_id = game.id
+        user.in_search = False
+
+    update(user, join)
+    update(user_to_play_with, join)
+
+    sio.emit(
+        'redirect',
+        {'url': f'/game/{game.id}'},
+        room=user.sid,
+    )
+    sio.emit(
+        'redirect',
+        {'url': f'/game/{game.id}'},
+        room=user_to_play_with.sid,
+    )
+    start_game.delay(game.id)
+
+
+def start_games(pairs: List[Tuple[int, int]], seconds: int) -> None:
+    '''Creates games for the pairs claimed by a matchmaking tick.
+       Games and users are written in one round trip.'''
+    users = User.get([user_id for pair in pairs for user_id in pair])
+    users = {user.id: user for user in users if user is not None}
+    tdelta = timedelta(seconds=seconds)
+
+    games = list()
+    started_pairs = list()
+    for white_user_id, black_user_id in pairs:
+        white_user = users.get(white_user_id)
+        black_user = users.get(black_user_id)
+        if white_user is None or black_user is None:
+            # E.g. the user was deleted, the opponent keeps searching
+            for user in (white_user, black_user):
+                if user is not None:
+                    matchmaking.add(user.id, user.rating, seconds)
+                    del users[user.id]
+            continue
+        started_pairs.append((white_user_id, black_user_id))
+
+        game = Game(
+            white_user=white_user,
+            black_user=black_user,
+            white_rating=white_user.rating,
+            black_rating=black_user.rating,
+            is_started=0,
+        )
+        game.total_clock = tdelta
+        game.white_clock = tdelta
+        game.black_clock = tdelta
+        games.append(game)
+
+        for user in (white_user, black_user):
+            user.cur_game_id = game.id
+            user.in_search = False
+
+    # Users updated meanwhile are saved one by one
+    for user in save_many(games + list(users.values())):
+        game_id = user.cur_game_id
+
+        def join(user: User) -> None:
+            user.cur_game_id = game_id
+            user.in_search = False
+
+        update(user, join)
+
+    for game, pair in zip(games, started_pairs):
+        for user_id in pair:
+            sio.emit(
+                'redirect',
+                {'url': f'/game/{game.id}'},
+                room=users[user_id].sid,
+            )
+        start_game.delay(game.id)
 
 
 @celery.task(name="cancel_search", ignore_result=True)
@@ -721,10 +888,28 @@ def cancel_search(user_id: int):
     '''Cancel game search, if it's possible'''
     user = User.get(user_id)
 
-    with rom.util.EntityLock(user, 10, 10):
+    def stop_search(user: User) -> None:
         user.in_search = False
-        user.save()
 
-    game_request = GameRequest.get_by(user_id=user_id, _limit=(0, 1))
-    if game_request:
-        game_request[0].delete()
+    update(user, stop_search)
+    matchmaking.remove(user_id)
+
+
+@celery.task(name="process_avatar", ignore_result=True)
+def process_avatar(user_id: int, upload_path: str) -> None:
+    '''Saves variants of the uploaded avatar and sets it to the user'''
+    try:
+        avatar_hash = avatars.save_variants(upload_path)
+    except avatars.INVALID_IMAGE_ERRORS:  # It isn't an image after all
+        return
+    finally:
+        os.remove(upload_path)
+
+    user = User.get(user_id)
+
+    def set_avatar(user: User) -> Optional[bool]:
+        if user.avatar_hash == avatar_hash:
+            return False
+        user.avatar_hash = avatar_hash
+
+    update(user, set_avatar)
@@ -0,0 +1,110 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from threading import local
+from typing import Dict, Optional
+import redis
+import rom.util
+
+
+# rom's session is used as the identity map: inside a scope every entity is
+# loaded at most once. A scope is opened for every Celery task (see
+# flask_celery), the session is also cleared after every Flask request
+# and Socket.IO event.
+
+STATS_KEY = 'stats:round_trips'  # Hash: "<task>:runs", "<task>:round_trips"
+
+_local = local()
+
+
+class CountingConnection(redis.Connection):
+    '''Counts round trips, a pipeline is sent at once'''
+
+    def send_packed_command(self, *args, **kwargs):
+        _local.round_trips = get_round_trips() + 1
+        return super().send_packed_command(*args, **kwargs)
+
+
+def get_round_trips() -> int:
+    '''Round trips made by the current thread (greenlet under gevent)'''
+    return getattr(_local, 'round_trips', 0)
+
+
+def set_connection_settings(**kwargs) -> None:
+    '''Like rom.util.set_connection_settings(...), but round trips
+       are counted'''
+    pool = redis.ConnectionPool(connection_class=CountingConnection, **kwargs)
+    rom.util.set_connection_settings(connection_pool=pool)
+
+
+@contextmanager
+def scope(name: Optional[str] = None, record_stats: bool = False):
+    '''Entities are cached till the outermost scope is closed.
+       If record_stats is True, round trips made inside are added
+       to the name's stats.'''
+    depth = getattr(_local, 'depth', 0)
+    _local.depth = depth + 1
+    round_trips = get_round_trips()
+    try:
+        yield
+    finally:
+        _local.depth = depth
+        if depth == 0:
+            rom.util.session.rollback()
+
+        if record_stats and name:
+            end_round_trips = get_round_trips()
+            pipe = rom.util.get_connection().pipeline(False)
+            pipe.hincrby(STATS_KEY, f"{name}:runs", 1)
+            pipe.hincrby(STATS_KEY, f"{name}:round_trips",
+                         end_round_trips - round_trips)
+            pipe.execute()
+            # Recording isn't counted in the outer scopes
+            _local.round_trips = end_round_trips
+
+
+def get_stats() -> Dict[str, float]:
+    '''Average round trips per run of each name'''
+    stats = rom.util.get_connection().hgetall(STATS_KEY)
+    result = dict()
+    for key, runs in stats.items():
+        name, field = key.decode().rsplit(':', 1)
+        if field == 'runs':
+            round_trips = int(stats.get(f"{name}:round_trips".encode(), 0))
+            result[name] = round_trips / int(runs)
+    return result
+
+
+if __name__ == '__main__':
+    from hydraChess.config import ProductionConfig
+
+    parser = ArgumentParser(
+        description="Prints average round trips to Redis per task. Set "
+                    "REDIS_ROUND_TRIPS_STATS in the config to collect them."
+    )
+    parser.add_argument('--db', type=int,
+                        default=ProductionConfig.REDIS_DB_ID)
+    parser.add_argument('--reset', action='store_true',
+                        help="delete collected stats")
+    args = parser.parse_args()
+
+    rom.util.set_connection_settings(db=args.db)
+    if args.reset:
+        rom.util.get_connection().delete(STATS_KEY)
+    for name, round_trips in sorted(get_stats().items()):
+        print(f"{name:30} {round_trips:6.1f}")
@@ -0,0 +1,309 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+from typing import Callable, Dict, List, Optional, Tuple
+from time import sleep, time
+import logging
+import rom.util
+from hydraChess import identity_map
+
+
+TIME_CONTROLS = (1, 2, 3, 5, 10, 15, 20, 30, 60)  # Minutes
+
+# Every user has at most one search. It's registered in SEEKERS_KEY first,
+# and the user is added to the pool when no opponent was found. Users are
+# claimed atomically, so searches may run concurrently.
+SEEKERS_KEY = 'seekers'  # Hash: user id -> "seconds:search start timestamp"
+POOL_KEY = 'seekers:{}'  # Sorted set per time control: user id -> rating
+
+RATING_WINDOW = 200
+RATING_WINDOW_GROWTH = 10  # Per second of waiting
+MAX_RATING_WINDOW = 600
+CANDIDATES = 16  # Closest seekers checked on each side of the rating
+
+ADD_LUA = '''
+if ARGV[4] == '1' then
+    if redis.call('HSETNX', KEYS[1], ARGV[1], ARGV[3]) == 0 then
+        return 0
+    end
+elseif redis.call('HGET', KEYS[1], ARGV[1]) ~= ARGV[3] then
+    return 0
+end
+redis.call('ZADD', KEYS[2], ARGV[2], ARGV[1])
+return 1
+'''
+
+CLAIM_LUA = '''
+if redis.call('ZREM', KEYS[2], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+return 1
+'''
+
+CLAIM_PAIRS_LUA = '''
+local claimed = {}
+for i = 1, #ARGV, 2 do
+    if redis.call('ZSCORE', KEYS[2], ARGV[i]) and
+            redis.call('ZSCORE', KEYS[2], ARGV[i + 1]) then
+        redis.call('ZREM', KEYS[2], ARGV[i], ARGV[i + 1])
+        redis.call('HDEL', KEYS[1], ARGV[i], ARGV[i + 1])
+        claimed[#claimed + 1] = ARGV[i]
+        claimed[#claimed + 1] = ARGV[i + 1]
+    end
+end
+return claimed
+'''
+
+REMOVE_LUA = '''
+local seeker = redis.call('HGET', KEYS[1], ARGV[1])
+if not seeker then
+    return 0
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+redis.call('ZREM', ARGV[2] .. string.match(seeker, '^%d+'), ARGV[1])
+return 1
+'''
+
+logger = logging.getLogger(__name__)
+
+
+def get_rating_window(waiting_time: float) -> float:
+    return min(RATING_WINDOW + RATING_WINDOW_GROWTH * waiting_time,
+               MAX_RATING_WINDOW)
+
+
+def _add(user_id: int, rating: int, seconds: int, seeker: str,
+         is_new: bool) -> bool:
+    conn = rom.util.get_connection()
+    add_lua = conn.register_script(ADD_LUA)
+    return bool(add_lua(keys=[SEEKERS_KEY, POOL_KEY.format(seconds)],
+                        args=[user_id, rating, seeker, int(is_new)]))
+
+
+def add(user_id: int, rating: int, seconds: int,
+        now: Optional[float] = None) -> bool:
+    '''Adds the user to the pool of the time control.
+       Returns False if the user is already searching.'''
+    now = time() if now is None else now
+    return _add(user_id, rating, seconds, f"{seconds}:{now}", True)
+
+
+def claim(user_id: int, seconds: int) -> bool:
+    '''Takes the user out of the pool of the time control.
+       Returns False if the user isn't there (e.g. was claimed already).'''
+    conn = rom.util.get_connection()
+    claim_lua = conn.register_script(CLAIM_LUA)
+    return bool(claim_lua(keys=[SEEKERS_KEY, POOL_KEY.format(seconds)],
+                          args=[user_id]))
+
+
+def remove(user_id: int) -> bool:
+    '''Cancels the user's search. Returns False if there was no search.'''
+    conn = rom.util.get_connection()
+    remove_lua = conn.register_script(REMOVE_LUA)
+    return bool(remove_lua(keys=[SEEKERS_KEY],
+                           args=[user_id, POOL_KEY.format('')]))
+
+
+def find_opponent(rating: int, seconds: int,
+                  now: Optional[float] = None,
+                  exclude: Optional[int] = None) -> Optional[int]:
+    '''Returns id of the seeker with the closest rating, whose rating window
+       includes the rating. The window widens while the seeker waits.
+       The seeker with exclude id is skipped.'''
+    conn = rom.util.get_connection()
+    now = time() if now is None else now
+    pool_key = POOL_KEY.format(seconds)
+
+    pipe = conn.pipeline(False)
+    pipe.zrevrangebyscore(pool_key, rating, rating - MAX_RATING_WINDOW,
+                          start=0, num=CANDIDATES, withscores=True)
+    pipe.zrangebyscore(pool_key, f"({rating}", rating + MAX_RATING_WINDOW,
+                       start=0, num=CANDIDATES, withscores=True)
+    lower, upper = pipe.execute()
+
+    candidates = sorted(lower + upper, key=lambda x: abs(x[1] - rating))
+    if exclude is not None:
+        candidates = [candidate for candidate in candidates
+                      if int(candidate[0]) != exclude]
+    if not candidates:
+        return None
+
+    seekers = conn.hmget(SEEKERS_KEY, [user_id for user_id, _ in candidates])
+    for (user_id, candidate_rating), seeker in zip(candidates, seekers):
+        if seeker is None:
+            continue
+        since = float(seeker.split(b':')[1])
+        if abs(candidate_rating - rating) <= get_rating_window(now - since):
+            return int(user_id)
+
+    return None
+
+
+def search(user_id: int, rating: int, seconds: int,
+           now: Optional[float] = None) -> Optional[int]:
+    '''Takes the closest appropriate opponent out of the pool and returns
+       his id. If there is no one, adds the user to the pool and returns None.
+       Does nothing if the user is already searching.'''
+    conn = rom.util.get_connection()
+    now = time() if now is None else now
+    seeker = f"{seconds}:{now}"
+
+    if not conn.hsetnx(SEEKERS_KEY, user_id, seeker):
+        return None
+
+    while True:
+        opponent_id = find_opponent(rating, seconds, now, user_id)
+        if opponent_id is None:
+            break
+        if claim(opponent_id, seconds):
+            conn.hdel(SEEKERS_KEY, user_id)
+            return opponent_id
+
+    # The search could be cancelled meanwhile
+    if not _add(user_id, rating, seconds, seeker, False):
+        return None
+
+    # A seeker, who has arrived at the same time, could miss the user and
+    # be added too. Both look again, the first to claim the pair wins.
+    while True:
+        opponent_id = find_opponent(rating, seconds, now, user_id)
+        if opponent_id is None:
+            return None
+        if claim_pairs([(user_id, opponent_id)], seconds):
+            return opponent_id
+        if conn.zscore(POOL_KEY.format(seconds), user_id) is None:
+            return None  # Claimed by another seeker or cancelled
+
+
+def get_pools() -> Dict[int, List[Tuple[int, int, float]]]:
+    '''Returns (user id, rating, search start timestamp) of every seeker
+       in the pool for each time control'''
+    conn = rom.util.get_connection()
+    pipe = conn.pipeline(False)
+    for minutes in TIME_CONTROLS:
+        pipe.zrange(POOL_KEY.format(minutes * 60), 0, -1, withscores=True)
+    pools = pipe.execute()
+
+    for pool in pools:
+        if pool:
+            pipe.hmget(SEEKERS_KEY, [user_id for user_id, _ in pool])
+    seekers = iter(pipe.execute())
+
+    result = dict()
+    for minutes, pool in zip(TIME_CONTROLS, pools):
+        if not pool:
+            continue
+        result[minutes * 60] = [
+            (int(user_id), int(rating), float(seeker.split(b':')[1]))
+            for (user_id, rating), seeker in zip(pool, next(seekers))
+            if seeker is not None
+        ]
+    return result
+
+
+def pair_seekers(seekers: List[Tuple[int, int, float]],
+                 now: Optional[float] = None) -> List[Tuple[int, int]]:
+    '''Pairs as many seekers as possible, minimizing the total rating
+       difference. Seekers can be paired if the rating window of the one who
+       waits longer includes the other's rating.'''
+    now = time() if now is None else now
+    seekers = sorted(seekers, key=lambda seeker: seeker[1])
+
+    # best[i] is (pairs count, -rating difference) for the first i seekers.
+    # It's enough to pair neighbours: if x < y < z and x can be paired with
+    # z, y can be paired with one of them too, with smaller difference.
+    best = [(0, 0)] * (len(seekers) + 1)
+    paired = [False] * (len(seekers) + 1)
+    for i in range(2, len(seekers) + 1):
+        best[i] = best[i - 1]
+        first, second = seekers[i - 2], seekers[i - 1]
+        difference = second[1] - first[1]
+        waiting_time = now - min(first[2], second[2])
+        if difference <= get_rating_window(waiting_time):
+            option = (best[i - 2][0] + 1, best[i - 2][1] - difference)
+            if option > best[i]:
+                best[i] = option
+                paired[i] = True
+
+    pairs = list()
+    i = len(seekers)
+    while i >= 2:
+        if paired[i]:
+            pairs.append((seekers[i - 2][0], seekers[i - 1][0]))
+            i -= 2
+        else:
+            i -= 1
+    return pairs
+
+
+def claim_pairs(pairs: List[Tuple[int, int]],
+                seconds: int) -> List[Tuple[int, int]]:
+    '''Takes the pairs out of the pool of the time control.
+       Returns the pairs, whose both users still were there.'''
+    if not pairs:
+        return list()
+
+    conn = rom.util.get_connection()
+    claim_pairs_lua = conn.register_script(CLAIM_PAIRS_LUA)
+    claimed = claim_pairs_lua(
+        keys=[SEEKERS_KEY, POOL_KEY.format(seconds)],
+        args=[user_id for pair in pairs for user_id in pair]
+    )
+    claimed = list(map(int, claimed))
+    return list(zip(claimed[::2], claimed[1::2]))
+
+
+def tick(now: Optional[float] = None) -> Dict[int, List[Tuple[int, int]]]:
+    '''Pairs the whole pool at once. Returns claimed pairs for each
+       time control.'''
+    result = dict()
+    for seconds, seekers in get_pools().items():
+        pairs = claim_pairs(pair_seekers(seekers, now), seconds)
+        if pairs:
+            result[seconds] = pairs
+    return result
+
+
+def run(interval: float,
+        start_games: Callable[[List[Tuple[int, int]], int], None]) -> None:
+    '''Runs a tick every interval seconds and passes claimed pairs of each
+       time control to start_games(pairs, seconds), never returns'''
+    while True:
+        started_at = time()
+        try:
+            claimed = tick()
+        except Exception:
+            logger.exception("Matchmaking tick failed")
+            claimed = dict()
+
+        for seconds, pairs in claimed.items():
+            try:
+                with identity_map.scope():
+                    start_games(pairs, seconds)
+            except Exception:
+                logger.exception(f"Failed to start games of pairs {pairs}")
+        sleep(max(0, started_at + interval - time()))
+
+
+if __name__ == '__main__':
+    from hydraChess.game_management import app, start_games
+    if not app.config['MATCHMAKING_TICK']:
+        raise SystemExit("MATCHMAKING_TICK isn't set, searches are paired "
+                         "on arrival")
+    run(app.config['MATCHMAKING_TICK'] / 1000, start_games)
@@ -0,0 +1,163 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from contextlib import contextmanager
+from time import perf_counter, time
+from typing import Callable, Iterable
+import os
+from celery.signals import before_task_publish, worker_init,\
+    worker_process_shutdown
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram,\
+    REGISTRY, generate_latest, multiprocess, start_http_server
+from prometheus_client.core import GaugeMetricFamily
+import redis
+import rom.util
+from hydraChess.matchmaking import SEEKERS_KEY
+
+
+# Task metrics are collected by Celery workers. Prefork workers must have
+# the prometheus_multiproc_dir environment variable set to an empty
+# directory, and METRICS_PORT to the port of the worker's metrics server.
+# Web servers expose task metrics of eager tasks and the gauges below
+# on /metrics.
+
+LIVE_GAMES_KEY = 'games:live'  # Set of started and not finished games
+
+TASK_RUN_TIME = Histogram(
+    'hydrachess_task_run_seconds', 'Run time of tasks', ['task']
+)
+TASK_QUEUE_WAIT = Histogram(
+    'hydrachess_task_queue_wait_seconds',
+    'Time from sending tasks to starting them', ['task']
+)
+MOVE_LATENCY = Histogram(
+    'hydrachess_move_latency_seconds',
+    "Time from the make_move socket event to the game_updated emit"
+)
+
+# Board caches of all processes are summed up, sizes are per process
+BOARD_CACHE_HITS = Counter(
+    'hydrachess_board_cache_hits', 'Boards taken from the board cache'
+)
+BOARD_CACHE_MISSES = Counter(
+    'hydrachess_board_cache_misses', 'Boards replayed on a board cache miss'
+)
+BOARD_CACHE_EVICTIONS = Counter(
+    'hydrachess_board_cache_evictions',
+    'Boards evicted from a full board cache'
+)
+BOARD_CACHE_SIZE = Gauge(
+    'hydrachess_board_cache_size', 'Boards in the board cache of the process',
+    multiprocess_mode='liveall'
+)
+
+
+@before_task_publish.connect
+def stamp_sent_at(headers=None, **kwargs) -> None:
+    headers['sent_at'] = time()
+
+
+def get_sent_at(task) -> float:
+    '''Time the current request of the task was sent at, None if unknown'''
+    return getattr(task.request, 'sent_at', None)
+
+
+@contextmanager
+def observe_task(task):
+    sent_at = get_sent_at(task)
+    if sent_at is not None:
+        TASK_QUEUE_WAIT.labels(task.name).observe(time() - sent_at)
+
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        TASK_RUN_TIME.labels(task.name).observe(perf_counter() - start)
+
+
+def observe_move_latency(task) -> None:
+    '''Called by make_move after emitting game_updated'''
+    sent_at = get_sent_at(task)
+    if sent_at is not None:
+        MOVE_LATENCY.observe(time() - sent_at)
+
+
+def game_started(game_id: int) -> None:
+    rom.util.get_connection().sadd(LIVE_GAMES_KEY, game_id)
+
+
+def game_ended(game_id: int) -> None:
+    rom.util.get_connection().srem(LIVE_GAMES_KEY, game_id)
+
+
+class WebCollector:
+    '''Gauges of the whole site and of the web server, read on scrape'''
+
+    def __init__(self, broker_url: str, queues: Iterable[str],
+                 get_connected_sockets: Callable[[], int]):
+        self.broker = redis.Redis.from_url(broker_url)
+        self.queues = list(queues)
+        self.get_connected_sockets = get_connected_sockets
+
+    def collect(self):
+        pipe = rom.util.get_connection().pipeline(False)
+        pipe.scard(LIVE_GAMES_KEY)
+        pipe.hlen(SEEKERS_KEY)
+        live_games, seekers = pipe.execute()
+
+        pipe = self.broker.pipeline(False)
+        for queue in self.queues:
+            pipe.llen(queue)
+        depths = pipe.execute()
+
+        yield GaugeMetricFamily('hydrachess_live_games', 'Live games',
+                                value=live_games)
+        yield GaugeMetricFamily('hydrachess_seekers',
+                                'Users searching for a game', value=seekers)
+        yield GaugeMetricFamily('hydrachess_connected_sockets',
+                                'Sockets connected to this web server',
+                                value=self.get_connected_sockets())
+
+        queue_depth = GaugeMetricFamily('hydrachess_queue_depth',
+                                        'Tasks waiting in the queue',
+                                        labels=['queue'])
+        for queue, depth in zip(self.queues, depths):
+            queue_depth.add_metric([queue], depth)
+        yield queue_depth
+
+
+def generate() -> bytes:
+    return generate_latest(REGISTRY)
+
+
+@worker_init.connect
+def start_worker_server(**kwargs) -> None:
+    port = os.environ.get('METRICS_PORT')
+    if not port:
+        return
+
+    if 'prometheus_multiproc_dir' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    start_http_server(int(port), registry=registry)
+
+
+@worker_process_shutdown.connect
+def mark_process_dead(pid=None, **kwargs) -> None:
+    if 'prometheus_multiproc_dir' in os.environ:
+        multiprocess.mark_process_dead(pid)
@@ -15,13 +15,82 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 
-from typing import List
+from typing import Dict, List, Iterable, Optional, Tuple
 from datetime import timedelta
-from werkzeug.security import generate_password_hash, check_password_hash
-from chess import Board, WHITE, BLACK
+from math import isfinite
+from time import time
+import json
+import struct
+from chess import Board, Move, WHITE, BLACK, STARTING_FEN
 from flask_login import UserMixin
+import redis
 import rom
 import rom.util
+from hydraChess import passwords
+
+
+def pack_move(move: Move) -> bytes:
+    '''Packs the move into 2 bytes: 6 bits for each square
+       and 3 bits for the promotion piece type'''
+    promotion = move.promotion - 1 if move.promotion else 0
+    return struct.pack('<H', move.from_square | move.to_square << 6 |
+                       promotion << 12)
+
+
+def unpack_moves(data: bytes) -> Iterable[Move]:
+    for (code, ) in struct.iter_unpack('<H', data):
+        promotion = code >> 12
+        yield Move(code & 63, code >> 6 & 63,
+                   promotion + 1 if promotion else None)
+
+
+def save_many(entities: Iterable[rom.Model],
+              pipe: Optional[redis.client.Pipeline] = None
+              ) -> List[rom.Model]:
+    '''Saves changes of the entities in one round trip. Like save(), it
+       doesn't write an entity, whose changed columns were updated by another
+       writer. Returns such entities. Game moves aren't saved.
+       Played games appended to users are saved even if the users aren't.
+       A transaction can be passed as pipe, see concurrency.transact(...).'''
+    if pipe is None:
+        pipe = rom.util.get_connection().pipeline(False)
+
+    entities = list(entities)
+    for entity in entities:
+        if isinstance(entity, User) and entity._appended_game_ids:
+            pipe.zadd(entity.games_key, entity._appended_game_ids)
+
+    pending = list()
+    for entity in entities:
+        bump_version(entity)
+        is_new = entity._new
+        _, data = entity._apply_changes(entity._last, entity.to_dict(),
+                                        full=is_new, is_new=is_new,
+                                        _conn=pipe)
+        pending.append((entity, data))
+
+    raced = list()
+    results = pipe.execute()[-len(pending):]
+    for (entity, data), result in zip(pending, results):
+        if isinstance(entity, User):
+            entity._appended_game_ids = dict()
+        result = json.loads(result)
+        if 'race' in result or 'unique' in result:
+            raced.append(entity)
+            continue
+        entity._last = data
+        entity._new = False
+        entity._modified = False
+
+    return raced
+
+
+def bump_version(entity: rom.Model) -> None:
+    '''Increments the version of the changed entity before it's written.
+       rom checks values of the changed columns, which were loaded, so
+       another write of the entity since it was loaded fails the save.'''
+    if entity._new or entity._modified:
+        entity.version = int(entity._last.get('version') or 0) + 1
 
 
 class User(rom.Model, UserMixin):
@@ -34,7 +103,8 @@ class User(rom.Model, UserMixin):
     rating = rom.Integer(default=1200)
 
     games_played = rom.Integer(default=0)
-    raw_game_ids = rom.Text(default="")  # LIFO
+    # Played games are stored in a separate sorted set by finish time,
+    # see games_key
     cur_game_id = rom.Integer(default=None)
 
     k_factor = rom.Integer(default=40)
@@ -46,30 +116,130 @@ class User(rom.Model, UserMixin):
 
     avatar_hash = rom.Text(default="default")
 
+    version = rom.Integer(default=0)  # Incremented by every write
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._appended_game_ids = dict()
+
+    @property
+    def games_key(self) -> str:
+        return f"{self._pk}:games"
+
     @property
     def game_ids(self) -> List[int]:
-        if self.raw_game_ids:
-            return list(map(int, self.raw_game_ids.split(',')))
-        return list()
-
-    @game_ids.setter
-    def game_ids(self, val: List[int]) -> None:
-        if val:
-            self.raw_game_ids = ','.join(val)
-        else:
-            self.raw_game_ids = ""
-
-    def append_game_id(self, game_id: int) -> None:
-        if self.raw_game_ids:
-            self.raw_game_ids = f"{game_id},{self.raw_game_ids}"
-        else:
-            self.raw_game_ids = f"{game_id}"
+        '''Ids of all played games, the last finished goes first'''
+        return list(map(int, self._connection.zrevrange(self.games_key,
+                                                        0, -1)))
+
+    def get_game_ids_page(self, cursor: Optional[str], size: int,
+                          start: int = 0) -> Tuple[List[int], Optional[str]]:
+        '''Returns ids of size played games going after the cursor, the last
+           finished goes first, and the cursor of the next page (None if it's
+           the last page). Without the cursor the page begins with the start-th
+           game. Raises ValueError if the cursor is malformed
+           (e.g. its score isn't finite).'''
+        max_score, last_id = '+inf', None
+        if cursor is not None:
+            max_score, last_id = cursor.split(':')
+            max_score, last_id = float(max_score), str(int(last_id)).encode()
+            if not isfinite(max_score):  # Redis rejects NaN as a score
+                raise ValueError(f"Non-finite score of cursor {cursor}")
+            start = 0
+
+        # Games finished at the same moment as the cursor's one go after it
+        # in the reversed order of ids' bytes, like in ZREVRANGEBYSCORE
+        page = list()
+        offset = start
+        while len(page) <= size:
+            chunk = self._connection.zrevrangebyscore(
+                self.games_key, max_score, '-inf',
+                start=offset, num=size + 1, withscores=True
+            )
+            for game_id, score in chunk:
+                if last_id is None or score < max_score or game_id < last_id:
+                    page.append((game_id, score))
+            if len(chunk) < size + 1:
+                break
+            offset += len(chunk)
+
+        next_cursor = None
+        if len(page) > size:
+            game_id, score = page[size - 1]
+            next_cursor = f"{score!r}:{int(game_id)}"
+        return [int(game_id) for game_id, _ in page[:size]], next_cursor
+
+    def append_game_id(self, game_id: int,
+                       finished_at: Optional[float] = None) -> None:
+        '''Adds the game to played ones on save()'''
+        finished_at = time() if finished_at is None else finished_at
+        self._appended_game_ids[game_id] = finished_at
 
     def set_password(self, password: str) -> None:
-        self.hashed_password = generate_password_hash(password)
+        '''Waits for the hash without blocking other greenlets'''
+        self.hashed_password = passwords.generate_hash(password)
 
     def check_password(self, password: str) -> bool:
-        return check_password_hash(self.hashed_password, password)
+        '''Waits for the hash without blocking other greenlets'''
+        return passwords.check_hash(self.hashed_password, password)
+
+    def save(self, full=False, force=False):
+        bump_version(self)
+        ret = super().save(full, force)
+
+        if self._appended_game_ids:
+            self._connection.zadd(self.games_key, self._appended_game_ids)
+        self._appended_game_ids = dict()
+
+        return ret
+
+    def _before_delete(self):
+        self._connection.delete(self.games_key)
+
+
+GET_GAME_LUA = '''
+local result = {redis.call('HGETALL', KEYS[1])}
+local user_ids = redis.call('HMGET', KEYS[1], 'white_user', 'black_user')
+for i = 1, 2 do
+    if user_ids[i] then
+        result[i + 1] = redis.call('HGETALL', ARGV[1] .. user_ids[i])
+    else
+        result[i + 1] = {}
+    end
+end
+return result
+'''
+
+
+COMMIT_MOVE_LUA = '''
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+local is_finished = redis.call('HGET', KEYS[1], 'is_finished')
+if is_finished and is_finished ~= '' then
+    return 0
+end
+if redis.call('STRLEN', KEYS[2]) ~= tonumber(ARGV[1]) then
+    return 0
+end
+
+redis.call('APPEND', KEYS[2], ARGV[2])
+for column, value in pairs(cjson.decode(ARGV[3])) do
+    redis.call('HSET', KEYS[1], column, value)
+end
+local deleted = cjson.decode(ARGV[4])
+if #deleted > 0 then
+    redis.call('HDEL', KEYS[1], unpack(deleted))
+end
+return redis.call('HINCRBY', KEYS[1], 'version', 1)
+'''
+
+
+def _decode_hash(data: list) -> Dict[str, str]:
+    return {
+        key.decode(): value.decode()
+        for key, value in zip(data[::2], data[1::2])
+    }
 
 
 class Game(rom.Model):
@@ -85,29 +255,176 @@ class Game(rom.Model):
     is_finished = rom.Boolean(default=False)
     result = rom.Text(default='*')
 
-    raw_moves = rom.Text(default="")
+    # Moves are stored packed in a separate key, see pack_move(...)
+
+    # Position after the last irreversible move and the number of moves
+    # before it. It's enough to rebuild the board from the last moves with
+    # repetition and 50-move detection.
+    root_fen = rom.Text(default=STARTING_FEN)
+    root_ply = rom.Integer(default=0)
+
     last_move_datetime = rom.DateTime()
 
     raw_total_clock = rom.Text(default="0.0")
     raw_white_clock = rom.Text(default="0.0")
     raw_black_clock = rom.Text(default="0.0")
 
-    first_move_timed_out_task_id = rom.Text()
-    first_move_timed_out_task_eta = rom.DateTime()
+    # Deadlines of armed timers, see hydraChess.timers
+    first_move_timed_out_eta = rom.DateTime()
+    white_disconnect_timed_out_eta = rom.DateTime()
+    black_disconnect_timed_out_eta = rom.DateTime()
 
-    white_time_is_up_task_id = rom.Text()
-    white_time_is_up_task_eta = rom.DateTime()
-
-    white_disconnect_timed_out_task_id = rom.Text()
-    white_disconnect_timed_out_task_eta = rom.DateTime()
+    draw_offer_sender = rom.Integer(default=None)
 
-    black_disconnect_timed_out_task_id = rom.Text()
-    black_disconnect_timed_out_task_eta = rom.DateTime()
+    version = rom.Integer(default=0)  # Incremented by every write
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._packed_moves = b"" if self._new else None  # Loaded lazily
+        self._appended_moves = b""
+        self._moves_rewritten = False
+
+    @classmethod
+    def get(cls, ids, force: bool = False):
+        '''Like rom.Model.get(...), but a single game is loaded with both
+           players in one round trip. If force is True, they are loaded
+           even if they are in the session.'''
+        if isinstance(ids, (list, tuple, set, frozenset)):
+            return super().get(ids)
+
+        pk = f"{cls._namespace}:{int(ids)}"
+        game = None if force else rom.util.session.get(pk)
+        if game is not None:
+            return game
+
+        get_game_lua = cls._connection.register_script(GET_GAME_LUA)
+        game_data, *users_data = get_game_lua(keys=[pk],
+                                              args=[f"{User._namespace}:"])
+        if not game_data:
+            return None
+
+        game_data = _decode_hash(game_data)
+        for attr, user_data in zip(('white_user', 'black_user'), users_data):
+            if attr not in game_data:
+                continue
+            user = None if force else\
+                rom.util.session.get(f"{User._namespace}:{game_data[attr]}")
+            if user is None and user_data:
+                user = User(_loading=True, **_decode_hash(user_data))
+            if user is not None:
+                game_data[attr] = user
+        return cls(_loading=True, **game_data)
 
-    white_time_is_up_task_id = rom.Text()
-    black_time_is_up_task_id = rom.Text()
+    @property
+    def moves_key(self) -> str:
+        return f"{self._pk}:moves"
 
-    draw_offer_sender = rom.Integer(default=None)
+    @property
+    def packed_moves(self) -> bytes:
+        if self._packed_moves is None:
+            self._packed_moves = self._connection.get(self.moves_key) or b""
+        return self._packed_moves
+
+    @classmethod
+    def get_summaries(cls, game_ids: List[int]) -> List[Optional[Dict]]:
+        '''Returns players' logins, result and moves count of the games
+           (None for the missing ones) in two round trips,
+           without loading the entities'''
+        pipe = cls._connection.pipeline(False)
+        for game_id in game_ids:
+            pipe.hmget(f"{cls._namespace}:{game_id}",
+                       ['white_user', 'black_user', 'result'])
+            pipe.strlen(f"{cls._namespace}:{game_id}:moves")
+        data = pipe.execute()
+        summaries = zip(game_ids, data[::2], data[1::2])
+
+        games = list()
+        for game_id, fields, packed_len in summaries:
+            white_user_id, black_user_id, result = fields
+            if white_user_id is None:
+                games.append(None)
+                continue
+            games.append({
+                'white_user_id': int(white_user_id),
+                'black_user_id': int(black_user_id),
+                'id': int(game_id),
+                'result': result.decode(),
+                'moves_cnt': packed_len // 2,
+            })
+
+        user_ids = list({
+            game[key] for game in games if game
+            for key in ('white_user_id', 'black_user_id')
+        })
+        for user_id in user_ids:
+            pipe.hget(f"{User._namespace}:{user_id}", 'login')
+        logins = {
+            user_id: login.decode() if login is not None else None
+            for user_id, login in zip(user_ids, pipe.execute())
+        }
+
+        for game in games:
+            if game:
+                game['white_login'] = logins[game['white_user_id']]
+                game['black_login'] = logins[game['black_user_id']]
+        return games
+
+    def save(self, full=False, force=False):
+        bump_version(self)
+        ret = super().save(full, force)
+
+        if self._moves_rewritten:
+            self._connection.set(self.moves_key, self._packed_moves)
+        elif self._appended_moves:
+            self._connection.append(self.moves_key, self._appended_moves)
+        self._appended_moves = b""
+        self._moves_rewritten = False
+
+        return ret
+
+    def commit_move(self) -> bool:
+        '''Atomically appends pushed moves and writes changed columns, if no
+           moves were made and the game wasn't finished since it was loaded.
+           Returns False if it happened, nothing is written then.
+           Unlike save(), it works only with non-indexed columns.'''
+        if self._new or self._moves_rewritten:
+            raise ValueError("Only moves pushed to a saved game are committed")
+
+        changed = dict()
+        deleted = list()
+        for attr, column in self._columns.items():
+            value = getattr(self, attr)
+            raw_value = column._to_redis(value) if value is not None else None
+            if raw_value == self._last.get(attr):
+                continue
+            if column._index or column._unique:
+                raise ValueError(f"Indexed column {attr} can't be committed")
+            if raw_value is None:
+                deleted.append(attr)
+            else:
+                changed[attr] = raw_value
+
+        commit_move_lua = self._connection.register_script(COMMIT_MOVE_LUA)
+        expected_len = len(self._packed_moves) - len(self._appended_moves)
+        version = commit_move_lua(
+            keys=[self._pk, self.moves_key],
+            args=[expected_len, self._appended_moves,
+                  json.dumps(changed), json.dumps(deleted)]
+        )
+        if not version:
+            return False
+
+        self.version = version
+        changed['version'] = str(version)
+        self._last.update(changed)
+        for attr in deleted:
+            self._last.pop(attr, None)
+        self._appended_moves = b""
+        self._modified = False
+        return True
+
+    def _before_delete(self):
+        self._connection.delete(self.moves_key)
 
     @property
     def total_clock(self) -> timedelta:
@@ -143,30 +460,34 @@ class Game(rom.Model):
         self.raw_white_clock = f"{seconds}.{microseconds}"
 
     @property
-    def moves(self) -> list:
-        raw_moves = self.raw_moves
-        if raw_moves:
-            return list(raw_moves.split(','))
-        return []
+    def moves(self) -> List[str]:
+        '''SAN moves, decoded by replaying the game'''
+        board = Board()
+        moves = list()
+        for move in unpack_moves(self.packed_moves):
+            moves.append(board.san(move))
+            board.push(move)
+        return moves
 
     @moves.setter
-    def moves(self, moves: list) -> None:
-        if not moves:
-            self.raw_moves = ""
-        else:
-            self.raw_moves = ','.join(moves)
+    def moves(self, moves: List[str]) -> None:
+        self._packed_moves = b""
+        self._appended_moves = b""
+        self._moves_rewritten = True
+        self.root_fen = STARTING_FEN
+        self.root_ply = 0
+
+        board = Board()
+        for move in moves:
+            self.push_move(board, move)
 
     def get_moves_cnt(self) -> int:
-        raw_moves = self.raw_moves
-        if raw_moves:
-            return raw_moves.count(',') + 1
-        return 0
+        return len(self.packed_moves) // 2
 
-    def append_move(self, move_san: str) -> None:
-        if self.raw_moves:
-            self.raw_moves += f",{move_san}"
-        else:
-            self.raw_moves = move_san
+    def append_move(self, move: Move) -> None:
+        packed_move = pack_move(move)
+        self._packed_moves = self.packed_moves + packed_move
+        self._appended_moves += packed_move
 
     def get_next_to_move(self) -> bool:
         moves_cnt = self.get_moves_cnt()
@@ -174,15 +495,32 @@ class Game(rom.Model):
             return WHITE
         return BLACK
 
+    def push_move(self, board: Board, move_san: str) -> None:
+        '''Makes the move on the board with the current position of the game
+           and appends it to the game. Raises ValueError on illegal moves.'''
+        move = board.parse_san(move_san)
+        is_irreversible = board.is_irreversible(move)
+        board.push(move)
+        self.append_move(move)
+
+        if is_irreversible:
+            self.root_fen = board.fen()
+            self.root_ply = self.get_moves_cnt()
+
     def get_board(self) -> Board:
-        board = Board()
-        for move in self.moves:
-            board.push_san(move)
-        return board
+        # Moves were validated on push, so don't check them again.
+        board = Board(self.root_fen)
+        for move in unpack_moves(self.packed_moves[self.root_ply * 2:]):
+            board.push(move)
 
+        ply = 2 * (board.fullmove_number - 1) + (board.turn == BLACK)
+        if ply == self.get_moves_cnt():
+            return board
 
-class GameRequest(rom.Model):
-    id = rom.PrimaryKey(index=True)
+        # The snapshot is out of date (moves were appended without it),
+        # so replay the whole game.
+        board = Board()
+        for move in unpack_moves(self.packed_moves):
+            board.push(move)
+        return board
 
-    time = rom.Float(index=True)
-    user_id = rom.Integer(index=True)
@@ -0,0 +1,59 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Callable, Optional
+from gevent.threadpool import ThreadPool
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+# Passwords are hashed with PBKDF2, which takes tens of milliseconds of CPU.
+# In the web process that would stall every greenlet, so every socket,
+# for the whole time. Hashes are computed by a pool of native threads
+# instead (hashlib releases the GIL), the calling greenlet waits for
+# the result and the others keep running. The size of the pool caps
+# concurrent hashes, the rest wait in its queue.
+
+THREADS = 4
+
+_threads = THREADS
+_pool: Optional[ThreadPool] = None
+
+
+def configure(threads: int) -> None:
+    '''Sets the size of the pool. If it's 0, hashes are computed
+       by the caller, blocking the process.'''
+    global _threads, _pool
+    if _pool is not None:
+        _pool.kill()
+        _pool = None
+    _threads = threads
+
+
+def _run(func: Callable, *args):
+    global _pool
+    if not _threads:
+        return func(*args)
+    if _pool is None:
+        _pool = ThreadPool(_threads)
+    return _pool.apply(func, args)
+
+
+def generate_hash(password: str) -> str:
+    return _run(generate_password_hash, password)
+
+
+def check_hash(hashed_password: str, password: str) -> bool:
+    return _run(check_password_hash, hashed_password, password)
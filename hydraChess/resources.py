@@ -38,6 +38,7 @@ class GamesList(Resource):
     parser = reqparse.RequestParser()
     parser.add_argument('nickname', type=str, required=True)
     parser.add_argument('start_from', type=int, default=0)
+    parser.add_argument('cursor', type=str)
     parser.add_argument(
         'size',
         type=int,
@@ -55,19 +56,30 @@ class GamesList(Resource):
         if not user:
             return {"message": "User doesn't exist"}, 400
 
-        game_ids = user.game_ids[start_from: start_from + size]
-        games = list()
-        for game in Game.get(game_ids):
+        try:
+            game_ids, next_cursor = user.get_game_ids_page(
+                args['cursor'], size, max(start_from, 0)
+            )
+        except ValueError:
+            return {"message": "Bad cursor"}, 400
+        games = Game.get_summaries(game_ids)
+
+        games_data = list()
+        for game in games:
+            if game is None:
+                continue
             cur_game = {
-                'white_player': game.white_user.login,
-                'black_player': game.black_user.login,
-                'id': game.id,
-                'result': game.result,
-                'moves_cnt': game.get_moves_cnt(),
+                'white_player': game['white_login'],
+                'black_player': game['black_login'],
+                'id': game['id'],
+                'result': game['result'],
+                'moves_cnt': game['moves_cnt'],
             }
-            games.append(cur_game)
+            games_data.append(cur_game)
 
-        return {"games": games}, 200
+        if next_cursor is None:
+            return {"games": games_data}, 200
+        return {"games": games_data, "next_cursor": next_cursor}, 200
 
 
 class GameResource(Resource):
@@ -97,7 +109,7 @@ class GameResource(Resource):
             "rating": game.black_rating
         }
         game_data["result"] = game.result
-        game_data["moves"] = game.raw_moves
+        game_data["moves"] = ','.join(game.moves)
 
         if current_user.is_authenticated:
             if current_user.id == game.white_user.id:
@@ -0,0 +1,172 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime, timezone
+from typing import Dict, Optional
+import json
+import rom.util
+from hydraChess.models import Game
+
+
+# Snapshots of games for spectators, so the web server can send game info
+# without loading the game and replaying its moves.
+# Hash: players (JSON), moves (SAN, comma separated), moves_cnt,
+# white_clock and black_clock (seconds at the last move),
+# last_move_datetime (timestamp or '') and result ('' if not finished).
+
+LIVE_GAME_TTL = 24 * 3600  # Seconds, longer than any game lasts
+FINISHED_GAME_TTL = 3600
+
+PUSH_MOVE_LUA = '''
+local moves_cnt = redis.call('HGET', KEYS[1], 'moves_cnt')
+if not moves_cnt then
+    return 0
+end
+if tonumber(moves_cnt) + 1 ~= tonumber(ARGV[1]) then
+    -- A move is missing, the snapshot will be made again
+    redis.call('DEL', KEYS[1])
+    return 0
+end
+
+local moves = redis.call('HGET', KEYS[1], 'moves')
+if moves ~= '' then
+    moves = moves .. ','
+end
+redis.call('HMSET', KEYS[1], 'moves', moves .. ARGV[2], 'moves_cnt', ARGV[1],
+           'white_clock', ARGV[3], 'black_clock', ARGV[4],
+           'last_move_datetime', ARGV[5])
+return 1
+'''
+
+
+def snapshot_key(game_id: int) -> str:
+    return f"{Game._namespace}:{game_id}:snapshot"
+
+
+def _timestamp(value: Optional[datetime]) -> str:
+    if value is None:
+        return ''
+    return repr(value.replace(tzinfo=timezone.utc).timestamp())
+
+
+def save(game: Game) -> Dict[str, str]:
+    '''Makes the snapshot of the game'''
+    snapshot = {
+        'players': json.dumps({
+            'white_user_id': game.white_user.id,
+            'black_user_id': game.black_user.id,
+            'white_user': {'nickname': game.white_user.login,
+                           'rating': game.white_rating},
+            'black_user': {'nickname': game.black_user.login,
+                           'rating': game.black_rating},
+        }),
+        'moves': ','.join(game.moves),
+        'moves_cnt': str(game.get_moves_cnt()),
+        'white_clock': repr(game.white_clock.total_seconds()),
+        'black_clock': repr(game.black_clock.total_seconds()),
+        'last_move_datetime': _timestamp(game.last_move_datetime),
+        'result': (game.result or '-') if game.is_finished else '',
+    }
+
+    key = snapshot_key(game.id)
+    pipe = rom.util.get_connection().pipeline(True)
+    pipe.delete(key)
+    pipe.hset(key, mapping=snapshot)
+    if game.is_finished:
+        pipe.expire(key, FINISHED_GAME_TTL)
+    else:
+        pipe.expire(key, LIVE_GAME_TTL)
+    pipe.execute()
+    return snapshot
+
+
+def push_move(game: Game, move_san: str) -> None:
+    '''Appends the committed move to the snapshot, if there is one.'''
+    conn = rom.util.get_connection()
+    push_move_lua = conn.register_script(PUSH_MOVE_LUA)
+    push_move_lua(keys=[snapshot_key(game.id)],
+                  args=[game.get_moves_cnt(), move_san,
+                        repr(game.white_clock.total_seconds()),
+                        repr(game.black_clock.total_seconds()),
+                        _timestamp(game.last_move_datetime)])
+
+
+def get(game_id: int) -> Optional[Dict[str, str]]:
+    data = rom.util.get_connection().hgetall(snapshot_key(game_id))
+    if not data:
+        return None
+    return {key.decode(): value.decode() for key, value in data.items()}
+
+
+def get_or_save(game_id: int) -> Optional[Dict[str, str]]:
+    '''Returns the snapshot, makes it if it's missing.
+       Returns None if there is no such game.'''
+    snapshot = get(game_id)
+    if snapshot is None:
+        game = Game.get(game_id)
+        if game is None:
+            return None
+        snapshot = save(game)
+    return snapshot
+
+
+def get_players(snapshot: Dict[str, str]) -> Dict:
+    return json.loads(snapshot['players'])
+
+
+def get_moves_since(moves: str, ply: Optional[int]) -> Dict:
+    '''Moves of game info. If the client already knows the first ply moves,
+       only the rest of them are sent and the ply is sent back.'''
+    if not ply:
+        return {'moves': moves}
+
+    moves_list = moves.split(',') if moves else []
+    if ply > len(moves_list):
+        return {'moves': moves}
+    return {'moves': ','.join(moves_list[ply:]), 'ply': ply}
+
+
+def get_game_info(snapshot: Dict[str, str], now: datetime,
+                  ply: Optional[int] = None) -> Dict:
+    '''Game info for spectators, like send_game_info(...) sends'''
+    players = get_players(snapshot)
+    data = {
+        'black_user': players['black_user'],
+        'white_user': players['white_user'],
+        'is_player': False,
+        'role': 'spectator',
+    }
+    data.update(get_moves_since(snapshot['moves'], ply))
+
+    if snapshot['result']:
+        data['result'] = snapshot['result']
+        return data
+
+    white_clock = float(snapshot['white_clock'])
+    black_clock = float(snapshot['black_clock'])
+    moves_cnt = int(snapshot['moves_cnt'])
+    if moves_cnt:
+        last_move_timestamp = float(snapshot['last_move_datetime'])
+        elapsed = now.replace(tzinfo=timezone.utc).timestamp() -\
+            last_move_timestamp
+        if moves_cnt % 2 == 0:
+            white_clock -= elapsed
+        else:
+            black_clock -= elapsed
+
+    data['black_clock'] = int(black_clock)
+    data['white_clock'] = int(white_clock)
+    return data
@@ -0,0 +1,126 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from contextlib import contextmanager
+from typing import Hashable
+import threading
+import socketio
+from hydraChess import tracing
+
+
+# Game updates are published to the game's room once for players and
+# spectators. Fields only for players are put in PLAYERS_ONLY of the data,
+# the web process, which knows the roles of its sockets, fills them in
+# for the players and strips them for the others.
+
+PLAYERS_ONLY = 'players_only'
+
+
+def players_room(room: Hashable) -> str:
+    '''Players of the game also join this room, besides the game's one'''
+    return f"{room}:players"
+
+
+class RoleManager(socketio.BaseManager):
+    '''Client manager, which fills in PLAYERS_ONLY fields of emits
+       for players. Message queues deliver emits to its emit(...).'''
+
+    def emit(self, event, data, namespace, room=None, skip_sid=None,
+             callback=None, **kwargs):
+        if not isinstance(data, dict) or PLAYERS_ONLY not in data:
+            return super().emit(event, data, namespace, room=room,
+                                skip_sid=skip_sid, callback=callback,
+                                **kwargs)
+
+        spectators_data = dict(data)
+        players_data = dict(spectators_data.pop(PLAYERS_ONLY))
+        players_data.update(spectators_data)
+
+        if not isinstance(skip_sid, list):
+            skip_sid = [skip_sid]
+        rooms = self.rooms.get(namespace, dict())
+        players = list()
+        if players_room(room) in rooms:
+            players = list(self.get_participants(namespace,
+                                                 players_room(room)))
+            super().emit(event, players_data, namespace,
+                         room=players_room(room), skip_sid=skip_sid,
+                         callback=callback, **kwargs)
+        super().emit(event, spectators_data, namespace, room=room,
+                     skip_sid=skip_sid + players, callback=callback,
+                     **kwargs)
+
+
+class RoleRedisManager(socketio.RedisManager, RoleManager):
+    '''Redis message queue for RoleManager'''
+
+
+class BatchingRedisManager(RoleRedisManager):
+    '''Socket.IO message queue, which can publish the emits of a task
+       in one message. Web processes emit the batched events in order.
+       Web processes must be updated before the workers start batching.'''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._local = threading.local()
+
+    @contextmanager
+    def batch(self):
+        '''Emits are published on exit. Nested batches are merged'''
+        if getattr(self._local, 'messages', None) is not None:
+            yield
+            return
+
+        self._local.messages = list()
+        try:
+            yield
+        finally:
+            self._flush()
+            self._local.messages = None
+
+    def flush(self) -> None:
+        '''Publishes emits of the current batch so far. Call it before
+           sending a task, so its emits can't overtake them.'''
+        if getattr(self._local, 'messages', None):
+            self._flush()
+
+    def _flush(self) -> None:
+        messages = self._local.messages
+        if not messages:
+            return
+
+        with tracing.span('emit_publish'):
+            if len(messages) == 1:
+                super()._publish(messages[0])
+            else:
+                super()._publish({'method': 'emit', 'batch': list(messages),
+                                  'host_id': self.host_id})
+        messages.clear()
+
+    def _publish(self, data):
+        if getattr(self._local, 'messages', None) is None:
+            return super()._publish(data)
+
+        if data['method'] == 'emit' and data['callback'] is None:
+            self._local.messages.append(data)
+            return None
+
+        self._flush()  # Keep the order of messages
+        return super()._publish(data)
+
+    def _handle_emit(self, message):
+        for emit in message.get('batch', (message, )):
+            super()._handle_emit(emit)
@@ -172,19 +172,37 @@ import { Timer, ClockPair } from './clock.js'
   }
 
   function onGameStarted(data) {
+    var moves = []
     if (data.moves !== '') {
-      movesArray = data.moves.split(',')
-    }    else {
-      movesArray = []
+      moves = data.moves.split(',')
     }
 
-    moveIndx = movesArray.length - 1
+    if (data.ply !== undefined && movesArray !== null &&
+        movesArray.length === data.ply) {
+      // We reconnected, only the moves played meanwhile were sent
+      while (moveIndx + 1 !== movesArray.length) {
+        moveIndx += 1
+        game.move(movesArray[moveIndx])
+      }
+      moves.forEach(function(move) {
+        movesArray.push(move)
+        pushToMovesList(move, movesArray.length - 1)
+        game.move(move)
+      })
+      moveIndx = movesArray.length - 1
+      $movesList.find('.halfmove').removeClass('halfmove-active')
+      $movesList.find(`#move_${moveIndx}`).addClass('halfmove-active')
+    } else {
+      movesArray = moves
+      moveIndx = movesArray.length - 1
 
-    game = new Chess()
-    movesArray.forEach(function(move, index) {
-      pushToMovesList(move, index)
-      game.move(move)
-    })
+      $movesList.empty()
+      game = new Chess()
+      movesArray.forEach(function(move, index) {
+        pushToMovesList(move, index)
+        game.move(move)
+      })
+    }
 
     board.position(game.fen())
 
@@ -441,6 +459,15 @@ import { Timer, ClockPair } from './clock.js'
     }
   })
 
+  sio.on('reconnect_attempt', function() {
+    // The server sends only the moves we don't know yet
+    sio.io.opts.query = {
+      request_type: 'game',
+      game_id: gameId,
+      ply: movesArray === null ? 0 : movesArray.length
+    }
+  })
+
   sio.on('game_started', onGameStarted)
   sio.on('game_updated', onGameUpdated)
   sio.on('game_ended', onGameEnded)
@@ -0,0 +1,185 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from argparse import ArgumentParser
+from collections import defaultdict
+from datetime import datetime
+from time import perf_counter, time
+from typing import Dict, Iterable, Optional
+import threading
+from celery.signals import task_postrun, task_prerun
+import rom.util
+
+
+# Lifecycle stats of tasks, recorded by the workers on Celery signals.
+# Timings are kept as histograms: a value is rounded to SIGNIFICANT_DIGITS
+# digits of microseconds and the count of its bucket is incremented.
+# There is a hash per minute, so stats of any time window can be summed up.
+# Hash fields: "<task>:count", "<task>:errors" and
+# "<task>:<timing>:<bucket>", timings are:
+# queue_wait - from sending the task to starting it,
+# run_time - from starting the task to finishing it,
+# lifetime - from sending the task to finishing it.
+# Queue wait and lifetime are unknown for eager tasks.
+
+STATS_KEY_PREFIX = 'stats:tasks:'
+STATS_TTL = 7 * 24 * 3600
+SIGNIFICANT_DIGITS = 3
+TIMINGS = ('queue_wait', 'run_time', 'lifetime')
+
+_local = threading.local()
+
+
+def stats_key(minute: int) -> str:
+    return f"{STATS_KEY_PREFIX}{minute}"
+
+
+def get_bucket(seconds: float) -> int:
+    '''Microseconds, rounded down to SIGNIFICANT_DIGITS digits'''
+    value = max(int(seconds * 1_000_000), 1)
+    exponent = max(len(str(value)) - SIGNIFICANT_DIGITS, 0)
+    return value // 10 ** exponent * 10 ** exponent
+
+
+def record(name: str, run_time: float, sent_at: Optional[float] = None,
+           failed: bool = False) -> None:
+    '''Records the task, which has finished now'''
+    now = time()
+    key = stats_key(int(now // 60))
+
+    pipe = rom.util.get_connection().pipeline(False)
+    pipe.hincrby(key, f"{name}:count", 1)
+    if failed:
+        pipe.hincrby(key, f"{name}:errors", 1)
+    pipe.hincrby(key, f"{name}:run_time:{get_bucket(run_time)}", 1)
+    if sent_at is not None:
+        lifetime = now - sent_at
+        queue_wait = lifetime - run_time
+        pipe.hincrby(key, f"{name}:queue_wait:{get_bucket(queue_wait)}", 1)
+        pipe.hincrby(key, f"{name}:lifetime:{get_bucket(lifetime)}", 1)
+    pipe.expire(key, STATS_TTL)
+    pipe.execute()
+
+
+def on_task_prerun(task_id=None, **kwargs) -> None:
+    if not hasattr(_local, 'started_at'):
+        _local.started_at = dict()
+    _local.started_at[task_id] = perf_counter()
+
+
+def on_task_postrun(task_id=None, task=None, state=None, **kwargs) -> None:
+    started_at = getattr(_local, 'started_at', {}).pop(task_id, None)
+    if started_at is None:
+        return
+    # sent_at is stamped by hydraChess.metrics
+    record(task.name, perf_counter() - started_at,
+           getattr(task.request, 'sent_at', None), state == 'FAILURE')
+
+
+def connect() -> None:
+    '''Starts recording stats of the tasks run by this process'''
+    task_prerun.connect(on_task_prerun, weak=False,
+                        dispatch_uid='task_stats_prerun')
+    task_postrun.connect(on_task_postrun, weak=False,
+                         dispatch_uid='task_stats_postrun')
+
+
+def get_stats(start: float, end: float,
+              tasks: Optional[Iterable[str]] = None) -> Dict[str, Dict]:
+    '''Stats of the tasks finished from start till end (timestamps),
+       summed up by minutes. Returns count, errors and a histogram
+       (bucket in microseconds -> count) of every timing of every task.'''
+    tasks = set(tasks) if tasks else None
+    pipe = rom.util.get_connection().pipeline(False)
+    for minute in range(int(start // 60), int(end // 60) + 1):
+        pipe.hgetall(stats_key(minute))
+
+    stats = defaultdict(lambda: {'count': 0, 'errors': 0,
+                                 **{timing: defaultdict(int)
+                                    for timing in TIMINGS}})
+    for data in pipe.execute():
+        for field, value in data.items():
+            name, counter = field.decode().split(':', 1)
+            if tasks is not None and name not in tasks:
+                continue
+            if counter in ('count', 'errors'):
+                stats[name][counter] += int(value)
+            else:
+                timing, bucket = counter.split(':')
+                stats[name][timing][int(bucket)] += int(value)
+    return dict(stats)
+
+
+def get_percentile(histogram: Dict[int, int], percent: float) -> float:
+    '''Value of the histogram in seconds, 0 if it's empty'''
+    total = sum(histogram.values())
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= percent / 100 * total:
+            return bucket / 1_000_000
+    return 0.0
+
+
+def delete_stats() -> None:
+    conn = rom.util.get_connection()
+    keys = list(conn.scan_iter(f"{STATS_KEY_PREFIX}*"))
+    if keys:
+        conn.delete(*keys)
+
+
+if __name__ == '__main__':
+    from hydraChess.config import ProductionConfig
+
+    parser = ArgumentParser(
+        description="Prints lifecycle stats of tasks, times are in ms. "
+                    "Set TASK_STATS in the config to record them."
+    )
+    parser.add_argument('--db', type=int,
+                        default=ProductionConfig.REDIS_DB_ID)
+    parser.add_argument('--task', action='append', dest='tasks',
+                        help="task to print, can be repeated")
+    parser.add_argument('--last', type=float, default=60,
+                        help="minutes to print, 60 by default")
+    parser.add_argument('--start', type=datetime.fromisoformat,
+                        help="start of the window, e.g. 2020-08-01T12:00, "
+                             "instead of --last")
+    parser.add_argument('--end', type=datetime.fromisoformat,
+                        help="end of the window, now by default")
+    parser.add_argument('--reset', action='store_true',
+                        help="delete recorded stats")
+    args = parser.parse_args()
+
+    rom.util.set_connection_settings(db=args.db)
+    end = args.end.timestamp() if args.end else time()
+    start = args.start.timestamp() if args.start else end - args.last * 60
+    stats = get_stats(start, end, args.tasks)
+    if args.reset:
+        delete_stats()
+
+    print(f"{'task':30} {'timing':10} {'count':>7} {'errors':>7} "
+          f"{'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for name, task in sorted(stats.items()):
+        for timing in TIMINGS:
+            histogram = task[timing]
+            if not histogram:
+                continue
+            percentiles = ' '.join(
+                f"{get_percentile(histogram, percent) * 1000:9.3f}"
+                for percent in (50, 90, 99, 100)
+            )
+            print(f"{name:30} {timing:10} {task['count']:7} "
+                  f"{task['errors']:7} {percentiles}")
@@ -0,0 +1,175 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+from datetime import datetime, timezone
+from typing import Iterable, List, Tuple
+from time import time, sleep
+import json
+import logging
+import rom.util
+
+
+TIMERS_KEY = 'timers'  # Sorted set: timer name -> deadline timestamp
+TIMER_TASKS_KEY = 'timers:tasks'  # Hash: timer name -> [task name, args]
+# Sorted set: timer name -> timestamp of popping. Popped timers stay here
+# till their tasks are sent, so a failed send doesn't lose them.
+SENDING_KEY = 'timers:sending'
+
+POLL_INTERVAL = 0.05  # Seconds
+ERROR_INTERVAL = 1  # Seconds before polling again after an error
+# Seconds, after which a popped timer is popped again, if its task
+# wasn't acknowledged (e.g. the process, which has popped it, crashed)
+SENDING_TIMEOUT = 30
+BATCH_SIZE = 100
+
+POP_EXPIRED_LUA = '''
+local now = tonumber(ARGV[1])
+local names = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now - ARGV[3],
+                         'LIMIT', 0, ARGV[2])
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now,
+                           'LIMIT', 0, ARGV[2] - #names)
+if #expired > 0 then
+    redis.call('ZREM', KEYS[1], unpack(expired))
+end
+for _, name in ipairs(expired) do
+    names[#names + 1] = name
+end
+if #names == 0 then
+    return {}
+end
+
+local result = {}
+local tasks = redis.call('HMGET', KEYS[2], unpack(names))
+for i, name in ipairs(names) do
+    redis.call('ZADD', KEYS[3], now, name)
+    result[#result + 1] = name
+    result[#result + 1] = tasks[i]
+end
+return result
+'''
+
+ACK_LUA = '''
+for _, name in ipairs(ARGV) do
+    redis.call('ZREM', KEYS[3], name)
+    -- The timer could be armed again meanwhile
+    if not redis.call('ZSCORE', KEYS[1], name) then
+        redis.call('HDEL', KEYS[2], name)
+    end
+end
+'''
+
+RELEASE_LUA = '''
+for _, name in ipairs(ARGV) do
+    -- Unless the timer was cancelled meanwhile
+    if redis.call('ZREM', KEYS[2], name) == 1 then
+        redis.call('ZADD', KEYS[1], 'NX', 0, name)
+    end
+end
+'''
+
+logger = logging.getLogger(__name__)
+
+
+def arm(name: str, eta: datetime, task_name: str, args: tuple) -> None:
+    '''Schedules the task to be sent at eta (UTC).
+       Arming an already armed timer moves its deadline, arming
+       a popped one stops it from being popped again on timeout.'''
+    conn = rom.util.get_connection()
+    deadline = eta.replace(tzinfo=timezone.utc).timestamp()
+
+    pipe = conn.pipeline(True)
+    pipe.zadd(TIMERS_KEY, {name: deadline})
+    pipe.hset(TIMER_TASKS_KEY, name, json.dumps([task_name, args]))
+    pipe.zrem(SENDING_KEY, name)
+    pipe.execute()
+
+
+def cancel(*names: str) -> None:
+    conn = rom.util.get_connection()
+
+    pipe = conn.pipeline(True)
+    pipe.zrem(TIMERS_KEY, *names)
+    pipe.zrem(SENDING_KEY, *names)
+    pipe.hdel(TIMER_TASKS_KEY, *names)
+    pipe.execute()
+
+
+def pop_expired(limit: int = BATCH_SIZE) -> List[Tuple[str, str, list]]:
+    '''Pops up to limit expired timers and returns their names and tasks.
+       Every timer is returned only once, even to concurrent callers,
+       unless it isn't acknowledged or released in SENDING_TIMEOUT.'''
+    conn = rom.util.get_connection()
+    pop_expired_lua = conn.register_script(POP_EXPIRED_LUA)
+
+    result = pop_expired_lua(keys=[TIMERS_KEY, TIMER_TASKS_KEY, SENDING_KEY],
+                             args=[time(), limit, SENDING_TIMEOUT])
+    return [(name.decode(), *json.loads(task))
+            for name, task in zip(result[::2], result[1::2]) if task]
+
+
+def ack(names: Iterable[str]) -> None:
+    '''Forgets the popped timers, whose tasks were sent'''
+    names = list(names)
+    if names:
+        conn = rom.util.get_connection()
+        conn.register_script(ACK_LUA)(
+            keys=[TIMERS_KEY, TIMER_TASKS_KEY, SENDING_KEY], args=names
+        )
+
+
+def release(names: Iterable[str]) -> None:
+    '''Returns the popped timers, whose tasks weren't sent, as expired'''
+    names = list(names)
+    if names:
+        conn = rom.util.get_connection()
+        conn.register_script(RELEASE_LUA)(keys=[TIMERS_KEY, SENDING_KEY],
+                                          args=names)
+
+
+def send_expired(celery) -> int:
+    '''Sends tasks of expired timers to their queues.
+       Returns the number of popped timers.'''
+    timers = pop_expired()
+    sent = list()
+    try:
+        for name, task_name, args in timers:
+            celery.send_task(task_name, args=args)
+            sent.append(name)
+    finally:
+        ack(sent)
+        release(name for name, _, _ in timers[len(sent):])
+    return len(timers)
+
+
+def run(celery) -> None:
+    '''Sends tasks of expired timers to their queues, never returns.
+       Errors (e.g. of the broker) are logged, the timers are kept.'''
+    while True:
+        try:
+            popped = send_expired(celery)
+        except Exception:
+            logger.exception("Failed to send tasks of expired timers")
+            sleep(ERROR_INTERVAL)
+            continue
+
+        if popped < BATCH_SIZE:
+            sleep(POLL_INTERVAL)
+
+
+if __name__ == '__main__':
+    from hydraChess.game_management import celery
+    run(celery)
@@ -0,0 +1,193 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from argparse import ArgumentParser
+from collections import defaultdict
+from contextlib import contextmanager
+from random import random
+from time import perf_counter, time
+from typing import Dict, List, Optional
+from uuid import uuid4
+import json
+import socket
+import os
+import threading
+from celery.signals import before_task_publish
+import rom.util
+
+
+# A trace follows a sampled socket event through the tasks it causes.
+# The trace id is sent in the headers of the tasks, which are sent while
+# the trace is active. Every traced handler or task saves a record with
+# its spans (timings of its parts) to the capped list below.
+
+TRACES_KEY = 'traces'  # List of JSON records, newest first
+MAX_RECORDS = 10000
+
+_local = threading.local()
+
+
+def sample(rate: float) -> Optional[str]:
+    '''Returns a new trace id with the given probability, else None'''
+    if rate and random() < rate:
+        return uuid4().hex
+    return None
+
+
+def get_trace_id() -> Optional[str]:
+    record = getattr(_local, 'record', None)
+    return record['trace_id'] if record is not None else None
+
+
+@contextmanager
+def trace(trace_id: Optional[str], name: str):
+    '''Records spans of the block, if the trace id isn't None.
+       Nested traces are a part of the outer one.'''
+    if trace_id is None or get_trace_id() is not None:
+        yield
+        return
+
+    _local.record = {
+        'trace_id': trace_id,
+        'name': name,
+        'host': socket.gethostname(),
+        'pid': os.getpid(),
+        'started_at': time(),
+        'spans': list(),
+    }
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        record = _local.record
+        _local.record = None
+        record['duration'] = perf_counter() - start
+        _save(record)
+
+
+@contextmanager
+def span(name: str):
+    record = getattr(_local, 'record', None)
+    if record is None:
+        yield
+        return
+
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        add_span(name, perf_counter() - start)
+
+
+def add_span(name: str, duration: float) -> None:
+    '''Adds the span, which ended now, to the active trace'''
+    record = getattr(_local, 'record', None)
+    if record is not None:
+        record['spans'].append({
+            'name': name,
+            'start': time() - duration - record['started_at'],
+            'duration': duration,
+        })
+
+
+@contextmanager
+def trace_task(task):
+    '''Traces the task, if it was sent by a trace. The time it waited
+       in the queue is a span too (sent_at, see hydraChess.metrics).'''
+    with trace(getattr(task.request, 'trace_id', None), task.name):
+        sent_at = getattr(task.request, 'sent_at', None)
+        if sent_at is not None:
+            add_span('queue_wait', time() - sent_at)
+        yield
+
+
+@before_task_publish.connect
+def propagate_trace_id(headers=None, **kwargs) -> None:
+    trace_id = get_trace_id()
+    if trace_id is not None:
+        headers['trace_id'] = trace_id
+
+
+def _save(record: Dict) -> None:
+    pipe = rom.util.get_connection().pipeline(False)
+    pipe.lpush(TRACES_KEY, json.dumps(record))
+    pipe.ltrim(TRACES_KEY, 0, MAX_RECORDS - 1)
+    pipe.execute()
+
+
+def get_traces() -> Dict[str, List[Dict]]:
+    '''Saved records grouped by trace id, records are ordered by start'''
+    traces = defaultdict(list)
+    for data in rom.util.get_connection().lrange(TRACES_KEY, 0, -1):
+        record = json.loads(data)
+        traces[record['trace_id']].append(record)
+    for records in traces.values():
+        records.sort(key=lambda record: record['started_at'])
+    return dict(traces)
+
+
+def get_span_stats(traces: Dict[str, List[Dict]]) -> Dict[str, Dict]:
+    '''p50, p99 and max of every span of every handler or task, in ms'''
+    durations = defaultdict(list)
+    for records in traces.values():
+        for record in records:
+            durations[record['name']].append(record['duration'])
+            for span in record['spans']:
+                durations[f"{record['name']}.{span['name']}"].append(
+                    span['duration']
+                )
+
+    stats = dict()
+    for name, values in durations.items():
+        values.sort()
+        p99_index = min(len(values) * 99 // 100, len(values) - 1)
+        stats[name] = {
+            'count': len(values),
+            'p50': values[len(values) // 2] * 1000,
+            'p99': values[p99_index] * 1000,
+            'max': values[-1] * 1000,
+        }
+    return stats
+
+
+if __name__ == '__main__':
+    from hydraChess.config import ProductionConfig
+
+    parser = ArgumentParser(
+        description="Dumps saved traces as JSON. Set TRACE_SAMPLE_RATE "
+                    "in the config to trace a share of moves."
+    )
+    parser.add_argument('--db', type=int,
+                        default=ProductionConfig.REDIS_DB_ID)
+    parser.add_argument('--summary', action='store_true',
+                        help="print span timings instead of traces")
+    parser.add_argument('--reset', action='store_true',
+                        help="delete saved traces")
+    args = parser.parse_args()
+
+    rom.util.set_connection_settings(db=args.db)
+    traces = get_traces()
+    if args.reset:
+        rom.util.get_connection().delete(TRACES_KEY)
+
+    if args.summary:
+        print(f"{'span':40} {'count':>7} {'p50, ms':>9} {'p99, ms':>9} "
+              f"{'max, ms':>9}")
+        for name, stats in sorted(get_span_stats(traces).items()):
+            print(f"{name:40} {stats['count']:7} {stats['p50']:9.3f} "
+                  f"{stats['p99']:9.3f} {stats['max']:9.3f}")
+    else:
+        print(json.dumps(traces, indent=2))
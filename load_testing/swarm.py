@@ -0,0 +1,291 @@
+"""
+    This module is needed to test the project under load with many players.
+    Every player is a coroutine, so one process can drive tens of thousands
+    of them. Players arrive at the given rate, sign up, search for games
+    and play random moves after thinking for a while. Latency from sending
+    a move to receiving its game_updated is recorded.
+    Percentiles and throughput are printed when the run is finished.
+    No new games are searched after the duration; after the grace period
+    players, who are still waiting or playing, are stopped.
+    The module doesn't run the server, run it on a different machine:
+    python3 swarm.py --url http://server:8000 --players 10000
+    Raise the open files limit (ulimit -n) for many players.
+"""
+
+
+from argparse import ArgumentParser
+from random import choice, expovariate
+from string import ascii_letters, digits
+from typing import Dict, List, Optional
+import asyncio
+import re
+import aiohttp
+import chess
+import socketio
+
+
+DISCONNECT_TIMEOUT = 10  # Seconds
+
+
+class Histogram:
+    '''Latency histogram like HdrHistogram: values are recorded with the
+       given number of significant digits, so memory doesn't grow with
+       the number of values.'''
+
+    def __init__(self, significant_digits: int = 3):
+        self.significant_digits = significant_digits
+        self.counts: Dict[int, int] = dict()  # Microseconds -> count
+        self.total = 0
+        self.max = 0
+
+    def record(self, seconds: float) -> None:
+        value = max(int(seconds * 1_000_000), 1)
+        self.max = max(self.max, value)
+        exponent = max(len(str(value)) - self.significant_digits, 0)
+        value = value // 10 ** exponent * 10 ** exponent
+        self.counts[value] = self.counts.get(value, 0) + 1
+        self.total += 1
+
+    def percentile(self, percent: float) -> float:
+        '''Returns the value in seconds'''
+        if not self.total:
+            return 0.0
+        rank = percent / 100 * self.total
+        seen = 0
+        for value in sorted(self.counts):
+            seen += self.counts[value]
+            if seen >= rank:
+                return value / 1_000_000
+        return self.max / 1_000_000
+
+
+class Stats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.players = 0
+        self.games = 0
+        self.moves = 0
+        self.errors = 0
+        self.stopped = 0  # Players still waiting or playing at the end
+
+
+def gen_string(length: int, alphabet: str) -> str:
+    return ''.join(choice(alphabet) for _ in range(length))
+
+
+class Player:
+    def __init__(self, url: str, time_controls: List[int], think_time: float,
+                 deadline: float, stats: Stats):
+        self.url = url
+        self.time_controls = time_controls
+        self.think_time = think_time
+        self.deadline = deadline
+        self.stats = stats
+
+        self.cookies = None
+        self.lobby: Optional[socketio.AsyncClient] = None
+        self.game: Optional[socketio.AsyncClient] = None
+        self.game_id = None
+        self.board = None
+        self.color = None
+        self.sent_at: Dict[int, float] = dict()  # Ply -> time
+        self.finished = asyncio.Event()
+
+    async def run(self) -> None:
+        try:
+            await self.sign_up()
+            self.stats.players += 1
+            await self.search()
+            await self.finished.wait()
+        except (aiohttp.ClientError, socketio.exceptions.ConnectionError,
+                asyncio.TimeoutError, AssertionError):
+            self.stats.errors += 1
+        finally:
+            for client in (self.lobby, self.game):
+                if client is not None and client.connected:
+                    await client.disconnect()
+
+    async def sign_up(self) -> None:
+        login = gen_string(12, ascii_letters)
+        password = gen_string(12, ascii_letters + digits)
+
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"{self.url}/sign_up") as response:
+                text = await response.text()
+            data = {'login': login,
+                    'password': password,
+                    'confirm_password': password}
+            # There is no token, if CSRF protection is off (StackConfig)
+            csrf_token = re.search(
+                r'"csrf_token" type="hidden" value="([^"]*)"', text
+            )
+            if csrf_token is not None:
+                data['csrf_token'] = csrf_token.groups()[0]
+            async with session.post(f"{self.url}/sign_up",
+                                    data=data) as response:
+                assert response.url.path == '/lobby'
+
+            self.cookies = '; '.join(
+                f"{cookie.key}={cookie.value}"
+                for cookie in session.cookie_jar
+            )
+
+    def new_client(self) -> socketio.AsyncClient:
+        return socketio.AsyncClient(reconnection=False)
+
+    async def search(self) -> None:
+        loop = asyncio.get_event_loop()
+        if self.finished.is_set():
+            return
+        if loop.time() > self.deadline:
+            self.finished.set()
+            return
+
+        self.lobby = self.new_client()
+        self.lobby.on('redirect', self.on_redirect)
+        await self.lobby.connect(f"{self.url}?request_type=lobby",
+                                 headers={'Cookie': self.cookies},
+                                 transports=['websocket'])
+        await self.lobby.emit('search_game',
+                              {'minutes': choice(self.time_controls)})
+
+    async def on_redirect(self, data) -> None:
+        # Like the browser: the game page connects, the lobby page leaves
+        self.game_id = int(data['url'].split('/')[-1])
+        self.game = self.new_client()
+        self.game.on('game_started', self.on_game_started)
+        self.game.on('game_updated', self.on_game_updated)
+        self.game.on('game_ended', self.on_game_ended)
+        await self.game.connect(
+            f"{self.url}?request_type=game&game_id={self.game_id}",
+            headers={'Cookie': self.cookies},
+            transports=['websocket'],
+        )
+        await self.lobby.disconnect()
+
+    async def on_game_started(self, data) -> None:
+        if not data.get('is_player'):
+            return
+        if self.board is not None:  # Sent by start_game and on connect
+            return
+        self.board = chess.Board()
+        for move_san in filter(None, data['moves'].split(',')):
+            self.board.push_san(move_san)
+        self.color = data['color'] == 'w'
+        await self.move_if_our_turn()
+
+    async def move_if_our_turn(self) -> None:
+        board = self.board
+        if board.turn != self.color or board.is_game_over():
+            return
+
+        await asyncio.sleep(expovariate(1 / self.think_time)
+                            if self.think_time else 0)
+        if board is not self.board:  # The game has ended
+            return
+        move = choice(list(board.legal_moves))
+        ply = len(board.move_stack)
+        self.sent_at[ply] = asyncio.get_event_loop().time()
+        await self.game.emit('make_move', {'san': board.san(move),
+                                           'game_id': self.game_id})
+
+    async def on_game_updated(self, data) -> None:
+        if self.board is None:
+            return
+        sent_at = self.sent_at.pop(len(self.board.move_stack), None)
+        if sent_at is not None:
+            self.stats.latency.record(
+                asyncio.get_event_loop().time() - sent_at
+            )
+        self.board.push_san(data['san'])
+        self.stats.moves += 1
+        await self.move_if_our_turn()
+
+    async def on_game_ended(self, data) -> None:
+        self.stats.games += 1
+        self.board = None
+        self.sent_at.clear()
+        # The handler mustn't wait for its own client to disconnect
+        asyncio.ensure_future(self.play_again())
+
+    async def play_again(self) -> None:
+        await self.game.disconnect()
+        try:
+            await self.search()
+        except (socketio.exceptions.ConnectionError, asyncio.TimeoutError):
+            self.stats.errors += 1
+            self.finished.set()
+
+
+async def run(url: str, players: int, arrival_rate: float,
+              think_time: float, time_controls: List[int],
+              duration: float, grace_period: float) -> Stats:
+    stats = Stats()
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    deadline = start + duration
+
+    def stop() -> None:
+        # E.g. a seeker without an opponent would wait forever
+        for player in swarm:
+            if not player.finished.is_set():
+                stats.stopped += 1
+                player.finished.set()
+
+    loop.call_at(deadline + grace_period, stop)
+
+    swarm = list()
+    tasks = list()
+    for _ in range(players):
+        if loop.time() > deadline:
+            break
+        swarm.append(Player(url, time_controls, think_time, deadline, stats))
+        tasks.append(asyncio.ensure_future(swarm[-1].run()))
+        await asyncio.sleep(1 / arrival_rate)
+    try:
+        # Stopped players only have to disconnect
+        await asyncio.wait_for(
+            asyncio.gather(*tasks, return_exceptions=True),
+            max(deadline + grace_period - loop.time(), 0) + DISCONNECT_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        print("Some players didn't disconnect in time")
+    # Unexpected errors of players don't stop the others
+    stats.errors += sum(1 for task in tasks if task.done() and
+                        not task.cancelled() and task.exception())
+
+    elapsed = loop.time() - start
+    print(f"Players: {stats.players}, errors: {stats.errors}, "
+          f"stopped: {stats.stopped}")
+    print(f"Games: {stats.games}, moves: {stats.moves}, "
+          f"{stats.moves / elapsed:.1f} moves/s, "
+          f"{stats.games / elapsed:.2f} games/s")
+    print("Move latency (sent -> game_updated):")
+    for percent in (50, 90, 99, 99.9):
+        latency = stats.latency.percentile(percent) * 1000
+        print(f"  p{percent}: {latency:.1f} ms")
+    print(f"  max: {stats.latency.max / 1000:.1f} ms")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--url', default="http://localhost:8000")
+    parser.add_argument('--players', type=int, default=1000)
+    parser.add_argument('--arrival-rate', type=float, default=50,
+                        help="players arriving per second")
+    parser.add_argument('--think-time', type=float, default=2,
+                        help="mean seconds before a move")
+    parser.add_argument('--time-controls', type=int, nargs='+', default=[1],
+                        help="minutes, a random one is searched for")
+    parser.add_argument('--duration', type=float, default=60 * 10,
+                        help="seconds, no new games are searched after it")
+    parser.add_argument('--grace-period', type=float, default=60 * 2,
+                        help="seconds after the duration, then players, "
+                             "who are still waiting or playing, are stopped")
+    args = parser.parse_args()
+
+    asyncio.get_event_loop().run_until_complete(run(
+        args.url, args.players, args.arrival_rate, args.think_time,
+        args.time_controls, args.duration, args.grace_period,
+    ))
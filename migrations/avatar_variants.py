@@ -0,0 +1,60 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+    This module saves sized variants of avatars uploaded before
+    the variants were introduced (static/img/profiles/<avatar hash>.jpg).
+    They keep their avatar hashes, so users aren't updated.
+    Run it from the project directory: python3 -m migrations.avatar_variants
+"""
+
+
+from argparse import ArgumentParser
+import os
+from hydraChess import avatars
+
+
+def migrate(directory: str) -> None:
+    converted = 0
+    failed = 0
+
+    for filename in sorted(os.listdir(directory)):
+        avatar_hash, extension = os.path.splitext(filename)
+        # Variants are named <avatar hash>-<size>.<extension>
+        if extension != '.jpg' or '-' in avatar_hash:
+            continue
+        if avatars.has_variants(avatar_hash, directory):
+            continue
+
+        try:
+            avatars.save_variants(os.path.join(directory, filename),
+                                  directory, avatar_hash)
+        except avatars.INVALID_IMAGE_ERRORS:
+            print(f"{filename} can't be read, skipped")
+            failed += 1
+            continue
+        converted += 1
+
+    print(f"Converted avatars: {converted}")
+    print(f"Skipped avatars: {failed}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--dir', default=avatars.PROFILES_DIR)
+    args = parser.parse_args()
+
+    migrate(args.dir)
@@ -0,0 +1,87 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+    This module moves users' played games from the comma-separated
+    raw_game_ids field to sorted sets scored by finish time.
+    Run it from the project directory: python3 -m migrations.game_index
+"""
+
+
+from argparse import ArgumentParser
+import re
+import rom.util
+from hydraChess.config import ProductionConfig
+from hydraChess.models import User, Game
+from migrations.pack_moves import rewrite_hash
+
+
+def get_finish_times(conn, game_ids: list) -> list:
+    '''Finish times of the games, the oldest goes first. The last move time
+       is used, so the order is kept for games without moves too.'''
+    pipe = conn.pipeline(False)
+    for game_id in game_ids:
+        pipe.hget(f"{Game._namespace}:{game_id}", 'last_move_datetime')
+
+    finish_times = list()
+    prev = 0.0
+    for last_move_datetime in pipe.execute():
+        # raw_game_ids is LIFO, so every next game must go after the previous
+        finished_at = float(last_move_datetime or 0)
+        prev = max(finished_at, prev + 0.001)
+        finish_times.append(prev)
+    return finish_times
+
+
+def migrate():
+    conn = rom.util.get_connection()
+    user_key = re.compile(rf'^{User._namespace}:(\d+)$')
+
+    converted = 0
+    games_cnt = 0
+
+    for key in conn.scan_iter(f"{User._namespace}:*", count=1000):
+        match = user_key.match(key.decode())
+        if not match or not conn.hexists(key, 'raw_game_ids'):
+            continue
+
+        user = User.get(int(match.group(1)))
+        raw_game_ids = conn.hget(key, 'raw_game_ids').decode()
+        game_ids = list(map(int, reversed(raw_game_ids.split(','))))\
+            if raw_game_ids else []
+
+        if game_ids:
+            for game_id, finished_at in zip(game_ids,
+                                            get_finish_times(conn, game_ids)):
+                user.append_game_id(game_id, finished_at)
+            user.save()
+        conn.hdel(key, 'raw_game_ids')
+        rewrite_hash(conn, key)
+
+        converted += 1
+        games_cnt += len(game_ids)
+
+    print(f"Converted users: {converted}")
+    print(f"Indexed games: {games_cnt}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--db', type=int, default=ProductionConfig.REDIS_DB_ID)
+    args = parser.parse_args()
+
+    rom.util.set_connection_settings(db=args.db)
+    migrate()
@@ -0,0 +1,96 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+    This module converts games with comma-separated SAN moves (raw_moves)
+    to packed moves and reports Redis memory saved per game.
+    Run it from the project directory: python3 -m migrations.pack_moves
+"""
+
+
+from argparse import ArgumentParser
+import re
+import rom.util
+from hydraChess.config import ProductionConfig
+from hydraChess.models import Game
+
+
+LEGACY_FIELDS = ('raw_moves', 'raw_tail_moves')
+
+
+def get_memory_usage(conn, *keys) -> int:
+    return sum(conn.memory_usage(key, samples=0) or 0 for key in keys)
+
+
+def rewrite_hash(conn, key) -> None:
+    '''Recreates the hash, so Redis can use compact encoding for it again'''
+    fields = conn.hgetall(key)
+    pipe = conn.pipeline(True)
+    pipe.delete(key)
+    pipe.hset(key, mapping=fields)
+    pipe.execute()
+
+
+def migrate():
+    conn = rom.util.get_connection()
+    game_key = re.compile(rf'^{Game._namespace}:(\d+)$')
+
+    converted = 0
+    failed = 0
+    memory_before = 0
+    memory_after = 0
+
+    for key in conn.scan_iter(f"{Game._namespace}:*", count=1000):
+        match = game_key.match(key.decode())
+        if not match or not conn.hexists(key, 'raw_moves'):
+            continue
+
+        game = Game.get(int(match.group(1)))
+        raw_moves = conn.hget(key, 'raw_moves').decode()
+        before = get_memory_usage(conn, key, game.moves_key)
+
+        try:
+            game.moves = raw_moves.split(',') if raw_moves else []
+        except ValueError:
+            print(f"Game {game.id} has illegal moves, skipped")
+            failed += 1
+            continue
+
+        game.save()
+        conn.hdel(key, *LEGACY_FIELDS)
+        rewrite_hash(conn, key)
+
+        converted += 1
+        memory_before += before
+        memory_after += get_memory_usage(conn, key, game.moves_key)
+
+    print(f"Converted games: {converted}")
+    print(f"Skipped games: {failed}")
+    if converted:
+        print(f"Memory per game before: {memory_before / converted:.1f} B")
+        print(f"Memory per game after: {memory_after / converted:.1f} B")
+        print("Memory saved per game: "
+              f"{(memory_before - memory_after) / converted:.1f} B")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--db', type=int, default=ProductionConfig.REDIS_DB_ID)
+    args = parser.parse_args()
+
+    rom.util.set_connection_settings(db=args.db)
+    migrate()
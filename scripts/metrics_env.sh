@@ -0,0 +1,10 @@
+#!/bin/bash
+
+# Usage: source metrics_env.sh NAME PORT
+# Prepares the metrics of a Celery worker, see hydraChess/metrics.py.
+# Metrics are served on PORT, unless METRICS_PORT is already set.
+
+export METRICS_PORT=${METRICS_PORT:-$2}
+export prometheus_multiproc_dir=/tmp/hydraChess_metrics/$1
+rm -rf ${prometheus_multiproc_dir}
+mkdir -p ${prometheus_multiproc_dir}
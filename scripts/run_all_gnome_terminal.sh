@@ -9,5 +9,6 @@ gnome-terminal -e "bash -c \"cd $SCRIPTS_DIR; ./purge_tasks.sh; ./run_high.sh\""
 gnome-terminal -e "bash -c \"cd $SCRIPTS_DIR; ./run_normal.sh\""
 gnome-terminal -e "bash -c \"cd $SCRIPTS_DIR; ./run_low.sh\""
 gnome-terminal -e "bash -c \"cd $SCRIPTS_DIR; ./run_searcher.sh\""
+gnome-terminal -e "bash -c \"cd $SCRIPTS_DIR; ./run_timers.sh\""
 gnome-terminal -e "bash -c \"cd $SCRIPTS_DIR; ./run_flower.sh\""
 gnome-terminal -e "bash -c \"cd $SCRIPTS_DIR; ./run_app.sh\""
@@ -1,6 +1,29 @@
 #!/bin/bash
 
+# Usage: ./run_searcher.sh [-p METRICS_PORT] [MINUTES...]
+# Serves the search queues of the given time controls (all of them by default).
+# Pairing is atomic, so any number of searchers may serve any time controls.
+# Metrics are served on port 9104 by default, pass another port to every
+# other searcher on the host.
+
+while getopts "p:" option; do
+    case ${option} in
+        p) METRICS_PORT=${OPTARG} ;;
+        *) exit 1 ;;
+    esac
+done
+shift $((OPTIND - 1))
+
 SCRIPTS_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" >/dev/null 2>&1 && pwd )"
 source ${SCRIPTS_DIR}/../dev/bin/activate
 cd ${SCRIPTS_DIR}/..
-celery -A hydraChess.game_management.celery worker --concurrency 1 -Q search -n worker.searcher -l=WARNING  # DO NOT CHANGE THE CONCURRENCY VALUE
+
+MINUTES=${@:-1 2 3 5 10 15 20 30 60}
+QUEUES=search
+for minutes in $MINUTES; do
+    QUEUES="${QUEUES},search_${minutes}"
+done
+NAME=worker.searcher_$(echo $MINUTES | tr ' ' '_')
+source ${SCRIPTS_DIR}/metrics_env.sh ${NAME} 9104
+
+celery -A hydraChess.game_management.celery worker --concurrency 4 -Q ${QUEUES} -n ${NAME} -l=WARNING
@@ -266,6 +266,41 @@ class TestGamesApi(unittest.TestCase):
 
                     self.assertEqual(expected_data, response_data)
 
+    def test_games_list_cursor(self):
+        game = Game()
+        white_user = User.get_by(login=self.user_data['login'])
+        black_user = User(login=uuid4().hex[:15])
+        black_user.save()
+        game.black_user = black_user
+        game.white_user = white_user
+        game.result = "1-0"
+        game.save()
+
+        for _ in range(25):
+            cur_game = game.copy()
+            cur_game.save()
+            white_user.append_game_id(cur_game.id)
+            white_user.games_played += 1
+            white_user.save()
+
+        url = app.config['HOST'] + 'api/v1.x/games_list'
+        data = {'nickname': self.user_data['login'], 'size': 10}
+
+        game_ids = list()
+        for expected_size in (10, 10, 5):
+            json = requests.get(url, data=data).json()
+            self.assertEqual(len(json["games"]), expected_size)
+            game_ids.extend(game["id"] for game in json["games"])
+            data['cursor'] = json.get("next_cursor")
+
+        self.assertIsNone(data['cursor'])
+        self.assertEqual(game_ids, white_user.game_ids)
+
+        for cursor in ('abc', 'nan:1', 'inf:1'):
+            data['cursor'] = cursor
+            resp = requests.get(url, data=data)
+            self.assertEqual(resp.status_code, 400)
+
     def test_game_resource_no_id(self):
         url = app.config['HOST'] + 'api/v1.x/game'
         resp = requests.get(url)
@@ -313,10 +348,10 @@ class TestGamesApi(unittest.TestCase):
         game = Game(
             white_user=white_user,
             black_user=black_user,
-            raw_moves="e4,e5,Nf3,Nc6,Bb5,a6",
             is_finished=True,
             result="1/2-1/2"
         )
+        game.moves = ['e4', 'e5', 'Nf3', 'Nc6', 'Bb5', 'a6']
         game.save()
 
         game_id = game.id
@@ -334,7 +369,7 @@ class TestGamesApi(unittest.TestCase):
                     "rating": game.black_rating,
                     "nickname": game.black_user.login
                 },
-                "moves": game.raw_moves,
+                "moves": "e4,e5,Nf3,Nc6,Bb5,a6",
                 "result": game.result
             }
         }
@@ -351,10 +386,10 @@ class TestGamesApi(unittest.TestCase):
         game = Game(
             white_user=white_user,
             black_user=black_user,
-            raw_moves="e4,e5,Nf3,Nc6,Bb5,a6",
             is_finished=True,
             result="1/2-1/2"
         )
+        game.moves = ['e4', 'e5', 'Nf3', 'Nc6', 'Bb5', 'a6']
         game.save()
 
         game_id = game.id
@@ -372,7 +407,7 @@ class TestGamesApi(unittest.TestCase):
                     "rating": game.black_rating,
                     "nickname": game.black_user.login
                 },
-                "moves": game.raw_moves,
+                "moves": "e4,e5,Nf3,Nc6,Bb5,a6",
                 "result": game.result,
                 "color": "w"
             }
@@ -0,0 +1,80 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import unittest
+from PIL import Image
+from hydraChess import avatars
+
+
+class TestAvatars(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dir = self.tmp_dir.name
+        self.upload_path = os.path.join(self.dir, 'upload')
+        # Left half is red, right half is blue, the crop keeps the middle
+        img = Image.new('RGB', (600, 300), (255, 0, 0))
+        img.paste((0, 0, 255), (300, 0, 600, 300))
+        img.save(self.upload_path, 'PNG')
+
+    def test_save_variants(self):
+        avatar_hash = avatars.save_variants(self.upload_path, self.dir)
+        self.assertEqual(avatar_hash, avatars.hash_file(self.upload_path))
+        self.assertEqual(len(avatar_hash), avatars.HASH_LENGTH)
+        self.assertTrue(avatars.has_variants(avatar_hash, self.dir))
+
+        for size in avatars.SIZES:
+            for extension, img_format in avatars.FORMATS:
+                path = os.path.join(
+                    self.dir, avatars.get_filename(avatar_hash, size,
+                                                   extension)
+                )
+                with Image.open(path) as img:
+                    self.assertEqual(img.format, img_format)
+                    self.assertEqual(img.size, (size, size))
+        self.assertEqual(
+            len(os.listdir(self.dir)),
+            len(avatars.SIZES) * len(avatars.FORMATS) + 1
+        )
+
+    def test_variants_are_saved_once(self):
+        avatar_hash = avatars.save_variants(self.upload_path, self.dir)
+        path = os.path.join(self.dir, avatars.get_filename(avatar_hash, 256,
+                                                           'jpg'))
+        os.utime(path, (0, 0))
+
+        self.assertEqual(avatars.save_variants(self.upload_path, self.dir),
+                         avatar_hash)
+        self.assertEqual(os.path.getmtime(path), 0)
+
+    def test_not_an_image(self):
+        with open(self.upload_path, 'wb') as upload:
+            upload.write(b'not an image')
+        with self.assertRaises(OSError):
+            avatars.save_variants(self.upload_path, self.dir)
+
+    def test_decompression_bomb(self):
+        max_image_pixels = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = 1000
+        try:
+            with self.assertRaises(avatars.INVALID_IMAGE_ERRORS):
+                avatars.save_variants(self.upload_path, self.dir)
+        finally:
+            Image.MAX_IMAGE_PIXELS = max_image_pixels
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
@@ -0,0 +1,121 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+from chess import Board
+from prometheus_client import REGISTRY
+import rom.util
+from hydraChess.board_cache import BoardCache
+from hydraChess.models import Game
+from hydraChess.config import TestingConfig
+
+
+class TestBoardCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rom.util.set_connection_settings(db=TestingConfig.REDIS_DB_ID)
+
+    def setUp(self):
+        self.used_game_ids = list()
+
+    def create_game(self) -> Game:
+        game = Game()
+        game.save()
+        self.used_game_ids.append(game.id)
+        return game
+
+    def get_sample(self, name: str) -> float:
+        return REGISTRY.get_sample_value(name) or 0
+
+    def test_hit(self):
+        cache = BoardCache(10)
+        game = self.create_game()
+        hits = self.get_sample('hydrachess_board_cache_hits_total')
+        misses = self.get_sample('hydrachess_board_cache_misses_total')
+
+        board = cache.take(game)
+        for move in ('e4', 'e5', 'Nf3'):
+            game.push_move(board, move)
+            cache.put(game, board)
+            board = cache.take(game)
+
+        self.assertEqual(board, game.get_board())
+        self.assertEqual(cache.hits, 3)
+        self.assertEqual(cache.misses, 1)
+        # Exported for all the caches of the process
+        self.assertEqual(self.get_sample('hydrachess_board_cache_hits_total'),
+                         hits + 3)
+        self.assertEqual(
+            self.get_sample('hydrachess_board_cache_misses_total'), misses + 1
+        )
+        self.assertEqual(self.get_sample('hydrachess_board_cache_size'), 0)
+
+    def test_stale_board(self):
+        cache = BoardCache(10)
+        game = self.create_game()
+
+        board = cache.take(game)
+        game.push_move(board, 'e4')
+        cache.put(game, board)
+
+        # Another worker makes the next move
+        game.push_move(game.get_board(), 'e5')
+
+        board = cache.take(game)
+        expected_board = Board()
+        expected_board.push_san('e4')
+        expected_board.push_san('e5')
+
+        self.assertEqual(board, expected_board)
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(cache.misses, 2)
+
+    def test_eviction(self):
+        cache = BoardCache(2)
+        games = [self.create_game() for _ in range(3)]
+
+        for game in games:
+            cache.put(game, cache.take(game))
+
+        self.assertEqual(cache.stats()['size'], 2)
+        self.assertEqual(cache.evictions, 1)
+
+        cache.take(games[0])
+        self.assertEqual(cache.misses, 4)
+        cache.take(games[2])
+        self.assertEqual(cache.hits, 1)
+
+    def test_discard(self):
+        cache = BoardCache(10)
+        game = self.create_game()
+
+        cache.put(game, cache.take(game))
+        cache.discard(game.id)
+        cache.take(game)
+
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(cache.misses, 2)
+
+    def tearDown(self):
+        for game_id in self.used_game_ids:
+            game = Game.get(game_id)
+            game.delete()
+        self.used_game_ids.clear()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import rom.util
+from hydraChess import concurrency, identity_map
+from hydraChess.models import User
+from hydraChess.config import TestingConfig
+
+
+class TestConcurrency(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Round trips are counted
+        identity_map.set_connection_settings(db=TestingConfig.REDIS_DB_ID)
+        rom.util.use_null_session()
+
+    def setUp(self):
+        self.conn = rom.util.get_connection()
+        self.conn.delete(concurrency.STATS_KEY)
+        self.user = User(rating=1200)
+        self.user.save()
+        self.attempts = 0
+
+    def write(self, command: str, *args) -> None:
+        '''Writes like another writer, which increments the version'''
+        pipe = self.conn.pipeline(True)
+        getattr(pipe, command)(self.user._pk, *args)
+        pipe.hincrby(self.user._pk, 'version', 1)
+        pipe.execute()
+
+    def add_rating(self, user: User) -> None:
+        self.attempts += 1
+        if self.attempts == 1:
+            # Another writer updates the user meanwhile
+            self.write('hincrby', 'rating', 10)
+        user.rating += 5
+
+    def test_conflicting_update_is_retried(self):
+        user = User.get(self.user.id)
+        self.assertTrue(concurrency.update(user, self.add_rating,
+                                           record_stats=True, name='test'))
+        self.assertEqual(self.attempts, 2)
+        self.assertEqual(int(self.conn.hget(self.user._pk, 'rating')), 1215)
+
+        self.assertEqual(concurrency.get_stats(), {
+            'test': {'updates': 1, 'contended_updates': 1, 'conflicts': 1}
+        })
+
+    def test_racing_writes_to_empty_column(self):
+        user = User.get(self.user.id)
+
+        def join(user: User) -> bool:
+            self.attempts += 1
+            if user.cur_game_id is not None:
+                return False
+            if self.attempts == 1:
+                # Another writer sets the empty column meanwhile
+                self.write('hset', 'cur_game_id', 1)
+            user.cur_game_id = 2
+
+        self.assertFalse(concurrency.update(user, join))
+        self.assertEqual(self.attempts, 2)
+        self.assertEqual(int(self.conn.hget(self.user._pk, 'cur_game_id')), 1)
+
+        # Set after the user was loaded, before the update
+        self.write('hset', 'in_search', 1)
+
+        def search(user: User) -> bool:
+            if user.in_search:
+                return False
+            user.in_search = True
+
+        self.assertFalse(concurrency.update(user, search))
+
+    def test_uncontended_update_takes_one_round_trip(self):
+        user = User.get(self.user.id)
+
+        def add_rating(user: User) -> None:
+            user.rating += 5
+
+        concurrency.update(user, add_rating)  # Scripts are loaded
+        round_trips = identity_map.get_round_trips()
+        self.assertTrue(concurrency.update(user, add_rating))
+        self.assertEqual(identity_map.get_round_trips() - round_trips, 1)
+        self.assertEqual(int(self.conn.hget(self.user._pk, 'rating')), 1210)
+
+    def test_update_saved_before_versions(self):
+        self.conn.hdel(self.user._pk, 'version')
+        user = User.get(self.user.id)
+        user.refresh()
+
+        def join(user: User) -> bool:
+            self.attempts += 1
+            if user.cur_game_id is not None:
+                return False
+            user.cur_game_id = 2
+
+        # Set after the user was loaded, before the update
+        self.write('hset', 'cur_game_id', 1)
+        self.assertFalse(concurrency.update(user, join))
+        self.assertEqual(self.attempts, 1)
+        self.assertEqual(int(self.conn.hget(self.user._pk, 'version')), 1)
+
+    def test_update_is_skipped(self):
+        user = User.get(self.user.id)
+
+        def skip(user: User) -> bool:
+            user.rating += 5
+            return False
+
+        self.assertFalse(concurrency.update(user, skip))
+        self.assertEqual(int(self.conn.hget(self.user._pk, 'rating')), 1200)
+
+    def test_update_under_lock(self):
+        user = User.get(self.user.id)
+
+        def add_rating(user: User) -> None:
+            user.rating += 5
+
+        self.assertTrue(concurrency.update(user, add_rating,
+                                           optimistic=False))
+        self.assertEqual(int(self.conn.hget(self.user._pk, 'rating')), 1205)
+
+    def test_too_many_conflicts(self):
+        user = User.get(self.user.id)
+
+        def add_rating(user: User) -> None:
+            self.write('hincrby', 'rating', 10)
+            user.rating += 5
+
+        with self.assertRaises(rom.exceptions.DataRaceError):
+            concurrency.update(user, add_rating)
+
+    def test_conflicting_transaction_is_retried(self):
+        def load_and_mutate():
+            self.attempts += 1
+            user = User.get(self.user.id)
+            user.append_game_id(1, finished_at=1)
+            if self.attempts == 1:
+                self.write('hincrby', 'rating', 10)
+            user.rating += 5
+            return [user]
+
+        self.assertTrue(concurrency.transact([self.user._pk], load_and_mutate))
+        self.assertEqual(self.attempts, 2)
+        self.assertEqual(int(self.conn.hget(self.user._pk, 'rating')), 1215)
+        self.assertEqual(self.conn.zrange(self.user.games_key, 0, -1), [b'1'])
+
+    def test_transaction_is_skipped(self):
+        self.assertFalse(concurrency.transact([self.user._pk], lambda: None))
+
+    def tearDown(self):
+        self.conn.delete(self.user.games_key)
+
+        self.conn.delete(concurrency.STATS_KEY)
+        self.user.delete()
@@ -0,0 +1,281 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta
+from typing import Optional
+from random import randint
+from uuid import uuid4
+import rom.util
+from hydraChess.config import TestingConfig
+from hydraChess.__main__ import app
+from hydraChess.models import User, Game
+from hydraChess import concurrency, game_management, matchmaking, snapshots
+from hydraChess import timers
+
+
+class TestGameManagement(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        app.config.from_object(TestingConfig)
+        rom.util.set_connection_settings(db=app.config['REDIS_DB_ID'])
+        rom.util.use_null_session()
+
+    def setUp(self):
+        self.white_user = User(login=uuid4().hex[:15])
+        self.white_user.save()
+        self.black_user = User(login=uuid4().hex[:15])
+        self.black_user.save()
+        self.game = Game(white_user=self.white_user,
+                         black_user=self.black_user,
+                         white_rating=1200, black_rating=1200)
+        self.game.total_clock = timedelta(minutes=1)
+        self.game.white_clock = self.game.black_clock = timedelta(minutes=1)
+        self.game.save()
+
+        # Tasks aren't sent, their calls are checked
+        patcher = mock.patch.object(game_management.end_game, 'delay')
+        self.end_game = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def set_far_ratings(self) -> None:
+        # Nobody else searching can be paired with the users
+        rating = 10**6 + randint(0, 10**6)
+        for user in (self.white_user, self.black_user):
+            user.rating = rating
+            user.save()
+            self.addCleanup(matchmaking.remove, user.id)
+
+    def make_moves(self, *moves_san: str) -> None:
+        board = self.game.get_board()
+        for move_san in moves_san:
+            self.game.push_move(board, move_san)
+        self.assertTrue(self.game.commit_move())
+
+    def test_conflicting_move_is_made_again(self):
+        commit_move = Game.commit_move
+        attempts = 0
+
+        def conflict_once(game: Game) -> bool:
+            nonlocal attempts
+            attempts += 1
+            return attempts > 1 and commit_move(game)
+
+        with mock.patch.object(Game, 'commit_move', conflict_once),\
+                mock.patch.object(game_management.sio, 'emit') as emit:
+            game_management.make_move.run(self.white_user.id, self.game.id,
+                                          'e4')
+
+        self.assertEqual(attempts, 2)
+        self.assertEqual(Game.get(self.game.id).moves, ['e4'])
+        self.assertEqual(sum(call[0][0] == 'game_updated'
+                             for call in emit.call_args_list), 1)
+
+    def test_move_conflicts_are_bounded(self):
+        with mock.patch.object(Game, 'commit_move', return_value=False):
+            with self.assertRaises(rom.exceptions.DataRaceError):
+                game_management.make_move.run(self.white_user.id,
+                                              self.game.id, 'e4')
+        self.assertEqual(Game.get(self.game.id).moves, [])
+
+    def test_time_is_up(self):
+        self.make_moves('e4')
+        self.game.last_move_datetime = datetime.utcnow() - timedelta(minutes=2)
+        self.game.save()
+
+        game_management.on_time_is_up.run(self.black_user.id, self.game.id)
+        self.end_game.assert_called_once_with(self.game.id, '1-0',
+                                              "Black's time is up.")
+
+    def test_stale_time_is_up(self):
+        # Black's clock runs out in a minute
+        self.make_moves('e4')
+        self.game.last_move_datetime = datetime.utcnow()
+        self.game.save()
+
+        game_management.on_time_is_up.run(self.black_user.id, self.game.id)
+        self.end_game.assert_not_called()
+
+    def test_disconnect_timed_out(self):
+        self.make_moves('e4', 'e5')
+        self.game.white_disconnect_timed_out_eta =\
+            datetime.utcnow() - timedelta(seconds=1)
+        self.game.save()
+
+        game_management.on_disconnect_timed_out.run(self.white_user.id,
+                                                    self.game.id)
+        self.end_game.assert_called_once_with(
+            self.game.id, '0-1', "White player disconnected. Black won."
+        )
+
+    def test_stale_disconnect_timed_out(self):
+        # The user has reconnected and disconnected again
+        self.make_moves('e4', 'e5')
+        self.game.white_disconnect_timed_out_eta =\
+            datetime.utcnow() + timedelta(seconds=30)
+        self.game.save()
+
+        game_management.on_disconnect_timed_out.run(self.white_user.id,
+                                                    self.game.id)
+        self.end_game.assert_not_called()
+
+    def test_finish_game(self):
+        self.white_user.games_played = 29
+        self.white_user.cur_game_id = self.black_user.cur_game_id =\
+            self.game.id
+        self.white_user.save()
+        self.black_user.save()
+
+        with mock.patch.object(concurrency, 'transact',
+                               wraps=concurrency.transact) as transact:
+            game, rating_deltas = game_management.finish_game(
+                self.game.id, '1-0', True
+            )
+        transact.assert_called_once()
+        self.assertEqual(game.id, self.game.id)
+        self.assertEqual(rating_deltas, {'w': 20, 'b': -20})
+
+        game = Game.get(self.game.id)
+        self.assertTrue(game.is_finished)
+        self.assertEqual(game.result, '1-0')
+        white_user = User.get(self.white_user.id)
+        black_user = User.get(self.black_user.id)
+        self.assertEqual((white_user.rating, black_user.rating), (1220, 1180))
+        # The white user has played 30 games now
+        self.assertEqual((white_user.k_factor, black_user.k_factor), (20, 40))
+        self.assertEqual((white_user.games_played, black_user.games_played),
+                         (30, 1))
+        for user in (white_user, black_user):
+            self.assertIsNone(user.cur_game_id)
+            self.assertEqual(user.game_ids, [self.game.id])
+
+        self.assertIsNone(game_management.finish_game(self.game.id, '0-1',
+                                                      True))
+        self.assertEqual(User.get(self.white_user.id).rating, 1220)
+
+    def test_finish_game_without_stats(self):
+        self.white_user.cur_game_id = self.game.id
+        self.white_user.save()
+
+        game, rating_deltas = game_management.finish_game(self.game.id, '-',
+                                                          False)
+        self.assertEqual(rating_deltas, {'w': 0, 'b': 0})
+        self.assertEqual(Game.get(self.game.id).result, '-')
+        for user_id in (self.white_user.id, self.black_user.id):
+            user = User.get(user_id)
+            self.assertIsNone(user.cur_game_id)
+            self.assertEqual((user.rating, user.games_played), (1200, 0))
+            self.assertEqual(user.game_ids, [])
+
+    def test_start_games(self):
+        self.set_far_ratings()
+        for user in (self.white_user, self.black_user):
+            user.in_search = True
+            user.save()
+
+        with mock.patch.object(game_management.sio, 'emit') as emit,\
+                mock.patch.object(game_management.start_game,
+                                  'delay') as start_game:
+            game_management.start_games(
+                [(self.white_user.id, self.black_user.id)], 60
+            )
+
+        white_user = User.get(self.white_user.id)
+        black_user = User.get(self.black_user.id)
+        game = Game.get(white_user.cur_game_id)
+        self.addCleanup(game.delete)
+        self.assertEqual(black_user.cur_game_id, game.id)
+        self.assertEqual((game.white_user.id, game.black_user.id),
+                         (white_user.id, black_user.id))
+        self.assertEqual(game.total_clock, timedelta(seconds=60))
+        self.assertFalse(white_user.in_search)
+        self.assertFalse(black_user.in_search)
+        self.assertEqual(emit.call_count, 2)
+        start_game.assert_called_once_with(game.id)
+
+    def test_start_games_with_missing_user(self):
+        self.set_far_ratings()
+        missing_user = User(login=uuid4().hex[:15])
+        missing_user.save()
+        missing_user.delete()
+
+        with mock.patch.object(game_management.sio, 'emit') as emit,\
+                mock.patch.object(game_management.start_game,
+                                  'delay') as start_game:
+            game_management.start_games(
+                [(self.white_user.id, missing_user.id)], 60
+            )
+
+        emit.assert_not_called()
+        start_game.assert_not_called()
+        self.assertIsNone(User.get(self.white_user.id).cur_game_id)
+        # The user keeps searching
+        pool_key = matchmaking.POOL_KEY.format(60)
+        self.assertEqual(rom.util.get_connection().zscore(pool_key,
+                                                          self.white_user.id),
+                         self.white_user.rating)
+
+    def test_search_game(self):
+        self.set_far_ratings()
+        with mock.patch.object(game_management.sio, 'emit') as emit,\
+                mock.patch.object(game_management.start_game,
+                                  'delay') as start_game:
+            game_management.search_game.run(self.black_user.id, 1)
+            self.assertTrue(User.get(self.black_user.id).in_search)
+            start_game.assert_not_called()
+
+            game_management.search_game.run(self.white_user.id, 1)
+
+        white_user = User.get(self.white_user.id)
+        black_user = User.get(self.black_user.id)
+        game = Game.get(white_user.cur_game_id)
+        self.addCleanup(game.delete)
+        self.assertEqual(black_user.cur_game_id, game.id)
+        self.assertEqual((game.white_user.id, game.black_user.id),
+                         (white_user.id, black_user.id))
+        self.assertFalse(white_user.in_search)
+        self.assertFalse(black_user.in_search)
+        self.assertEqual(emit.call_count, 2)
+        start_game.assert_called_once_with(game.id)
+
+    def test_search_cancelled_before_add(self):
+        self.set_far_ratings()
+        search = matchmaking.search
+
+        def cancel_and_search(user_id: int, *args) -> Optional[int]:
+            game_management.cancel_search.run(user_id)
+            return search(user_id, *args)
+
+        with mock.patch.object(matchmaking, 'search', cancel_and_search):
+            game_management.search_game.run(self.white_user.id, 1)
+
+        self.assertFalse(User.get(self.white_user.id).in_search)
+        self.assertFalse(matchmaking.remove(self.white_user.id))
+
+    def tearDown(self):
+        timers.cancel(game_management.first_move_timer(self.game.id),
+                      game_management.time_is_up_timer(self.game.id))
+        game_management.board_cache.discard(self.game.id)
+        rom.util.get_connection().delete(snapshots.snapshot_key(self.game.id))
+        self.game.delete()
+        self.white_user.delete()
+        self.black_user.delete()
+
+
+if __name__ == "__main__":
+    unittest.main()
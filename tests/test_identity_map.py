@@ -0,0 +1,92 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import rom.util
+from hydraChess import identity_map
+from hydraChess.models import User, Game
+from hydraChess.config import TestingConfig
+
+
+class TestIdentityMap(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        identity_map.set_connection_settings(db=TestingConfig.REDIS_DB_ID)
+
+    @classmethod
+    def tearDownClass(cls):
+        rom.util.set_connection_settings(db=TestingConfig.REDIS_DB_ID)
+
+    def setUp(self):
+        # Other tests may turn the session off for all threads
+        rom.util.session.null_session = False
+
+        self.white_user = User()
+        self.white_user.save()
+        self.black_user = User()
+        self.black_user.save()
+        self.game = Game(white_user=self.white_user,
+                         black_user=self.black_user)
+        self.game.save()
+        rom.util.session.rollback()
+
+    def test_game_is_loaded_with_players_in_one_round_trip(self):
+        with identity_map.scope():
+            round_trips = identity_map.get_round_trips()
+            game = Game.get(self.game.id)
+            self.assertEqual(game.white_user.id, self.white_user.id)
+            self.assertEqual(game.black_user.id, self.black_user.id)
+            self.assertEqual(identity_map.get_round_trips(), round_trips + 1)
+
+            # Already loaded entities are taken from the identity map
+            self.assertIs(Game.get(self.game.id), game)
+            self.assertIs(User.get(self.white_user.id), game.white_user)
+            self.assertEqual(identity_map.get_round_trips(), round_trips + 1)
+
+    def test_scope_is_cleared_after_outermost_exit(self):
+        with identity_map.scope():
+            game = Game.get(self.game.id)
+            with identity_map.scope():
+                self.assertIs(Game.get(self.game.id), game)
+            self.assertIs(Game.get(self.game.id), game)
+
+        with identity_map.scope():
+            self.assertIsNot(Game.get(self.game.id), game)
+
+    def test_stats(self):
+        name = f"test_stats_{self.game.id}"
+        for _ in range(2):
+            with identity_map.scope(name, True):
+                Game.get(self.game.id)
+
+        self.assertEqual(identity_map.get_stats()[name], 1)
+        conn = rom.util.get_connection()
+        conn.hdel(identity_map.STATS_KEY, f"{name}:runs",
+                  f"{name}:round_trips")
+
+    def test_missing_game(self):
+        self.assertIsNone(Game.get(self.game.id + 10 ** 6))
+
+    def tearDown(self):
+        rom.util.session.rollback()
+        for entity in (Game.get(self.game.id), self.white_user,
+                       self.black_user):
+            entity.delete()
+        del rom.util.session.null_session
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,299 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+from multiprocessing import Barrier, Process
+from random import choice, randint, random, shuffle, Random
+from time import time
+import rom.util
+from hydraChess import matchmaking
+from hydraChess.config import TestingConfig
+
+
+class TestMatchmaking(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rom.util.set_connection_settings(db=TestingConfig.REDIS_DB_ID)
+
+    def setUp(self):
+        self.used_user_ids = list()
+        # Unique time control, so other tests' seekers don't interfere
+        self.seconds = randint(10 ** 6, 10 ** 9)
+
+    def add(self, rating: int, since: float) -> int:
+        user_id = randint(10 ** 6, 10 ** 9)
+        self.used_user_ids.append(user_id)
+        matchmaking.add(user_id, rating, self.seconds, since)
+        return user_id
+
+    def test_closest_rating(self):
+        now = time()
+        self.add(1350, now)
+        user_id = self.add(1480, now)
+        self.add(1600, now)
+
+        self.assertEqual(
+            matchmaking.find_opponent(1500, self.seconds, now),
+            user_id
+        )
+
+    def test_rating_window(self):
+        now = time()
+        self.add(1200, now)
+        self.add(1900, now)
+
+        self.assertIsNone(matchmaking.find_opponent(1500, self.seconds, now))
+        self.assertIsNone(matchmaking.find_opponent(1500, self.seconds + 1))
+
+    def test_rating_window_widens(self):
+        now = time()
+        user_id = self.add(1200, now)
+
+        self.assertIsNone(matchmaking.find_opponent(1500, self.seconds, now))
+        self.assertEqual(
+            matchmaking.find_opponent(1500, self.seconds, now + 10),
+            user_id
+        )
+
+    def test_remove(self):
+        now = time()
+        user_id = self.add(1500, now)
+
+        self.assertTrue(matchmaking.remove(user_id))
+        self.assertFalse(matchmaking.remove(user_id))
+        self.assertIsNone(matchmaking.find_opponent(1500, self.seconds, now))
+
+    def test_add_twice(self):
+        user_id = self.add(1500, time())
+
+        self.assertFalse(matchmaking.add(user_id, 1500, self.seconds + 1))
+        self.assertIsNone(matchmaking.find_opponent(1500, self.seconds + 1))
+
+    def test_search(self):
+        now = time()
+        user_id = randint(10 ** 6, 10 ** 9)
+        self.used_user_ids.append(user_id)
+
+        self.assertIsNone(matchmaking.search(user_id, 1500, self.seconds, now))
+        # Already searching
+        self.assertIsNone(matchmaking.search(user_id, 1500, self.seconds, now))
+        self.assertEqual(
+            matchmaking.find_opponent(1500, self.seconds, now),
+            user_id
+        )
+
+        opponent_id = randint(10 ** 6, 10 ** 9)
+        self.used_user_ids.append(opponent_id)
+        self.assertEqual(
+            matchmaking.search(opponent_id, 1450, self.seconds, now),
+            user_id
+        )
+        self.assertFalse(matchmaking.remove(user_id))
+        self.assertFalse(matchmaking.remove(opponent_id))
+
+    def test_claim(self):
+        user_id = self.add(1500, time())
+
+        self.assertFalse(matchmaking.claim(user_id, self.seconds + 1))
+        self.assertTrue(matchmaking.claim(user_id, self.seconds))
+        self.assertFalse(matchmaking.claim(user_id, self.seconds))
+        self.assertFalse(matchmaking.remove(user_id))
+
+    def test_pair_seekers(self):
+        now = time()
+        seekers = [(1, 1500, now), (2, 1560, now), (3, 1600, now)]
+        self.assertEqual(matchmaking.pair_seekers(seekers, now), [(2, 3)])
+
+        # Pairing 2 with 3 would leave 1 and 4 out
+        seekers.append((4, 1400, now))
+        self.assertEqual(sorted(matchmaking.pair_seekers(seekers, now)),
+                         [(2, 3), (4, 1)])
+
+    def test_pair_seekers_window(self):
+        now = time()
+        seekers = [(1, 1200, now), (2, 1500, now)]
+        self.assertEqual(matchmaking.pair_seekers(seekers, now), [])
+
+        seekers[0] = (1, 1200, now - 10)
+        self.assertEqual(matchmaking.pair_seekers(seekers, now), [(1, 2)])
+
+    def test_claim_pairs(self):
+        now = time()
+        first = self.add(1500, now)
+        second = self.add(1450, now)
+        third = self.add(1400, now)
+
+        # The third one cancels before the tick claims the pairs
+        pairs = [(first, second), (third, first)]
+        matchmaking.remove(third)
+        self.assertEqual(matchmaking.claim_pairs(pairs, self.seconds),
+                         [(first, second)])
+        self.assertFalse(matchmaking.remove(first))
+        self.assertFalse(matchmaking.remove(second))
+
+    def test_tick(self):
+        self.seconds = matchmaking.TIME_CONTROLS[-1] * 60
+        now = time()
+        first = self.add(1500, now)
+        second = self.add(1520, now)
+
+        self.assertIn((first, second),
+                      matchmaking.tick(now).get(self.seconds, []))
+        self.assertFalse(matchmaking.remove(first))
+
+    def tearDown(self):
+        for user_id in self.used_user_ids:
+            matchmaking.remove(user_id)
+        self.used_user_ids.clear()
+
+
+class TestMatchmakingStress(unittest.TestCase):
+    USERS_CNT = 400
+    WORKERS_CNT = 8
+
+    @classmethod
+    def setUpClass(cls):
+        rom.util.set_connection_settings(db=TestingConfig.REDIS_DB_ID)
+
+    def setUp(self):
+        self.base_id = randint(10 ** 6, 10 ** 9)
+        self.seconds = randint(10 ** 6, 10 ** 9)
+        self.user_ids = [self.base_id + i for i in range(self.USERS_CNT)]
+        rng = Random(self.base_id)
+        self.ratings = {
+            user_id: rng.randint(1000, 2000) for user_id in self.user_ids
+        }
+        self.pairs_key = f"stress:{self.base_id}:pairs"
+
+    def get_seconds(self, user_id: int) -> int:
+        # Two time controls
+        return self.seconds + user_id % 2
+
+    def hammer(self) -> None:
+        '''Searches every user once (the first worker to get to him wins)
+           and cancels random users meanwhile.'''
+        rom.util.set_connection_settings(db=TestingConfig.REDIS_DB_ID)
+        conn = rom.util.get_connection()
+
+        user_ids = self.user_ids.copy()
+        shuffle(user_ids)
+        for user_id in user_ids:
+            if random() < 0.3:
+                matchmaking.remove(choice(self.user_ids))
+
+            if not conn.set(f"stress:{self.base_id}:{user_id}", 1, nx=True):
+                continue
+            seconds = self.get_seconds(user_id)
+            opponent_id = matchmaking.search(
+                user_id, self.ratings[user_id], seconds
+            )
+            if opponent_id is not None:
+                conn.rpush(self.pairs_key, f"{user_id}:{opponent_id}")
+
+    def test_concurrent_search_and_cancel(self):
+        workers = [
+            Process(target=self.hammer) for _ in range(self.WORKERS_CNT)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+            self.assertEqual(worker.exitcode, 0)
+
+        conn = rom.util.get_connection()
+        pairs = [
+            tuple(map(int, pair.split(b':')))
+            for pair in conn.lrange(self.pairs_key, 0, -1)
+        ]
+        self.assertTrue(pairs)
+
+        paired = [user_id for pair in pairs for user_id in pair]
+        # Nobody is paired twice
+        self.assertEqual(len(paired), len(set(paired)))
+
+        for user_id, opponent_id in pairs:
+            self.assertEqual(self.get_seconds(user_id),
+                             self.get_seconds(opponent_id))
+            self.assertLessEqual(
+                abs(self.ratings[user_id] - self.ratings[opponent_id]),
+                matchmaking.MAX_RATING_WINDOW
+            )
+
+        seekers = conn.hmget(matchmaking.SEEKERS_KEY, self.user_ids)
+        for user_id, seeker in zip(self.user_ids, seekers):
+            seconds = self.get_seconds(user_id)
+            rating = conn.zscore(matchmaking.POOL_KEY.format(seconds),
+                                 user_id)
+            if user_id in paired:
+                self.assertIsNone(seeker)
+                self.assertIsNone(rating)
+            elif seeker is None:
+                # Cancelled
+                self.assertIsNone(rating)
+            else:
+                self.assertEqual(int(seeker.split(b':')[0]), seconds)
+                self.assertEqual(rating, self.ratings[user_id])
+
+        # Seekers, who arrived at the same time, found each other
+        for seconds in {self.get_seconds(user_id)
+                        for user_id in self.user_ids}:
+            pool = conn.zrange(matchmaking.POOL_KEY.format(seconds), 0, -1,
+                               withscores=True)
+            for (_, rating), (_, next_rating) in zip(pool, pool[1:]):
+                self.assertGreater(next_rating - rating,
+                                   matchmaking.RATING_WINDOW)
+
+    def search_in_lockstep(self, user_ids: list, barrier: Barrier) -> None:
+        '''Searches the users, one per round, in a unique time control'''
+        rom.util.set_connection_settings(db=TestingConfig.REDIS_DB_ID)
+        for i, user_id in enumerate(user_ids):
+            barrier.wait()
+            matchmaking.search(user_id, 1500, self.seconds + i)
+
+    def test_simultaneous_searches(self):
+        rounds = self.USERS_CNT // 2
+        barrier = Barrier(2)
+        workers = [
+            Process(target=self.search_in_lockstep,
+                    args=(self.user_ids[i::2], barrier))
+            for i in range(2)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+            self.assertEqual(worker.exitcode, 0)
+
+        # Both users of every round are paired
+        conn = rom.util.get_connection()
+        for i in range(rounds):
+            self.assertEqual(
+                conn.zcard(matchmaking.POOL_KEY.format(self.seconds + i)), 0
+            )
+        self.assertEqual(conn.hmget(matchmaking.SEEKERS_KEY, self.user_ids),
+                         [None] * self.USERS_CNT)
+
+    def tearDown(self):
+        conn = rom.util.get_connection()
+        for user_id in self.user_ids:
+            matchmaking.remove(user_id)
+            conn.delete(f"stress:{self.base_id}:{user_id}")
+        conn.delete(self.pairs_key)
+
+
+if __name__ == "__main__":
+    unittest.main()
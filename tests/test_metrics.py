@@ -0,0 +1,93 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from time import time
+from types import SimpleNamespace
+import rom.util
+from prometheus_client import REGISTRY
+from hydraChess import metrics
+from hydraChess.matchmaking import SEEKERS_KEY
+from hydraChess.config import TestingConfig
+
+
+class TestMetrics(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rom.util.set_connection_settings(db=TestingConfig.REDIS_DB_ID)
+
+    def setUp(self):
+        self.conn = rom.util.get_connection()
+        self.conn.delete(metrics.LIVE_GAMES_KEY, SEEKERS_KEY, 'test_queue')
+
+    def get_sample(self, name: str, labels=None) -> float:
+        return REGISTRY.get_sample_value(name, labels or {}) or 0
+
+    def test_observe_task(self):
+        task = SimpleNamespace(name='test_task',
+                               request=SimpleNamespace(sent_at=time() - 1))
+        labels = {'task': 'test_task'}
+        run_count = self.get_sample('hydrachess_task_run_seconds_count',
+                                    labels)
+        wait_sum = self.get_sample('hydrachess_task_queue_wait_seconds_sum',
+                                   labels)
+
+        with metrics.observe_task(task):
+            pass
+        self.assertEqual(
+            self.get_sample('hydrachess_task_run_seconds_count', labels),
+            run_count + 1
+        )
+        self.assertGreaterEqual(
+            self.get_sample('hydrachess_task_queue_wait_seconds_sum', labels),
+            wait_sum + 1
+        )
+
+        # Eager tasks weren't sent
+        wait_count = self.get_sample(
+            'hydrachess_task_queue_wait_seconds_count', labels
+        )
+        task.request = SimpleNamespace()
+        with metrics.observe_task(task):
+            pass
+        self.assertEqual(
+            self.get_sample('hydrachess_task_queue_wait_seconds_count',
+                            labels),
+            wait_count
+        )
+
+    def test_web_collector(self):
+        metrics.game_started(1)
+        metrics.game_started(2)
+        metrics.game_ended(1)
+        self.conn.hset(SEEKERS_KEY, 5, '60:0')
+        self.conn.rpush('test_queue', 'a', 'b', 'c')
+
+        collector = metrics.WebCollector(TestingConfig.CELERY_BROKER_URL,
+                                         ['test_queue'], lambda: 7)
+        values = {
+            (sample.name, tuple(sample.labels.values())): sample.value
+            for metric in collector.collect() for sample in metric.samples
+        }
+        self.assertEqual(values, {
+            ('hydrachess_live_games', ()): 1,
+            ('hydrachess_seekers', ()): 1,
+            ('hydrachess_connected_sockets', ()): 7,
+            ('hydrachess_queue_depth', ('test_queue', )): 3,
+        })
+
+    def tearDown(self):
+        self.conn.delete(metrics.LIVE_GAMES_KEY, SEEKERS_KEY, 'test_queue')
@@ -17,9 +17,9 @@
 
 import unittest
 from datetime import timedelta
-from chess import Board, WHITE, BLACK
+from chess import Board, Move, WHITE, BLACK
 import rom.util
-from hydraChess.models import User, Game
+from hydraChess.models import User, Game, pack_move, unpack_moves, save_many
 from hydraChess.config import TestingConfig
 
 
@@ -63,7 +63,7 @@ class TestGame(unittest.TestCase):
 
         self.assertEqual(game.moves, moves)
 
-    def test_moves_cnt_and_next_to_move_and_append_move(self):
+    def test_moves_cnt_and_next_to_move_and_push_move(self):
         game = Game()
         game.save()
         self.used_game_ids.append(game.id)
@@ -72,11 +72,12 @@ class TestGame(unittest.TestCase):
 
         next_to_move = WHITE
 
+        board = Board()
         for i in range(len(moves)):
             self.assertEqual(game.get_moves_cnt(), i)
             self.assertEqual(game.get_next_to_move(), next_to_move)
 
-            game.append_move(moves[i])
+            game.push_move(board, moves[i])
             if next_to_move == WHITE:
                 next_to_move = BLACK
             else:
@@ -103,6 +104,139 @@ class TestGame(unittest.TestCase):
 
         self.assertEqual(game.get_board(), expected_board)
 
+    def test_push_move_and_get_board(self):
+        game = Game()
+        game.save()
+        self.used_game_ids.append(game.id)
+
+        # Captures and castling reset the snapshot, knight moves extend it.
+        moves = ['e4', 'd5', 'exd5', 'Nf6', 'Nf3', 'Nxd5', 'Bc4', 'Nb6',
+                 'O-O', 'Nc6', 'Ng5', 'Nd5', 'Nf3', 'Nb6', 'Ng5', 'Nd5',
+                 'Nf3', 'Nb6', 'Ng5', 'Nd5']
+
+        expected_board = Board()
+        board = Board()
+        for move in moves:
+            expected_board.push_san(move)
+            game.push_move(board, move)
+            game.save()
+            game.refresh()
+
+            actual_board = game.get_board()
+            self.assertEqual(actual_board, expected_board)
+            self.assertEqual(actual_board.result(), expected_board.result())
+            self.assertEqual(
+                actual_board.is_repetition(),
+                expected_board.is_repetition()
+            )
+
+        self.assertEqual(game.moves, moves)
+        self.assertEqual(game.get_moves_cnt() - game.root_ply, 11)
+
+    def test_get_board_without_snapshot(self):
+        game = Game()
+        game.save()
+        self.used_game_ids.append(game.id)
+
+        moves = ['e4', 'e5', 'Nf3', 'Nc6']
+
+        expected_board = Board()
+        for move in moves:
+            game.append_move(expected_board.parse_san(move))
+            expected_board.push_san(move)
+
+        game.save()
+        game.refresh()
+
+        self.assertEqual(game.get_board(), expected_board)
+
+    def test_pack_move(self):
+        moves = [Move.from_uci(uci) for uci in
+                 ('e2e4', 'a7a8q', 'h2h1n', 'b7c8r', 'g2f1b', 'e1g1', 'h8a1')]
+        packed_moves = b''.join(map(pack_move, moves))
+
+        self.assertEqual(len(packed_moves), 2 * len(moves))
+        self.assertEqual(list(unpack_moves(packed_moves)), moves)
+
+    def test_moves_are_appended_and_deleted(self):
+        game = Game()
+        game.moves = ['e4', 'e5']
+        game.save()
+
+        game = Game.get(game.id)
+        game.push_move(game.get_board(), 'Nf3')
+        game.save()
+
+        game = Game.get(game.id)
+        self.assertEqual(game.moves, ['e4', 'e5', 'Nf3'])
+        self.assertEqual(game.get_moves_cnt(), 3)
+
+        moves_key = game.moves_key
+        game.delete()
+        self.assertFalse(game._connection.exists(moves_key))
+
+    def test_commit_move(self):
+        game = Game()
+        game.moves = ['e4', 'e5']
+        game.save()
+        self.used_game_ids.append(game.id)
+        rom.util.session.rollback()
+
+        first = Game.get(game.id)
+        rom.util.session.rollback()
+        second = Game.get(game.id)
+        second_board = second.get_board()
+
+        first.push_move(first.get_board(), 'Nf3')
+        first.white_clock = timedelta(seconds=10)
+        first.draw_offer_sender = None
+        self.assertTrue(first.commit_move())
+
+        # The second one was loaded before the first one's move
+        second.push_move(second_board, 'Nc3')
+        self.assertFalse(second.commit_move())
+
+        rom.util.session.rollback()
+        game = Game.get(game.id)
+        self.assertEqual(game.moves, ['e4', 'e5', 'Nf3'])
+        self.assertEqual(game.white_clock, timedelta(seconds=10))
+
+        game.push_move(game.get_board(), 'Nc6')
+        game.is_finished = True
+        game.save()
+        rom.util.session.rollback()
+        game = Game.get(game.id)
+        game.push_move(game.get_board(), 'Bb5')
+        self.assertFalse(game.commit_move())
+
+    def test_get_summaries(self):
+        white_user = User(login='summaries_white')
+        white_user.save()
+        self.used_user_ids.append(white_user.id)
+        black_user = User(login='summaries_black')
+        black_user.save()
+        self.used_user_ids.append(black_user.id)
+
+        game = Game(white_user=white_user, black_user=black_user,
+                    result='1-0')
+        game.moves = ['e4', 'e5', 'Qh5']
+        game.save()
+        self.used_game_ids.append(game.id)
+
+        missing_id = game.id + 10 ** 6
+        self.assertEqual(
+            Game.get_summaries([game.id, missing_id]),
+            [{
+                'id': game.id,
+                'white_user_id': white_user.id,
+                'black_user_id': black_user.id,
+                'white_login': 'summaries_white',
+                'black_login': 'summaries_black',
+                'result': '1-0',
+                'moves_cnt': 3,
+            }, None]
+        )
+
     def tearDown(self):
         for game_id in self.used_game_ids:
             game = Game.get(game_id)
@@ -138,6 +272,53 @@ class TestUser(unittest.TestCase):
             user.refresh()
             self.assertEqual(expected, user.game_ids)
 
+    def test_get_game_ids_page(self):
+        user = User()
+        user.save()
+        self.used_user_ids.append(user.id)
+
+        # Some games are finished at the same moment
+        finish_times = [1.0, 2.0, 2.0, 2.0, 3.0, 4.0, 4.0]
+        for game_id, finished_at in enumerate(finish_times, 8):
+            user.append_game_id(game_id, finished_at)
+        user.save()
+
+        expected = user.game_ids
+        self.assertEqual(sorted(expected), list(range(8, 15)))
+
+        for size in range(1, len(expected) + 1):
+            game_ids = list()
+            cursor = None
+            while True:
+                page, cursor = user.get_game_ids_page(cursor, size)
+                game_ids.extend(page)
+                if cursor is None:
+                    break
+                self.assertEqual(len(page), size)
+            self.assertEqual(game_ids, expected)
+
+        self.assertEqual(user.get_game_ids_page(None, 3, 5),
+                         (expected[5:], None))
+        for cursor in ('abc', 'nan:1', 'inf:1', '-inf:1'):
+            with self.assertRaises(ValueError):
+                user.get_game_ids_page(cursor, 10)
+
+    def test_save_many(self):
+        users = [User(), User()]
+        self.assertEqual(save_many(users), [])
+        self.used_user_ids.extend(user.id for user in users)
+
+        # Another writer updates the first user
+        conn = rom.util.get_connection()
+        conn.hset(users[0]._pk, 'rating', 1700)
+
+        for user in users:
+            user.rating = 1600
+        self.assertEqual(save_many(users), [users[0]])
+
+        self.assertEqual(conn.hget(users[0]._pk, 'rating'), b'1700')
+        self.assertEqual(conn.hget(users[1]._pk, 'rating'), b'1600')
+
     def tearDown(self):
         for user_id in self.used_user_ids:
             user = User.get(user_id)
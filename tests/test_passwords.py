@@ -0,0 +1,46 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import gevent
+from hydraChess import passwords
+
+
+class TestPasswords(unittest.TestCase):
+    def check(self):
+        hashed_password = passwords.generate_hash('password')
+        self.assertTrue(passwords.check_hash(hashed_password, 'password'))
+        self.assertFalse(passwords.check_hash(hashed_password, 'passw0rd'))
+
+    def test_pool(self):
+        passwords.configure(2)
+        self.check()
+
+    def test_in_caller(self):
+        passwords.configure(0)
+        self.check()
+
+    def test_concurrent_hashes(self):
+        passwords.configure(2)
+        greenlets = [gevent.spawn(passwords.generate_hash, f'password{i}')
+                     for i in range(4)]
+        gevent.joinall(greenlets, raise_error=True)
+        for i, greenlet in enumerate(greenlets):
+            self.assertTrue(passwords.check_hash(greenlet.value,
+                                                 f'password{i}'))
+
+    def tearDown(self):
+        passwords.configure(passwords.THREADS)
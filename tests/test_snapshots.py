@@ -0,0 +1,118 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from datetime import datetime, timedelta
+import rom.util
+from hydraChess import snapshots
+from hydraChess.models import User, Game
+from hydraChess.config import TestingConfig
+
+
+class TestSnapshots(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rom.util.set_connection_settings(db=TestingConfig.REDIS_DB_ID)
+
+    def setUp(self):
+        self.white_user = User(login='snapshot_w')
+        self.white_user.save()
+        self.black_user = User(login='snapshot_b')
+        self.black_user.save()
+        self.game = Game(white_user=self.white_user,
+                         black_user=self.black_user,
+                         white_rating=1200, black_rating=1300)
+        self.game.white_clock = self.game.black_clock = timedelta(minutes=5)
+        self.game.save()
+        self.board = self.game.get_board()
+        self.now = datetime.utcnow()
+
+    def make_move(self, move_san: str) -> None:
+        self.game.push_move(self.board, move_san)
+        self.game.last_move_datetime = self.now
+        self.assertTrue(self.game.commit_move())
+        snapshots.push_move(self.game, move_san)
+
+    def test_game_info(self):
+        self.assertIsNone(snapshots.get(self.game.id))
+        snapshots.get_or_save(self.game.id)
+        self.make_move('e4')
+        self.make_move('e5')
+        self.make_move('Nf3')
+
+        snapshot = snapshots.get(self.game.id)
+        self.assertEqual(snapshots.get_players(snapshot)['black_user_id'],
+                         self.black_user.id)
+        game_info = snapshots.get_game_info(
+            snapshot, self.now + timedelta(seconds=10)
+        )
+        self.assertEqual(game_info, {
+            'black_user': {'nickname': 'snapshot_b', 'rating': 1300},
+            'white_user': {'nickname': 'snapshot_w', 'rating': 1200},
+            'moves': 'e4,e5,Nf3',
+            'is_player': False,
+            'role': 'spectator',
+            'black_clock': 290,  # Black is to move
+            'white_clock': 300,
+        })
+
+    def test_moves_since_ply(self):
+        for move_san in ('e4', 'e5', 'Nf3'):
+            self.make_move(move_san)
+        snapshot = snapshots.get_or_save(self.game.id)
+
+        game_info = snapshots.get_game_info(snapshot, self.now, 2)
+        self.assertEqual((game_info['moves'], game_info['ply']), ('Nf3', 2))
+        game_info = snapshots.get_game_info(snapshot, self.now, 3)
+        self.assertEqual((game_info['moves'], game_info['ply']), ('', 3))
+
+        # The client knows nothing or more than the server
+        for ply in (None, 0, 4):
+            game_info = snapshots.get_game_info(snapshot, self.now, ply)
+            self.assertEqual(game_info['moves'], 'e4,e5,Nf3')
+            self.assertNotIn('ply', game_info)
+
+    def test_snapshot_with_missing_move_is_made_again(self):
+        self.make_move('e4')
+        snapshots.save(self.game)
+        self.game.push_move(self.board, 'e5')
+        self.assertTrue(self.game.commit_move())
+        self.make_move('Nf3')  # The snapshot missed e5
+        self.assertIsNone(snapshots.get(self.game.id))
+
+        snapshot = snapshots.get_or_save(self.game.id)
+        self.assertEqual(snapshot['moves'], 'e4,e5,Nf3')
+
+    def test_finished_game(self):
+        self.make_move('e4')
+        self.game.is_finished = True
+        self.game.result = '1-0'
+        self.game.save()
+        snapshots.save(self.game)
+
+        game_info = snapshots.get_game_info(snapshots.get(self.game.id),
+                                            self.now)
+        self.assertEqual(game_info['result'], '1-0')
+        self.assertNotIn('white_clock', game_info)
+        key = snapshots.snapshot_key(self.game.id)
+        self.assertLessEqual(rom.util.get_connection().ttl(key),
+                             snapshots.FINISHED_GAME_TTL)
+
+    def tearDown(self):
+        rom.util.get_connection().delete(snapshots.snapshot_key(self.game.id))
+        self.game.delete()
+        self.white_user.delete()
+        self.black_user.delete()
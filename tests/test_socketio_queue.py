@@ -0,0 +1,155 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import pickle
+import unittest
+from unittest import mock
+import redis
+import socketio
+from hydraChess.socketio_queue import BatchingRedisManager, RoleManager,\
+    PLAYERS_ONLY, players_room
+from hydraChess.config import TestingConfig
+
+
+class TestBatchingRedisManager(unittest.TestCase):
+    CHANNEL = 'test-socketio'
+
+    def setUp(self):
+        self.manager = BatchingRedisManager(TestingConfig.SOCKET_IO_URL,
+                                            channel=self.CHANNEL,
+                                            write_only=True)
+        self.pubsub = redis.Redis.from_url(
+            TestingConfig.SOCKET_IO_URL
+        ).pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(self.CHANNEL)
+        self.pubsub.get_message(timeout=1)
+
+    def get_messages(self):
+        messages = list()
+        while True:
+            message = self.pubsub.get_message(timeout=0.1)
+            if message is None:
+                return messages
+            messages.append(pickle.loads(message['data']))
+
+    def test_emits_are_published_at_once(self):
+        with self.manager.batch():
+            self.manager.emit('game_updated', {'san': 'e4'}, room=1)
+            with self.manager.batch():
+                self.manager.emit('first_move_waiting', None, room='sid')
+            self.assertEqual(self.get_messages(), [])
+
+        messages = self.get_messages()
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(
+            [(emit['event'], emit['room']) for emit in messages[0]['batch']],
+            [('game_updated', 1), ('first_move_waiting', 'sid')]
+        )
+
+    def test_single_emit_is_not_batched(self):
+        with self.manager.batch():
+            self.manager.emit('game_updated', {'san': 'e4'}, room=1)
+        self.manager.emit('game_ended', {'result': '1-0'}, room=1)
+
+        messages = self.get_messages()
+        self.assertEqual([message['event'] for message in messages],
+                         ['game_updated', 'game_ended'])
+
+    def test_order_is_kept(self):
+        with self.manager.batch():
+            self.manager.emit('game_ended', {'result': '1-0'}, room=1)
+            self.manager.close_room(1)
+
+        messages = self.get_messages()
+        self.assertEqual([message['method'] for message in messages],
+                         ['emit', 'close_room'])
+
+    def test_flush(self):
+        with self.manager.batch():
+            self.manager.emit('game_updated', {'san': 'e4'}, room=1)
+            # Before sending a task, which emits game_ended
+            self.manager.flush()
+            self.assertEqual(
+                [message['event'] for message in self.get_messages()],
+                ['game_updated']
+            )
+            self.manager.flush()
+            self.manager.emit('first_move_waiting', None, room='sid')
+
+        self.assertEqual([message['event'] for message in self.get_messages()],
+                         ['first_move_waiting'])
+
+    def test_batch_is_emitted_in_order(self):
+        with self.manager.batch():
+            self.manager.emit('game_updated', {'san': 'e4'}, room=1)
+            self.manager.emit('game_ended', {'result': '1-0'}, room=1)
+        batch = self.get_messages()[0]
+
+        with mock.patch.object(socketio.base_manager.BaseManager,
+                               'emit') as emit:
+            self.manager._handle_emit(batch)
+        self.assertEqual([call.args[:2] for call in emit.call_args_list],
+                         [('game_updated', {'san': 'e4'}),
+                          ('game_ended', {'result': '1-0'})])
+
+    def tearDown(self):
+        self.pubsub.close()
+
+
+class TestRoleManager(unittest.TestCase):
+    def setUp(self):
+        self.server = mock.Mock()
+        self.manager = RoleManager()
+        self.manager.set_server(self.server)
+        for sid in ('white', 'black', 'spectator', 'other'):
+            self.manager.connect(sid, '/')
+        for sid in ('white', 'black', 'spectator'):
+            self.manager.enter_room(sid, '/', 1)
+        for sid in ('white', 'black'):
+            self.manager.enter_room(sid, '/', players_room(1))
+
+    def get_emits(self):
+        return {call.args[0]: call.args[2]
+                for call in self.server._emit_internal.call_args_list}
+
+    def test_players_only_fields(self):
+        self.manager.emit('game_ended', {
+            'result': '1-0',
+            PLAYERS_ONLY: {'rating_deltas': {'w': 10, 'b': -10}},
+        }, '/', room=1)
+
+        players_data = {'result': '1-0', 'rating_deltas': {'w': 10, 'b': -10}}
+        self.assertEqual(self.get_emits(), {
+            'white': players_data,
+            'black': players_data,
+            'spectator': {'result': '1-0'},
+        })
+
+    def test_without_players(self):
+        self.manager.leave_room('white', '/', players_room(1))
+        self.manager.leave_room('black', '/', players_room(1))
+        self.manager.emit('game_ended', {
+            'result': '1-0', PLAYERS_ONLY: {'rating_deltas': {}},
+        }, '/', room=1, skip_sid='spectator')
+
+        self.assertEqual(self.get_emits(), {'white': {'result': '1-0'},
+                                            'black': {'result': '1-0'}})
+
+    def test_other_emits(self):
+        self.manager.emit('game_updated', {'san': 'e4'}, '/', room=1)
+        self.assertEqual(self.get_emits(), {sid: {'san': 'e4'}
+                                            for sid in ('white', 'black',
+                                                        'spectator')})
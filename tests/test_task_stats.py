@@ -0,0 +1,79 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from time import time
+from types import SimpleNamespace
+import rom.util
+from hydraChess import task_stats
+from hydraChess.config import TestingConfig
+
+
+class TestTaskStats(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rom.util.set_connection_settings(db=TestingConfig.REDIS_DB_ID)
+
+    def setUp(self):
+        task_stats.delete_stats()
+
+    def test_get_bucket(self):
+        self.assertEqual(task_stats.get_bucket(0), 1)
+        self.assertEqual(task_stats.get_bucket(0.000123), 123)
+        self.assertEqual(task_stats.get_bucket(0.0123456), 12300)
+        self.assertEqual(task_stats.get_bucket(1.23456), 1230000)
+
+    def test_signals(self):
+        task = SimpleNamespace(name='make_move', request=SimpleNamespace(
+            sent_at=time() - 1
+        ))
+        for task_id, state in (('a', 'SUCCESS'), ('b', 'FAILURE')):
+            task_stats.on_task_prerun(task_id=task_id, task=task)
+            task_stats.on_task_postrun(task_id=task_id, task=task,
+                                       state=state)
+
+        # Eager tasks have no sent_at
+        eager_task = SimpleNamespace(name='end_game',
+                                     request=SimpleNamespace())
+        task_stats.on_task_prerun(task_id='c', task=eager_task)
+        task_stats.on_task_postrun(task_id='c', task=eager_task,
+                                   state='SUCCESS')
+
+        stats = task_stats.get_stats(time() - 60, time())
+        self.assertEqual(stats['make_move']['count'], 2)
+        self.assertEqual(stats['make_move']['errors'], 1)
+        self.assertGreaterEqual(task_stats.get_percentile(
+            stats['make_move']['queue_wait'], 50), 0.99)
+        self.assertEqual(sum(stats['make_move']['lifetime'].values()), 2)
+        self.assertEqual(stats['end_game']['count'], 1)
+        self.assertEqual(stats['end_game']['queue_wait'], {})
+        self.assertEqual(sum(stats['end_game']['run_time'].values()), 1)
+
+        self.assertEqual(list(task_stats.get_stats(time() - 60, time(),
+                                                   ['end_game'])),
+                         ['end_game'])
+        self.assertEqual(task_stats.get_stats(time() - 3600,
+                                              time() - 1800), {})
+
+    def test_get_percentile(self):
+        histogram = {1000: 50, 2000: 40, 100000: 10}
+        self.assertEqual(task_stats.get_percentile(histogram, 50), 0.001)
+        self.assertEqual(task_stats.get_percentile(histogram, 90), 0.002)
+        self.assertEqual(task_stats.get_percentile(histogram, 99), 0.1)
+        self.assertEqual(task_stats.get_percentile({}, 50), 0.0)
+
+    def tearDown(self):
+        task_stats.delete_stats()
@@ -0,0 +1,149 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+from datetime import datetime, timedelta
+from uuid import uuid4
+import rom.util
+from hydraChess import timers
+from hydraChess.config import TestingConfig
+
+
+class TestTimers(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rom.util.set_connection_settings(db=TestingConfig.REDIS_DB_ID)
+
+    def setUp(self):
+        self.used_names = list()
+
+    def gen_name(self) -> str:
+        name = uuid4().hex
+        self.used_names.append(name)
+        return name
+
+    def pop_expired(self) -> list:
+        return [task[1:] for task in timers.pop_expired(10 ** 6)
+                if task[0] in self.used_names]
+
+    def test_expired_timers_are_popped_once(self):
+        now = datetime.utcnow()
+        expired_name = self.gen_name()
+        pending_name = self.gen_name()
+
+        timers.arm(expired_name, now - timedelta(seconds=1),
+                   'on_time_is_up', (expired_name, 1))
+        timers.arm(pending_name, now + timedelta(minutes=1),
+                   'on_time_is_up', (pending_name, 1))
+
+        self.assertEqual(self.pop_expired(),
+                         [('on_time_is_up', [expired_name, 1])])
+        self.assertEqual(self.pop_expired(), [])
+
+    def test_arm_again(self):
+        now = datetime.utcnow()
+        name = self.gen_name()
+
+        timers.arm(name, now + timedelta(minutes=1),
+                   'on_time_is_up', (name, 1))
+        timers.arm(name, now - timedelta(seconds=1),
+                   'on_time_is_up', (name, 2))
+
+        self.assertEqual(self.pop_expired(), [('on_time_is_up', [name, 2])])
+
+    def test_cancel(self):
+        now = datetime.utcnow()
+        names = [self.gen_name() for _ in range(3)]
+        for name in names:
+            timers.arm(name, now - timedelta(seconds=1),
+                       'on_first_move_timed_out', (name, ))
+
+        timers.cancel(*names[:2])
+
+        self.assertEqual(self.pop_expired(),
+                         [('on_first_move_timed_out', [names[2]])])
+
+    def test_failed_send(self):
+        now = datetime.utcnow()
+        names = [self.gen_name() for _ in range(3)]
+        for name in names:
+            timers.arm(name, now - timedelta(seconds=1),
+                       'on_time_is_up', (name, ))
+        sent = list()
+
+        class Celery:
+            def send_task(self, task_name: str, args: list) -> None:
+                if len(sent) == 1:
+                    raise ConnectionError("The broker is down")
+                sent.append(args[0])
+
+        with self.assertRaises(ConnectionError):
+            timers.send_expired(Celery())
+
+        # Tasks, which weren't sent, are expired again
+        self.assertEqual(
+            sorted(task[1][0] for task in self.pop_expired()),
+            sorted(name for name in names if name not in sent)
+        )
+
+    def test_ack_keeps_armed_again(self):
+        now = datetime.utcnow()
+        name = self.gen_name()
+        timers.arm(name, now - timedelta(seconds=1),
+                   'on_time_is_up', (name, 1))
+        self.assertEqual(len(self.pop_expired()), 1)
+
+        timers.arm(name, now - timedelta(seconds=1),
+                   'on_time_is_up', (name, 2))
+        timers.ack([name])
+        self.assertEqual(self.pop_expired(), [('on_time_is_up', [name, 2])])
+
+    def test_arm_popped(self):
+        now = datetime.utcnow()
+        name = self.gen_name()
+        timers.arm(name, now - timedelta(seconds=1),
+                   'on_time_is_up', (name, 1))
+        self.assertEqual(len(self.pop_expired()), 1)
+
+        # The sender crashes, the timer is armed again meanwhile
+        timers.arm(name, now + timedelta(minutes=1),
+                   'on_time_is_up', (name, 2))
+        sending_timeout = timers.SENDING_TIMEOUT
+        timers.SENDING_TIMEOUT = 0
+        try:
+            self.assertEqual(self.pop_expired(), [])
+        finally:
+            timers.SENDING_TIMEOUT = sending_timeout
+
+    def test_cancel_popped(self):
+        now = datetime.utcnow()
+        name = self.gen_name()
+        timers.arm(name, now - timedelta(seconds=1),
+                   'on_time_is_up', (name, ))
+        self.assertEqual(len(self.pop_expired()), 1)
+
+        timers.cancel(name)
+        timers.release([name])
+        self.assertEqual(self.pop_expired(), [])
+
+    def tearDown(self):
+        timers.cancel(*self.used_names)
+        self.used_names.clear()
+
+
+if __name__ == "__main__":
+    unittest.main()
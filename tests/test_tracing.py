@@ -0,0 +1,73 @@
+# This file is part of the hydraChess project.
+# Copyright (C) 2019-2020 Anton Dobrynin <hashlib@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from time import time
+from types import SimpleNamespace
+import rom.util
+from hydraChess import tracing
+from hydraChess.config import TestingConfig
+
+
+class TestTracing(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rom.util.set_connection_settings(db=TestingConfig.REDIS_DB_ID)
+
+    def setUp(self):
+        rom.util.get_connection().delete(tracing.TRACES_KEY)
+
+    def test_trace(self):
+        headers = dict()
+        with tracing.trace('abc', 'on_make_move'):
+            with tracing.span('publish'):
+                tracing.propagate_trace_id(headers=headers)
+            # Nested traces are a part of the outer one
+            with tracing.trace('def', 'make_move'):
+                with tracing.span('commit'):
+                    pass
+        self.assertEqual(headers, {'trace_id': 'abc'})
+
+        # The task gets the trace id from the headers
+        task = SimpleNamespace(name='make_move', request=SimpleNamespace(
+            trace_id='abc', sent_at=time() - 1
+        ))
+        with tracing.trace_task(task):
+            pass
+
+        traces = tracing.get_traces()
+        self.assertEqual(list(traces), ['abc'])
+        records = traces['abc']
+        self.assertEqual([record['name'] for record in records],
+                         ['on_make_move', 'make_move'])
+        self.assertEqual([span['name'] for span in records[0]['spans']],
+                         ['publish', 'commit'])
+        self.assertEqual(records[1]['spans'][0]['name'], 'queue_wait')
+        self.assertGreaterEqual(records[1]['spans'][0]['duration'], 1)
+
+        stats = tracing.get_span_stats(traces)
+        self.assertEqual(stats['make_move.queue_wait']['count'], 1)
+
+    def test_not_sampled(self):
+        headers = dict()
+        with tracing.trace(tracing.sample(0), 'on_make_move'):
+            with tracing.span('publish'):
+                tracing.propagate_trace_id(headers=headers)
+        self.assertEqual(headers, {})
+        self.assertEqual(tracing.get_traces(), {})
+
+    def tearDown(self):
+        rom.util.get_connection().delete(tracing.TRACES_KEY)